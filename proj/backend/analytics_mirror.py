@@ -0,0 +1,250 @@
+# Embedded analytical mirror of products, orders and expiry.
+# Aggregations and joins from NL2SQL (e.g. "what is the most popular product based on orders?") run on a local
+# DuckDB file (columnar, vectorised) instead of the MySQL primary. SQLite is used when duckdb is not installed.
+#
+# The mirror is kept in sync from a read replica (or the primary) by:
+#   - incremental snapshots, copying rows with an id above the highest one already mirrored,
+#   - the DatabaseManager write listener, queueing this process's inserts / updates / deletes, which a background
+#     thread applies (so a writer never waits for a sync),
+#   - a full resync periodically, and of one store's table after writes to it flagged by other processes (the
+#     per store and table dirty markers, see report_snapshots.py), as MySQL has no row versions to pick up updates
+#     made elsewhere. Those resyncs read the primary, a lagging replica may not have the flagged write yet.
+# Every store is mirrored (each synced from its own database host), NL2SQL scopes its queries to one store.
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import Date, Integer, Numeric, select
+
+from proj.backend.database_orm import DatabaseManager
+from proj.backend.model_schema import Product, Order, ProductExpiry
+from proj.backend.report_snapshots import dirty_since
+from proj.backend.tenancy import store_ids, tenant
+
+try:
+	import duckdb
+except ImportError:  # duckdb is optional, sqlite3 is always available.
+	duckdb = None
+
+logger = logging.getLogger(__name__)
+
+ANALYTICS_MIRROR_PATH = os.getenv(
+	"ANALYTICS_MIRROR_PATH",
+	os.path.join(os.path.dirname(os.path.abspath(__file__)), "analytics_mirror", "mirror.duckdb" if duckdb else "mirror.sqlite")
+)
+ANALYTICS_SYNC_S = float(os.getenv("ANALYTICS_SYNC_S", "30"))
+ANALYTICS_FULL_SYNC_S = float(os.getenv("ANALYTICS_FULL_SYNC_S", "3600"))
+ANALYTICS_SYNC_CHUNK = 5000
+
+# Mirrored tables, with the same names and columns as in MySQL so the NL2SQL schema still applies.
+MIRROR_MODELS = {"products": Product, "orders": Order, "expiry": ProductExpiry}
+
+
+def _column_type(column, dialect: str) -> str:
+	if isinstance(column.type, Integer):
+		return "INTEGER"
+	if isinstance(column.type, Date):
+		return "DATE"
+	if isinstance(column.type, Numeric):
+		return f"DECIMAL({column.type.precision}, {column.type.scale})" if dialect == "duckdb" else "REAL"
+	return "VARCHAR" if dialect == "duckdb" else "TEXT"
+
+
+class AnalyticsMirror:
+	"""Local copy of the OLTP tables for analytical SELECTs, see the module docstring for how it is synced."""
+
+	def __init__(self, path: str = ANALYTICS_MIRROR_PATH, db: DatabaseManager = None):
+		self.path = path
+		self.db = db or DatabaseManager()
+		self.dialect = "duckdb" if duckdb else "sqlite"
+		os.makedirs(os.path.dirname(path), exist_ok=True)
+		if duckdb:
+			self._conn = duckdb.connect(path)
+		else:
+			# Autocommit, transactions are opened explicitly around the syncs.
+			self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+		self._lock = threading.Lock()
+		self._columns = {table: [column.name for column in model.__table__.columns] for table, model in MIRROR_MODELS.items()}
+		self._keys = {table: model.__table__.primary_key.columns.keys()[0] for table, model in MIRROR_MODELS.items()}
+		self.last_sync = 0.0
+		self.last_full_sync = 0.0
+		# (store, table) -> start time of its last full copy from the primary, writes flagged before it are mirrored.
+		self.table_synced_at: Dict[Tuple[int, str], float] = {}
+		# (action, table, key or row) of this process's writes, applied by apply_writes.
+		self._writes: deque = deque()
+		self._writes_ready = threading.Event()
+		self._create_tables()
+
+	@property
+	def ready(self) -> bool:
+		"""Whether a full sync has completed, before that the mirror may be empty."""
+		return self.last_full_sync > 0
+
+	def _create_tables(self):
+		with self._lock:
+			for table, model in MIRROR_MODELS.items():
+				if self._table_exists(table):
+					existing = [column[0] for column in self._conn.execute(f"SELECT * FROM {table} LIMIT 0").description]
+					if existing != self._columns[table]:
+						# The models changed (e.g. store_id was added), the mirror is only a copy, so start over.
+						self._conn.execute(f"DROP TABLE {table}")
+				columns = ", ".join(
+					f"{column.name} {_column_type(column, self.dialect)}{' PRIMARY KEY' if column.primary_key else ''}"
+					for column in model.__table__.columns
+				)
+				self._conn.execute(f"CREATE TABLE IF NOT EXISTS {table} ({columns})")
+				self._conn.execute(f"CREATE INDEX IF NOT EXISTS ix_{table}_store ON {table} (store_id)")
+
+	def _table_exists(self, table: str) -> bool:
+		if self.dialect == "duckdb":
+			return bool(self._conn.execute("SELECT 1 FROM information_schema.tables WHERE table_name = ?", [table]).fetchone())
+		return bool(self._conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", [table]).fetchone())
+
+	def _value(self, value: Any) -> Any:
+		# sqlite3 binds neither Decimal nor (without deprecated adapters) dates.
+		if self.dialect == "sqlite":
+			if isinstance(value, Decimal):
+				return float(value)
+			if isinstance(value, (date, datetime)):
+				return value.isoformat()
+		return value
+
+	def _upsert(self, table: str, rows: List[tuple]):
+		if not rows:
+			return
+		columns = self._columns[table]
+		statement = f"INSERT OR REPLACE INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)})"
+		self._conn.executemany(statement, [tuple(self._value(value) for value in row) for row in rows])
+
+	def _max_key(self, table: str, store_id: int) -> int:
+		return self._conn.execute(f"SELECT MAX({self._keys[table]}) FROM {table} WHERE store_id = ?", [store_id]).fetchone()[0] or 0
+
+	def sync(self, full: bool = False, resync: Iterable[Tuple[int, str]] = ()) -> Dict[str, int]:
+		"""
+		Copy new rows (or, with full, every row) of every store from the read replica, and every row of the
+		(store, table) pairs in resync from the primary. Returns the rows copied per table.
+		"""
+		copied = {table: 0 for table in MIRROR_MODELS}
+		resync = set(resync)
+		# Taken before reading, so a write flagged while a table is copied gets it copied again.
+		started = time.time()
+		for store_id in store_ids():
+			full_tables = {table for table in MIRROR_MODELS if full or (store_id, table) in resync}
+			use_replica = not any((store_id, table) in resync for table in MIRROR_MODELS)
+			with tenant(store_id), self.db.session(readonly=True, use_replica=use_replica) as session, self._lock:
+				for table, model in MIRROR_MODELS.items():
+					key_column = model.__table__.c[self._keys[table]]
+					query = select(*model.__table__.columns).where(model.__table__.c.store_id == store_id).order_by(key_column)
+					if table not in full_tables:
+						query = query.where(key_column > self._max_key(table, store_id))
+
+					self._conn.execute("BEGIN TRANSACTION")
+					try:
+						if table in full_tables:
+							self._conn.execute(f"DELETE FROM {table} WHERE store_id = ?", [store_id])
+						result = session.execute(query.execution_options(stream_results=True, yield_per=ANALYTICS_SYNC_CHUNK))
+						for rows in result.partitions(ANALYTICS_SYNC_CHUNK):
+							self._upsert(table, [tuple(row) for row in rows])
+							copied[table] += len(rows)
+						self._conn.execute("COMMIT")
+					except Exception:
+						self._conn.execute("ROLLBACK")
+						raise
+					if (store_id, table) in resync:
+						# Only a copy from the primary is known to include the flagged writes.
+						self.table_synced_at[(store_id, table)] = started
+
+		self.last_sync = time.time()
+		if full:
+			self.last_full_sync = started
+		logger.info(f"Analytics mirror {'full' if full else 'incremental'} sync copied {copied}, resynced {sorted(resync)}")
+		return copied
+
+	def dirty_tables(self) -> Set[Tuple[int, str]]:
+		"""(store, table) pairs written to since their last full copy from the primary."""
+		return {
+			(store_id, table) for store_id in store_ids() for table in MIRROR_MODELS
+			if dirty_since(table, store_id) > self.table_synced_at.get((store_id, table), 0.0)
+		}
+
+	def on_write(self, action: str, entity: object):
+		"""DatabaseManager write listener, queues this process's writes for apply_writes (runs in the writer's thread)."""
+		table = getattr(entity, "__tablename__", None)
+		if table not in MIRROR_MODELS:
+			return
+		if action == "delete":
+			self._writes.append((action, table, getattr(entity, self._keys[table])))
+		else:
+			self._writes.append((action, table, tuple(getattr(entity, column) for column in self._columns[table])))
+		self._writes_ready.set()
+
+	def apply_writes(self):
+		"""Apply the queued writes to the mirror as they come (blocking, run in a background thread)."""
+		while True:
+			self._writes_ready.wait()
+			self._writes_ready.clear()
+			while self._writes:
+				action, table, value = self._writes.popleft()
+				try:
+					with self._lock:
+						if action == "delete":
+							self._conn.execute(f"DELETE FROM {table} WHERE {self._keys[table]} = ?", [value])
+						else:
+							self._upsert(table, [value])
+				except Exception as e:
+					logger.error(f"Analytics mirror failed to apply {action} on {table}: {str(e)}")
+
+	def query(self, statement: str, max_rows: int) -> Tuple[List[str], List[tuple], bool]:
+		"""Run a read query, returns the column names, at most max_rows rows and whether there were more."""
+		if self.dialect == "duckdb":
+			# A cursor is a separate connection to the same database, so readers run in parallel.
+			cursor = self._conn.cursor()
+			try:
+				cursor.execute(statement)
+				rows = cursor.fetchmany(max_rows + 1)
+				return [column[0] for column in cursor.description], rows[:max_rows], len(rows) > max_rows
+			finally:
+				cursor.close()
+		with self._lock:
+			cursor = self._conn.execute(statement)
+			rows = cursor.fetchmany(max_rows + 1)
+			return [column[0] for column in cursor.description or []], rows[:max_rows], len(rows) > max_rows
+
+
+class MirrorSyncer(threading.Thread):
+	"""Incremental sync every ANALYTICS_SYNC_S, full resync every ANALYTICS_FULL_SYNC_S, flagged tables resynced."""
+
+	def __init__(self, mirror: AnalyticsMirror):
+		super().__init__(name="analytics-mirror-sync", daemon=True)
+		self.mirror = mirror
+
+	def run(self):
+		while True:
+			try:
+				full = not self.mirror.ready or time.time() - self.mirror.last_full_sync >= ANALYTICS_FULL_SYNC_S
+				self.mirror.sync(full=full, resync=self.mirror.dirty_tables())
+			except Exception as e:
+				logger.error(f"Analytics mirror sync failed: {str(e)}")
+			time.sleep(ANALYTICS_SYNC_S)
+
+
+_mirror: Optional[AnalyticsMirror] = None
+_mirror_lock = threading.Lock()
+
+
+def get_analytics_mirror() -> AnalyticsMirror:
+	"""The process wide mirror, synced in the background and updated by this process's writes."""
+	global _mirror
+	with _mirror_lock:
+		if _mirror is None:
+			_mirror = AnalyticsMirror()
+			_mirror.db.add_write_listener(_mirror.on_write)
+			threading.Thread(target=_mirror.apply_writes, name="analytics-mirror-writes", daemon=True).start()
+			MirrorSyncer(_mirror).start()
+		return _mirror
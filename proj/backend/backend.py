@@ -1,9 +1,20 @@
-from flask import Flask, jsonify
+from flask import Flask, jsonify, request, Response, stream_with_context, send_file
+from werkzeug.utils import safe_join
 from flask_cors import CORS
-from database_orm import DatabaseManager
-from model_schema import Product, Order, ProductExpiry
+from proj.backend.database_orm import DatabaseManager
+from proj.backend.model_schema import Product, Order, ProductExpiry
+from proj.backend.response_layer import json_response, dumps
+from proj.backend.change_feed import ChangeFeed, FEED_TABLES, CHANGE_FEED_TOKEN, claim_feed_process
+from proj.backend.db_metrics import db_metrics
+from proj.backend.report_snapshots import REPORT_NAMES, load_snapshot
+from proj.backend.reports import start_report_scheduler
+from proj.backend.parquet_export import EXPORT_DIR, list_snapshots, load_manifest, start_export_scheduler
+from proj.backend.tenancy import bind_request_tenant, current_store_id, store_ids, validate_store_id, TenantError
+from proj.backend.warmup import Warmup, bind_readiness
 from sqlalchemy import select
+import hmac
 import logging
+import os
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
@@ -11,32 +22,82 @@ logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
+# Every request works on the store in its X-Store-Id header (see tenancy.py), sessions are scoped to it.
+bind_request_tenant(app)
 
 # Initialize database manager
 db = DatabaseManager()
 
+# Writes through the DatabaseManager (and ones forwarded by other processes) are published on the change feed.
+change_feed = ChangeFeed()
+db.add_write_listener(change_feed.on_write)
+CHANGE_FEED_HEARTBEAT_S = 15.0
+BACKEND_DEBUG = os.getenv("BACKEND_DEBUG", "true").lower() != "false"  # Debug mode, with the reloader.
+
+
+def warm_report_snapshots():
+	for store_id in store_ids():
+		for name in REPORT_NAMES:
+			load_snapshot(name, store_id)
+
+
+# Started with the app (see start_background_tasks), GET /ready is 503 until the pools are open and the report
+# snapshots loaded.
+warmup = Warmup({"db_pool": db.fill_pools, "report_snapshots": warm_report_snapshots})
+bind_readiness(app, warmup)
+_background_started = False
+
+
+def start_background_tasks():
+	"""Claim the change feed and start the warmup and the report and export schedulers, once per process."""
+	global _background_started
+	if _background_started:
+		return
+	# The feed's seq is this process's, a second serving process would hand out its own (see change_feed.py).
+	claim_feed_process()
+	_background_started = True
+	if os.getenv("REPORT_SCHEDULER", "true").lower() != "false":
+		start_report_scheduler(db)
+	start_export_scheduler(db)
+	warmup.start()
+
+
+def with_change_seq(response, seq: int):
+	"""Tell the client which change feed seq the data is current to, so it can resume the feed from there."""
+	response.headers["X-Change-Seq"] = str(seq)
+	return response
+
+
+# Column lists for the list endpoints. Selecting columns (rather than ORM objects) gives plain rows that
+# orjson serialises directly, dates natively and Decimal cost through the response layer's hook.
+INVENTORY_COLUMNS = (
+	Product.id, Product.product_name, Product.supplier, Product.category,
+	Product.stock_count, Product.cost, Product.description
+)
+ORDER_COLUMNS = (
+	Order.order_id, Order.product_id, Order.order_date, Order.quantity, Order.date_expected,
+	# Including product name for reference
+	Product.product_name
+)
+EXPIRY_COLUMNS = (
+	ProductExpiry.id.label("batch_id"), ProductExpiry.product_id, Product.product_name,
+	ProductExpiry.expiry_date, ProductExpiry.quantity
+)
+
 
 @app.get("/inventory")
 def get_inventory():
 	"""Return the current inventory as a JSON object"""
 	try:
-		with db.session() as session:
+		seq = change_feed.seq  # Taken before the query, events replayed on top of the data are idempotent upserts.
+		# From the primary: a lagging replica could miss writes the seq already covers, which the client would
+		# then never see (it resumes the feed after seq).
+		with db.session(readonly=True, use_replica=False) as session:
 			# Create query to get all products
-			query = select(Product)
-			products = session.execute(query).scalars()
-
-			# Convert products to list of dictionaries
-			inventory_data = [{
-				"id": product.id,
-				"product_name": product.product_name,
-				"supplier": product.supplier,
-				"category": product.category,
-				"stock_count": product.stock_count,
-				"cost": float(product.cost) if product.cost else None,
-				"description": product.description
-			} for product in products]
-
-			return jsonify(inventory_data), 200
+			query = select(*INVENTORY_COLUMNS)
+			inventory_data = [dict(row) for row in session.execute(query).mappings()]
+
+			return with_change_seq(json_response(inventory_data), seq)
 
 	except Exception as e:
 		logger.error(f"Error fetching inventory: {str(e)}")
@@ -47,23 +108,13 @@ def get_inventory():
 def get_orders():
 	"""Return the current orders as a JSON object"""
 	try:
-		with db.session() as session:
-			# Create query to get all orders with product information
-			query = select(Order).join(Product)
-			orders = session.execute(query).scalars()
-
-			# Convert orders to list of dictionaries
-			orders_data = [{
-				"order_id": order.order_id,
-				"product_id": order.product_id,
-				"order_date": order.order_date.isoformat() if order.order_date else None,
-				"quantity": order.quantity,
-				"date_expected": order.date_expected.isoformat() if order.date_expected else None,
-				# Including product name for reference
-				"product_name": order.product.product_name if order.product else None
-			} for order in orders]
-
-			return jsonify(orders_data), 200
+		seq = change_feed.seq
+		with db.session(readonly=True, use_replica=False) as session:
+			# Create query to get all orders with product information (one joined query, no per-row lazy load)
+			query = select(*ORDER_COLUMNS).join(Product, Order.product_id == Product.id)
+			orders_data = [dict(row) for row in session.execute(query).mappings()]
+
+			return with_change_seq(json_response(orders_data), seq)
 
 	except Exception as e:
 		logger.error(f"Error fetching orders: {str(e)}")
@@ -75,21 +126,13 @@ def get_orders():
 def get_expiry():
     """Return the expiry data as a JSON object"""
     try:
-        with db.session() as session:
+        seq = change_feed.seq
+        with db.session(readonly=True, use_replica=False) as session:
             # Query the expiry table with product information
-            query = select(ProductExpiry).join(Product)
-            expiry_data = session.execute(query).scalars()
+            query = select(*EXPIRY_COLUMNS).join(Product, ProductExpiry.product_id == Product.id)
+            expiry_list = [dict(row) for row in session.execute(query).mappings()]
 
-            # Convert expiry data to a list of dictionaries
-            expiry_list = [{
-                "batch_id": expiry.id,
-                "product_id": expiry.product_id,
-                "product_name": expiry.product.product_name if expiry.product else None,
-                "expiry_date": expiry.expiry_date.isoformat(),
-                "quantity": expiry.quantity
-            } for expiry in expiry_data]
-
-            return jsonify(expiry_list), 200
+            return with_change_seq(json_response(expiry_list), seq)
 
     except Exception as e:
         logger.error(f"Error fetching expiry data: {str(e)}")
@@ -98,6 +141,121 @@ def get_expiry():
 
 
 
+@app.get("/changes")
+def get_changes():
+	"""
+	Stream insert / update / delete events for products, orders and expiry as server-sent events.
+	Resume with the Last-Event-ID header or ?since=<seq>, filter with ?table=orders&table=expiry.
+	With ?format=json the events after since are returned at once, for polling clients.
+	"""
+	tables = [table for table in request.args.getlist("table") if table in FEED_TABLES] or None
+	try:
+		since = int(request.headers.get("Last-Event-ID") or request.args.get("since", change_feed.seq))
+	except ValueError:
+		return jsonify({"error": "Invalid since"}), 400
+
+	store_id = current_store_id()
+	events, reset, latest = change_feed.since(since, tables, store_id)
+	if request.args.get("format") == "json":
+		return json_response({"seq": latest, "reset": reset, "events": [] if reset else events})
+
+	def stream():
+		seq, pending = since, events
+		if reset:
+			# The client is too far behind (or the backend restarted), it must refetch the tables.
+			seq, pending = latest, []
+			yield f"event: reset\ndata: {seq}\n\n"
+		while True:
+			for event in pending:
+				seq = event["seq"]
+				yield f"id: {seq}\nevent: change\ndata: {dumps(event).decode()}\n\n"
+			pending, latest = change_feed.wait(seq, timeout=CHANGE_FEED_HEARTBEAT_S, tables=tables, store_id=store_id)
+			if not pending:
+				seq = latest
+				# Keeps proxies from closing an idle stream, and notices a client that went away.
+				yield ": heartbeat\n\n"
+
+	return Response(stream_with_context(stream()), mimetype="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+@app.post("/changes")
+def publish_change():
+	"""Publish a change made by another process (the agent), see change_feed.ChangeFeedPublisher"""
+	# Events reach every dashboard of the store they name, so only holders of the token may publish (closed without one).
+	if not CHANGE_FEED_TOKEN or not hmac.compare_digest(request.headers.get("X-Change-Feed-Token", ""), CHANGE_FEED_TOKEN):
+		return jsonify({"error": "Forbidden"}), 403
+	event = request.get_json(silent=True) or {}
+	if event.get("table") not in FEED_TABLES or event.get("op") not in ("insert", "update", "delete", "invalidate"):
+		return jsonify({"error": "Invalid change event"}), 400
+	try:
+		store_id = validate_store_id(event.get("store_id", current_store_id()))
+	except TenantError as e:
+		return jsonify({"error": str(e)}), 400
+	published = change_feed.publish(event["table"], event["op"], event.get("row"), store_id)
+	return jsonify({"seq": published["seq"]}), 201
+
+
+@app.get("/metrics")
+def get_metrics():
+	"""Connection pool state, checkout waits and per query fingerprint latency of this process's engines"""
+	return jsonify(db_metrics.snapshot(top=request.args.get("top", 50, type=int)))
+
+
+@app.get("/reports")
+def list_reports():
+	"""Return the available precomputed reports and when they were generated"""
+	reports = []
+	for name in REPORT_NAMES:
+		snapshot = load_snapshot(name)
+		reports.append({
+			"name": name,
+			"generated_at": snapshot["generated_at"] if snapshot else None,
+			"row_count": snapshot["row_count"] if snapshot else None
+		})
+	return json_response(reports)
+
+
+@app.get("/reports/<name>")
+def get_report(name: str):
+	"""Return the latest snapshot of a precomputed report (expiring_7/30/90, expired, low_stock)"""
+	snapshot = load_snapshot(name)
+	if snapshot is None:
+		return jsonify({"error": f"Report '{name}' is not available"}), 404
+	return json_response(snapshot)
+
+
+@app.get("/exports")
+def get_export_manifest():
+	"""Manifest of the latest (or ?snapshot=<id>) Parquet snapshot, listing the store's files per table and partition"""
+	manifest = load_manifest(request.args.get("snapshot"))
+	if manifest is None:
+		return jsonify({"error": "No Parquet snapshot is available"}), 404
+	store_partition = f"store_id={current_store_id()}"
+	for info in manifest["tables"].values():
+		info["files"] = [file for file in info["files"] if file["partition"].split("/")[0] == store_partition]
+		info["rows"] = sum(file["rows"] for file in info["files"])
+	manifest["snapshots"] = list_snapshots()
+	return json_response(manifest)
+
+
+@app.get("/exports/<snapshot_id>/<path:file_path>")
+def get_export_file(snapshot_id: str, file_path: str):
+	"""
+	Serve a Parquet file of a snapshot, e.g. /exports/<id>/orders/store_id=1/month=2024-05/part-0.parquet.
+	Supports Range requests, so Parquet readers can fetch just the footer and the row groups they need.
+	"""
+	if snapshot_id not in list_snapshots():
+		return jsonify({"error": f"Snapshot '{snapshot_id}' is not available"}), 404
+	full_path = safe_join(EXPORT_DIR, snapshot_id, file_path)
+	# Only the files of the request's store.
+	if f"store_id={current_store_id()}" not in file_path.split("/"):
+		return jsonify({"error": "File not found"}), 404
+	if full_path is None or not full_path.endswith(".parquet") or not os.path.isfile(full_path):
+		return jsonify({"error": "File not found"}), 404
+	# Snapshot files never change, so they can be cached for good.
+	return send_file(full_path, mimetype="application/vnd.apache.parquet", conditional=True, max_age=31536000)
+
+
 # Error handlers
 @app.errorhandler(404)
 def not_found_error(error):
@@ -109,5 +267,13 @@ def internal_error(error):
 	return jsonify({"error": "Internal server error"}), 500
 
 
+# Run from the repository root: python -m proj.backend.backend
 if __name__ == '__main__':
-	app.run(debug=True, port=5000)
+	# The debug reloader's parent process only watches the files and restarts its serving child (which has
+	# WERKZEUG_RUN_MAIN set), so it skips the background tasks.
+	if not BACKEND_DEBUG or os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+		start_background_tasks()
+	app.run(debug=BACKEND_DEBUG, host=os.getenv("BACKEND_HOST", "127.0.0.1"), port=5000)
+else:
+	# Imported by a WSGI server, as a single process with threads: gunicorn -w 1 --threads 16 proj.backend.backend:app
+	start_background_tasks()
@@ -0,0 +1,76 @@
+# Serialization benchmark for the list endpoints.
+# Compares the previous path (per-row dict with float() / .isoformat(), stdlib json as used by jsonify)
+# with the response layer (orjson on plain rows), and the payload size with gzip / zstd.
+#
+# Usage:
+#   python -m proj.backend.bench_serialization --rows 100000
+import argparse
+import json
+import time
+from decimal import Decimal
+
+from proj.backend.response_layer import dumps, compress, zstandard
+
+
+def make_rows(count: int) -> list:
+	"""Synthetic inventory rows with exactly the fields of select(*INVENTORY_COLUMNS) results."""
+	return [{
+		"id": i,
+		"product_name": f"Product {i}",
+		"supplier": f"Supplier {i % 50}",
+		"category": ("Medicine", "Prescription", "General", "Supplement")[i % 4],
+		"stock_count": i % 500,
+		"cost": Decimal(f"{(i % 9999) / 100:.2f}"),
+		"description": "Synthetic benchmark product.",
+	} for i in range(count)]
+
+
+def legacy_serialize(rows: list) -> bytes:
+	# What the endpoints did before: convert every value in Python, then stdlib json (jsonify).
+	data = [{
+		"id": row["id"],
+		"product_name": row["product_name"],
+		"supplier": row["supplier"],
+		"category": row["category"],
+		"stock_count": row["stock_count"],
+		"cost": float(row["cost"]) if row["cost"] else None,
+		"description": row["description"],
+	} for row in rows]
+	return json.dumps(data).encode()
+
+
+def cpu_time(fn, *args, repeat: int = 3):
+	"""Best CPU time over a few runs, and the last result."""
+	best, result = float("inf"), None
+	for _ in range(repeat):
+		start = time.process_time()
+		result = fn(*args)
+		best = min(best, time.process_time() - start)
+	return best, result
+
+
+def main():
+	parser = argparse.ArgumentParser(description="Benchmark JSON serialization and compression of the inventory endpoint.")
+	parser.add_argument("--rows", type=int, default=100_000)
+	args = parser.parse_args()
+
+	rows = make_rows(args.rows)
+	legacy_s, legacy_body = cpu_time(legacy_serialize, rows)
+	orjson_s, orjson_body = cpu_time(dumps, rows)
+
+	print(f"Rows: {args.rows}")
+	print(f"{'Serializer':<28}{'CPU ms':>10}{'Bytes':>14}")
+	print(f"{'stdlib json (jsonify)':<28}{legacy_s * 1000:>10.1f}{len(legacy_body):>14}")
+	print(f"{'orjson':<28}{orjson_s * 1000:>10.1f}{len(orjson_body):>14}")
+
+	print(f"\n{'Encoding':<28}{'CPU ms':>10}{'Bytes':>14}")
+	encodings = ["gzip"] + (["zstd"] if zstandard is not None else [])
+	for encoding in encodings:
+		seconds, body = cpu_time(compress, orjson_body, encoding)
+		print(f"{encoding:<28}{seconds * 1000:>10.1f}{len(body):>14}")
+	if zstandard is None:
+		print("(zstandard is not installed, zstd skipped)")
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,204 @@
+# Change feed for live dashboards.
+# Inserts, updates and deletes made through the DatabaseManager write paths are published as events with a
+# monotonic sequence number. The backend serves them as server-sent events (or JSON for polling clients),
+# so the dashboards apply deltas instead of refetching whole tables, and can resume from the last seq they saw.
+#
+# Writes made in another process (the agent) are forwarded to the backend by ChangeFeedPublisher, which needs the
+# same CHANGE_FEED_TOKEN set in both processes (POST /changes is closed without one).
+# Events carry the store (see tenancy.py) the row belongs to, clients only receive their own store's events.
+#
+# The feed and its seq live in the memory of one process, so the backend must run as a single process (threads
+# for concurrency, e.g. gunicorn -w 1 --threads 16, without --preload). With several, each would have its own seq:
+# a client polling another worker would get spurious resets or miss events, and a forwarded write would reach one
+# worker only. claim_feed_process enforces it with a lock file.
+import logging
+import os
+import threading
+import time
+from collections import deque
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import requests
+from sqlalchemy import inspect
+
+from proj.backend.tenancy import current_store_id
+
+try:
+	import fcntl
+except ImportError:  # Not on Windows, where the single process check is skipped.
+	fcntl = None
+
+logger = logging.getLogger(__name__)
+
+CHANGE_FEED_BUFFER = int(os.getenv("CHANGE_FEED_BUFFER", "10000"))
+CHANGE_FEED_TOKEN = os.getenv("CHANGE_FEED_TOKEN", "")
+BACKEND_URL = os.getenv("BACKEND_URL", "http://127.0.0.1:5000").rstrip("/")
+CHANGE_FEED_LOCK = os.getenv("CHANGE_FEED_LOCK", os.path.join(os.path.dirname(os.path.abspath(__file__)), "change_feed.lock"))
+
+FEED_TABLES = {"products", "orders", "expiry"}
+# Row key per table, matching the rows of the list endpoints.
+TABLE_KEYS = {"products": "id", "orders": "order_id", "expiry": "batch_id"}
+
+
+def _jsonable(value: Any) -> Any:
+	if isinstance(value, Decimal):
+		return float(value)
+	if isinstance(value, (date, datetime)):
+		return value.isoformat()
+	return value
+
+
+def row_for(entity: object) -> Dict[str, Any]:
+	"""The entity as a row shaped like the /inventory, /orders or /expiry endpoint rows."""
+	row = {attr.key: _jsonable(getattr(entity, attr.key)) for attr in inspect(entity).mapper.column_attrs}
+	table = entity.__tablename__
+	if table == "expiry":
+		row["batch_id"] = row.pop("id")
+	if table in ("orders", "expiry"):
+		try:
+			row["product_name"] = entity.product.product_name if entity.product else None
+		except Exception:
+			# Relationship not loaded and the session is gone (e.g. after a delete).
+			row["product_name"] = None
+	return row
+
+
+class ChangeFeed:
+	"""In-memory ring buffer of change events with a monotonic sequence number."""
+
+	def __init__(self, maxlen: int = CHANGE_FEED_BUFFER):
+		self._events = deque(maxlen=maxlen)
+		self._seq = 0
+		self._condition = threading.Condition()
+
+	@property
+	def seq(self) -> int:
+		with self._condition:
+			return self._seq
+
+	def publish(self, table: str, op: str, row: Dict[str, Any] = None, store_id: int = None) -> Dict[str, Any]:
+		"""op is insert / update / delete, or invalidate when only the table is known (clients refetch it)."""
+		with self._condition:
+			self._seq += 1
+			event = {
+				"seq": self._seq, "table": table, "op": op, "key": TABLE_KEYS.get(table), "row": row,
+				"store_id": current_store_id() if store_id is None else store_id, "ts": time.time()
+			}
+			self._events.append(event)
+			self._condition.notify_all()
+			return event
+
+	def on_write(self, action: str, entity: object) -> None:
+		"""DatabaseManager write listener."""
+		table = getattr(entity, "__tablename__", None)
+		if table in FEED_TABLES:
+			self.publish(table, action, row_for(entity), entity.store_id)
+
+	def since(self, seq: int, tables: Iterable[str] = None, store_id: int = None) -> Tuple[List[Dict[str, Any]], bool, int]:
+		"""
+		Events after seq (of one store, if given), whether the client fell behind the buffer (and must refetch
+		everything), and the feed's seq the events are complete up to, read under the same lock.
+		"""
+		with self._condition:
+			return self._since(seq, set(tables) if tables else None, store_id)
+
+	def _since(self, seq: int, tables: Optional[set], store_id: Optional[int]) -> Tuple[List[Dict[str, Any]], bool, int]:
+		# Older than the buffer, or from before a backend restart.
+		reset = (bool(self._events) and seq < self._events[0]["seq"] - 1) or seq > self._seq
+		events = [
+			e for e in self._events
+			if e["seq"] > seq and (tables is None or e["table"] in tables) and (store_id is None or e["store_id"] == store_id)
+		]
+		return events, reset, self._seq
+
+	def wait(self, seq: int, timeout: float, tables: Iterable[str] = None, store_id: int = None) -> Tuple[List[Dict[str, Any]], int]:
+		"""
+		Block until there are events after seq (or the timeout passes). Also returns the seq the feed was at, so a
+		client whose filters matched none of the new events moves past them instead of waking up on them again.
+		"""
+		with self._condition:
+			self._condition.wait_for(lambda: self._seq > seq, timeout=timeout)
+			events, _, latest = self._since(seq, set(tables) if tables else None, store_id)
+		return events, latest
+
+
+_feed_lock_file = None
+
+
+def claim_feed_process(path: str = CHANGE_FEED_LOCK):
+	"""
+	Make this process the one serving the change feed, or raise RuntimeError when another live process already does
+	(e.g. a second WSGI worker). The lock is released when the process exits.
+	"""
+	global _feed_lock_file
+	if fcntl is None or _feed_lock_file is not None:
+		return
+	lock_file = open(path, "a+")
+	try:
+		fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+	except OSError:
+		lock_file.seek(0)
+		owner = lock_file.read().strip()
+		lock_file.close()
+		raise RuntimeError(
+			f"The change feed is already served by process {owner or '?'}. It lives in one process's memory, "
+			f"run the backend as a single process (e.g. gunicorn -w 1 --threads 16)"
+		)
+	lock_file.truncate(0)
+	lock_file.write(str(os.getpid()))
+	lock_file.flush()
+	_feed_lock_file = lock_file
+
+
+class ChangeFeedPublisher:
+	"""Forwards writes made in another process (e.g. the agent) to the backend's change feed, off the request path."""
+
+	def __init__(self, backend_url: str = BACKEND_URL):
+		self.backend_url = backend_url
+		self._session = requests.Session()
+		self._queue: deque = deque(maxlen=CHANGE_FEED_BUFFER)
+		self._ready = threading.Event()
+		threading.Thread(target=self._run, name="change-feed-publisher", daemon=True).start()
+
+	def on_write(self, action: str, entity: object) -> None:
+		table = getattr(entity, "__tablename__", None)
+		if table in FEED_TABLES:
+			self.publish(table, action, row_for(entity), entity.store_id)
+
+	def publish(self, table: str, op: str, row: Optional[Dict[str, Any]] = None, store_id: int = None) -> None:
+		store_id = current_store_id() if store_id is None else store_id
+		self._queue.append({"table": table, "op": op, "row": row, "store_id": store_id})
+		self._ready.set()
+
+	def _run(self):
+		if not CHANGE_FEED_TOKEN:
+			logger.warning("CHANGE_FEED_TOKEN is not set, changes made in this process are not published to the backend")
+			return
+		while True:
+			self._ready.wait()
+			self._ready.clear()
+			while self._queue:
+				event = self._queue.popleft()
+				try:
+					self._session.post(
+						f"{self.backend_url}/changes",
+						json=event,
+						headers={"X-Change-Feed-Token": CHANGE_FEED_TOKEN},
+						timeout=2
+					)
+				except requests.RequestException as e:
+					logger.warning(f"Could not publish change event for {event['table']}: {str(e)}")
+
+
+_publisher: Optional[ChangeFeedPublisher] = None
+_publisher_lock = threading.Lock()
+
+
+def get_publisher() -> ChangeFeedPublisher:
+	global _publisher
+	with _publisher_lock:
+		if _publisher is None:
+			_publisher = ChangeFeedPublisher()
+		return _publisher
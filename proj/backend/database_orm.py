@@ -1,11 +1,22 @@
-from sqlalchemy import create_engine, text
-from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session, sessionmaker, with_loader_criteria
 from sqlalchemy.exc import SQLAlchemyError
-from typing import Optional, TypeVar, Generic, Type
+from typing import Optional, TypeVar, Generic, Type, Callable, List, Dict, Tuple
+from concurrent.futures import Future
 from contextlib import contextmanager
+import contextvars
 from dotenv import load_dotenv
+import itertools
 import logging
 import os
+import queue
+import threading
+import time
+
+from proj.backend.db_metrics import engine_options, instrument_engine
+from proj.backend.model_schema import TenantMixin
+from proj.backend.tenancy import TenantError, current_store_id, is_unscoped, store_ids, tenant, tenant_host
 
 # Load environment variables
 load_dotenv()
@@ -16,6 +27,247 @@ logger = logging.getLogger(__name__)
 
 T = TypeVar('T')
 
+# Read replicas, comma separated hosts with the same user and database as DB_HOST (the primary).
+DB_REPLICA_HOSTS = [host.strip() for host in os.getenv("DB_REPLICA_HOSTS", "").split(",") if host.strip()]
+DB_REPLICA_MAX_LAG_S = float(os.getenv("DB_REPLICA_MAX_LAG_S", "5"))  # Replicas further behind are skipped.
+DB_REPLICA_CHECK_S = float(os.getenv("DB_REPLICA_CHECK_S", "10"))
+
+# Deferred (group) commit, see DatabaseManager.submit
+DB_GROUP_COMMIT_WINDOW_MS = float(os.getenv("DB_GROUP_COMMIT_WINDOW_MS", "5"))
+DB_GROUP_COMMIT_MAX_BATCH = int(os.getenv("DB_GROUP_COMMIT_MAX_BATCH", "200"))
+WRITE_ACTIONS = ("insert", "update", "delete")
+
+# Pool of the primary (DB_HOST), size it from the load test's checkout waits (see chain/load_test.py).
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+
+# Pool per tenant database host (DB_TENANT_HOSTS), shared by every store on that host.
+DB_TENANT_POOL_SIZE = int(os.getenv("DB_TENANT_POOL_SIZE", "5"))
+DB_TENANT_MAX_OVERFLOW = int(os.getenv("DB_TENANT_MAX_OVERFLOW", "10"))
+
+
+def _connection_string(host: str) -> str:
+	# {os.getenv('DB_PASSWORD')}
+	return f"mysql://{os.getenv('DB_USER')}:@{host}/{os.getenv('DB_NAME')}"
+
+
+# Writes made in the current context (e.g. one agent turn), see track_writes.
+_tracked_writes: contextvars.ContextVar[Optional[List[str]]] = contextvars.ContextVar("tracked_writes", default=None)
+
+
+@contextmanager
+def track_writes():
+	"""Collect the writes ("insert products", ...) made in this context, through the DatabaseManager or record_write."""
+	writes: List[str] = []
+	token = _tracked_writes.set(writes)
+	try:
+		yield writes
+	finally:
+		_tracked_writes.reset(token)
+
+
+def record_write(action: str, table: str):
+	"""Note a write made outside the DatabaseManager (e.g. NL2SQL DML) for track_writes."""
+	writes = _tracked_writes.get()
+	if writes is not None:
+		writes.append(f"{action} {table}")
+
+
+def fill_pool(engine: Engine, connections: int = None) -> int:
+	"""Open the pool's permanent connections up front (held at once, so each is a new one), returns how many."""
+	count = connections or (engine.pool.size() if hasattr(engine.pool, "size") else 1)
+	opened = []
+	try:
+		for _ in range(count):
+			opened.append(engine.connect())
+			opened[-1].execute(text("SELECT 1"))
+	finally:
+		for connection in opened:
+			connection.close()
+	return len(opened)
+
+
+class ReplicaPool:
+	"""Engines for the read replicas, health and lag checked in the background and picked round robin."""
+
+	def __init__(self, hosts: List[str], max_lag_s: float = DB_REPLICA_MAX_LAG_S, check_interval_s: float = DB_REPLICA_CHECK_S):
+		self.max_lag_s = max_lag_s
+		self.check_interval_s = check_interval_s
+		self._engines: Dict[str, Engine] = {
+			host: instrument_engine(create_engine(
+				_connection_string(host), pool_pre_ping=True, pool_size=5, max_overflow=10,
+				**engine_options(f"replica-{host}")
+			), f"replica-{host}")
+			for host in hosts
+		}
+		self._lag: Dict[str, Optional[float]] = {}
+		self._healthy: List[str] = []
+		self._counter = itertools.count()
+		self._lock = threading.Lock()
+		self.check()
+		threading.Thread(target=self._run, name="replica-health", daemon=True).start()
+
+	@staticmethod
+	def _replica_lag(engine: Engine) -> Optional[float]:
+		"""Seconds behind the primary, None when replication is not running."""
+		with engine.connect() as connection:
+			try:
+				status = connection.execute(text("SHOW REPLICA STATUS")).mappings().first()
+			except SQLAlchemyError:
+				# MySQL before 8.0.22.
+				status = connection.execute(text("SHOW SLAVE STATUS")).mappings().first()
+		if status is None:
+			return None
+		lag = status.get("Seconds_Behind_Source", status.get("Seconds_Behind_Master"))
+		return None if lag is None else float(lag)
+
+	def check(self):
+		lags, healthy = {}, []
+		for host, engine in self._engines.items():
+			try:
+				lags[host] = self._replica_lag(engine)
+			except SQLAlchemyError as e:
+				logger.warning(f"Replica {host} is unreachable: {str(e)}")
+				lags[host] = None
+				continue
+			if lags[host] is not None and lags[host] <= self.max_lag_s:
+				healthy.append(host)
+			else:
+				logger.warning(f"Replica {host} skipped, lag: {lags[host]}")
+		with self._lock:
+			self._lag, self._healthy = lags, healthy
+
+	def _run(self):
+		while True:
+			time.sleep(self.check_interval_s)
+			self.check()
+
+	def engine(self) -> Optional[Engine]:
+		"""A healthy replica's engine, or None when every replica is down or lagging."""
+		with self._lock:
+			if not self._healthy:
+				return None
+			return self._engines[self._healthy[next(self._counter) % len(self._healthy)]]
+
+	def status(self) -> Dict[str, Optional[float]]:
+		with self._lock:
+			return dict(self._lag)
+
+	def engines(self) -> Dict[str, Engine]:
+		return dict(self._engines)
+
+
+# Tenant scoping of every ORM session, see tenancy.py. The store is the one the session was opened for.
+@event.listens_for(Session, "do_orm_execute")
+def _scope_to_store(execute_state):
+	"""Filter ORM selects, updates and deletes (including joined and lazy loads) to the session's store."""
+	if is_unscoped() or execute_state.is_column_load or execute_state.is_relationship_load:
+		return
+	if execute_state.is_select or execute_state.is_update or execute_state.is_delete:
+		store_id = execute_state.session.info.get("store_id", current_store_id())
+		execute_state.statement = execute_state.statement.options(
+			with_loader_criteria(TenantMixin, lambda cls: cls.store_id == store_id, include_aliases=True)
+		)
+
+
+@event.listens_for(Session, "before_flush")
+def _assign_store(session, flush_context, instances):
+	"""New rows belong to the session's store, rows for another store are refused."""
+	store_id = session.info.get("store_id", current_store_id())
+	for entity in session.new:
+		if not isinstance(entity, TenantMixin):
+			continue
+		if entity.store_id is None:
+			entity.store_id = store_id
+		elif entity.store_id != store_id and not is_unscoped():
+			raise TenantError(f"{type(entity).__name__} of store {entity.store_id} written in a session of store {store_id}")
+
+
+class UnitOfWork:
+	"""Writes collected on one session, flushed and committed together by DatabaseManager.unit_of_work()."""
+
+	def __init__(self, session: Session):
+		self.session = session
+		self.writes: List[Tuple[str, object]] = []
+
+	def add(self, entity: T) -> T:
+		self.session.add(entity)
+		self.writes.append(("insert", entity))
+		return entity
+
+	def add_all(self, entities: List[T]) -> List[T]:
+		return [self.add(entity) for entity in entities]
+
+	def update(self, entity: T) -> T:
+		merged = self.session.merge(entity)
+		self.writes.append(("update", merged))
+		return merged
+
+	def delete(self, entity: T) -> T:
+		self.session.delete(entity)
+		self.writes.append(("delete", entity))
+		return entity
+
+	def apply(self, action: str, entity: T) -> T:
+		return {"insert": self.add, "update": self.update, "delete": self.delete}[action](entity)
+
+
+class GroupCommitter:
+	"""
+	Deferred writes from many callers committed together: the first write opens a window of window_s,
+	and everything submitted within it (up to max_batch) goes into one transaction. Each caller gets a Future.
+	"""
+
+	def __init__(self, manager: "DatabaseManager", window_s: float, max_batch: int):
+		self._manager = manager
+		self.window_s = window_s
+		self.max_batch = max_batch
+		self._queue: queue.Queue = queue.Queue()
+		threading.Thread(target=self._run, name="group-commit", daemon=True).start()
+
+	def submit(self, action: str, entity: T) -> Future:
+		if action not in WRITE_ACTIONS:
+			raise ValueError(f"Unknown write action: {action}")
+		future = Future()
+		# The committer thread has no request context, the write keeps the store it was submitted for.
+		self._queue.put((action, entity, future, current_store_id()))
+		return future
+
+	def _run(self):
+		while True:
+			batch = [self._queue.get()]
+			deadline = time.monotonic() + self.window_s
+			while len(batch) < self.max_batch:
+				remaining = deadline - time.monotonic()
+				if remaining <= 0:
+					break
+				try:
+					batch.append(self._queue.get(timeout=remaining))
+				except queue.Empty:
+					break
+			# One transaction per store, as stores may live on different hosts.
+			by_store: Dict[int, list] = {}
+			for item in batch:
+				by_store.setdefault(item[3], []).append(item)
+			for store_batch in by_store.values():
+				self._commit(store_batch)
+
+	def _commit(self, batch: List[Tuple[str, object, Future, int]]):
+		try:
+			with tenant(batch[0][3]), self._manager.unit_of_work() as uow:
+				results = [uow.apply(action, entity) for action, entity, _, _ in batch]
+		except Exception as e:
+			if len(batch) == 1:
+				batch[0][2].set_exception(e)
+				return
+			# One bad row must not fail everyone else's write, retry them one by one.
+			logger.warning(f"Group commit of {len(batch)} writes failed, retrying individually: {str(e)}")
+			for item in batch:
+				self._commit([item])
+			return
+		for (_, _, future, _), result in zip(batch, results):
+			future.set_result(result)
+
 
 # Database Manager Singleton...
 
@@ -23,6 +275,14 @@ class DatabaseManager:
 	_instance = None
 	_engine = None
 	_SessionFactory = None
+	_replicas: Optional[ReplicaPool] = None
+	# Engines of the tenant database hosts, by host, created on the first use.
+	_tenant_engines: Dict[str, Engine] = {}
+	_tenant_engines_lock = threading.Lock()
+	_group_committer: Optional[GroupCommitter] = None
+	_group_committer_lock = threading.Lock()
+	# Called as listener(action, entity) after a successful create / update / delete.
+	_write_listeners: List[Callable[[str, object], None]] = []
 
 	def __new__(cls):
 		if cls._instance is None:
@@ -35,31 +295,73 @@ class DatabaseManager:
 		"""Initialize the database connection using environment variables"""
 		if not self._engine:
 			try:
-				# {os.getenv('DB_PASSWORD')}
-				connection_string = f"mysql://{os.getenv('DB_USER')}:@{os.getenv('DB_HOST')}/{os.getenv('DB_NAME')}"
+				connection_string = _connection_string(os.getenv('DB_HOST'))
 				print("Connection String: ", connection_string)
 				self._engine = create_engine(
 					connection_string,
 					pool_pre_ping=True,  # Enables connection health checks
-					pool_size=5,  # Maximum number of permanent connections
-					max_overflow=10  # Maximum number of temporary connections
+					pool_size=DB_POOL_SIZE,  # Maximum number of permanent connections
+					max_overflow=DB_MAX_OVERFLOW,  # Maximum number of temporary connections
+					**engine_options("primary")  # Checkout wait timing, see db_metrics.py
 				)
-				self._SessionFactory = sessionmaker(bind=self._engine)
+				instrument_engine(self._engine, "primary")
+				# Entities stay readable after their session commits and closes (they are returned to callers).
+				self._SessionFactory = sessionmaker(bind=self._engine, expire_on_commit=False)
+				if DB_REPLICA_HOSTS:
+					self._replicas = ReplicaPool(DB_REPLICA_HOSTS)
 				logger.info("Database connection initialized successfully")
 			except Exception as e:
 				logger.error(f"Failed to initialize database connection: {str(e)}")
 				raise
 
+	def engine(self, store_id: int = None) -> Engine:
+		"""Engine of the (current) store's database host, the primary unless the store is in DB_TENANT_HOSTS."""
+		host = tenant_host(store_id)
+		if host is None:
+			return self._engine
+		with self._tenant_engines_lock:
+			if host not in self._tenant_engines:
+				self._tenant_engines[host] = instrument_engine(create_engine(
+					_connection_string(host), pool_pre_ping=True, pool_size=DB_TENANT_POOL_SIZE,
+					max_overflow=DB_TENANT_MAX_OVERFLOW, **engine_options(f"tenant-{host}")
+				), f"tenant-{host}")
+			return self._tenant_engines[host]
+
+	def replica_engine(self) -> Optional[Engine]:
+		"""A healthy read replica, None when none are configured, all are down / lagging or the store is not on the primary."""
+		if not self._replicas or tenant_host() is not None:
+			return None
+		return self._replicas.engine()
+
+	def read_engine(self) -> Engine:
+		"""Engine for reads, a replica when one is healthy, else the store's primary."""
+		return self.replica_engine() or self.engine()
+
 	@contextmanager
-	def session(self):
-		"""Provide a transactional scope around a series of operations."""
+	def session(self, readonly: bool = False, use_replica: bool = True):
+		"""
+		Provide a transactional scope around a series of operations.
+		readonly=True runs on a read replica (falling back to the primary) and never commits,
+		use it for reads that can be a few seconds stale (overviews, reports).
+		use_replica=False keeps a readonly session on the primary, for reads that must include every committed
+		write (e.g. data returned with a change feed seq).
+		The session is scoped to the current store (see tenancy.py) and bound to that store's database.
+		"""
 		if not self._SessionFactory:
 			raise RuntimeError("DatabaseManager not initialized properly")
 
-		session = self._SessionFactory()
+		session = self._SessionFactory(
+			bind=self.read_engine() if readonly and use_replica else self.engine(),
+			info={"store_id": current_store_id()}
+		)
 		try:
 			yield session
-			session.commit()
+			if readonly:
+				if session.new or session.dirty or session.deleted:
+					raise RuntimeError("Write attempted in a readonly session")
+				session.rollback()
+			else:
+				session.commit()
 		except Exception as e:
 			session.rollback()
 			logger.error(f"Session error: {str(e)}")
@@ -67,8 +369,32 @@ class DatabaseManager:
 		finally:
 			session.close()
 
+	def fill_pools(self) -> Dict[str, int]:
+		"""Open the permanent connections of the primary, each tenant host and each replica, so the first requests do not."""
+		engines = {"primary": self._engine}
+		for store_id in store_ids():
+			host = tenant_host(store_id)
+			if host is not None:
+				engines[f"tenant-{host}"] = self.engine(store_id)
+		if self._replicas:
+			engines.update({f"replica-{host}": engine for host, engine in self._replicas.engines().items()})
+		return {label: fill_pool(engine) for label, engine in engines.items()}
+
+	def add_write_listener(self, listener: Callable[[str, object], None]):
+		"""Register a callback for writes, action is one of "insert", "update" or "delete"."""
+		if listener not in self._write_listeners:
+			self._write_listeners.append(listener)
+
+	def _notify_write(self, action: str, entity: object):
+		record_write(action, getattr(entity, "__tablename__", type(entity).__name__))
+		for listener in self._write_listeners:
+			try:
+				listener(action, entity)
+			except Exception as e:
+				logger.error(f"Write listener failed for {action} {type(entity).__name__}: {str(e)}")
+
 	def get_by_id(self, model: Type[T], id: int) -> Optional[T]:
-		"""Generic method to get an entity by ID"""
+		"""Generic method to get an entity by ID (from the primary, as it is usually read before an update)"""
 		try:
 			with self.session() as session:
 				return session.get(model, id)
@@ -76,14 +402,46 @@ class DatabaseManager:
 			logger.error(f"Error fetching {model.__name__} with id {id}: {str(e)}")
 			return None
 
+	@contextmanager
+	def unit_of_work(self):
+		"""
+		Collect writes and commit them in one transaction, e.g. a product with its expiry batches and an order:
+
+			with db.unit_of_work() as uow:
+				product = uow.add(Product(...))
+				uow.add_all([ProductExpiry(product=product, ...), Order(product=product, ...)])
+
+		Everything goes out in a single flush (ordered by the relationships) and a single commit, instead of a
+		transaction per write. Write listeners are notified once the transaction has committed.
+		"""
+		with self.session() as session:
+			uow = UnitOfWork(session)
+			yield uow
+			session.flush()
+		for action, entity in uow.writes:
+			self._notify_write(action, entity)
+
+	def submit(self, entity: T, action: str = "insert") -> Future:
+		"""
+		Deferred write for high rate callers (e.g. dispensing events): committed together with the writes of
+		other callers within DB_GROUP_COMMIT_WINDOW_MS, instead of one transaction each.
+		The returned Future resolves to the written entity, or raises the database error.
+		"""
+		with self._group_committer_lock:
+			if self._group_committer is None:
+				DatabaseManager._group_committer = GroupCommitter(
+					self, DB_GROUP_COMMIT_WINDOW_MS / 1000, DB_GROUP_COMMIT_MAX_BATCH
+				)
+		# Recorded here, the committer thread does not run in the caller's context.
+		record_write(action, getattr(entity, "__tablename__", type(entity).__name__))
+		return self._group_committer.submit(action, entity)
+
 	def create(self, entity: T) -> Optional[T]:
 		"""Generic method to create an entity"""
 		try:
-			with self.session() as session:
-				session.add(entity)
-				session.commit()
-				session.refresh(entity)
-				return entity
+			with self.unit_of_work() as uow:
+				uow.add(entity)
+			return entity
 		except SQLAlchemyError as e:
 			logger.error(f"Error creating {type(entity).__name__}: {str(e)}")
 			return None
@@ -91,10 +449,9 @@ class DatabaseManager:
 	def update(self, entity: T) -> Optional[T]:
 		"""Generic method to update an entity"""
 		try:
-			with self.session() as session:
-				session.merge(entity)
-				session.commit()
-				return entity
+			with self.unit_of_work() as uow:
+				uow.update(entity)
+			return entity
 		except SQLAlchemyError as e:
 			logger.error(f"Error updating {type(entity).__name__}: {str(e)}")
 			return None
@@ -102,10 +459,9 @@ class DatabaseManager:
 	def delete(self, entity: T) -> bool:
 		"""Generic method to delete an entity"""
 		try:
-			with self.session() as session:
-				session.delete(entity)
-				session.commit()
-				return True
+			with self.unit_of_work() as uow:
+				uow.delete(entity)
+			return True
 		except SQLAlchemyError as e:
 			logger.error(f"Error deleting {type(entity).__name__}: {str(e)}")
 			return False
@@ -123,7 +479,8 @@ class DatabaseManager:
 
 # Example usage
 if __name__ == "__main__":
-	from model_schema import Product, Order, ProductExpiry
+	from datetime import date, timedelta
+	from proj.backend.model_schema import Product, Order, ProductExpiry
 
 	try:
 		# Get database instance (it will automatically initialize using env variables)
@@ -140,5 +497,11 @@ if __name__ == "__main__":
 		)
 		created_product = db.create(new_product)
 
+		# Several writes in one transaction.
+		with db.unit_of_work() as uow:
+			product = uow.add(Product(product_name="Test Batch Product", category="Test", stock_count=20, cost=4.50))
+			uow.add(ProductExpiry(product=product, expiry_date=date.today() + timedelta(days=90), quantity=20))
+			uow.add(Order(product=product, order_date=date.today(), quantity=10))
+
 	except Exception as e:
 		logger.error(f"Error in example operations: {str(e)}")
\ No newline at end of file
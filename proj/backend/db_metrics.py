@@ -0,0 +1,236 @@
+# Connection pool and query instrumentation for the DatabaseManager engines.
+# Built on SQLAlchemy pool and cursor events: checkout wait, checked-out / overflow counts, connection lifetimes,
+# and per-statement latency histograms grouped by a normalised SQL fingerprint, with a slow query log.
+# Recording is a couple of perf_counter calls, a cached fingerprint and a bucket increment per statement,
+# so it is left on in production (DB_METRICS=false turns it off).
+import bisect
+import logging
+import os
+import re
+import threading
+import time
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
+
+logger = logging.getLogger(__name__)
+
+DB_METRICS_ENABLED = os.getenv("DB_METRICS", "true").lower() != "false"
+DB_SLOW_QUERY_MS = float(os.getenv("DB_SLOW_QUERY_MS", "500"))
+DB_METRICS_MAX_FINGERPRINTS = int(os.getenv("DB_METRICS_MAX_FINGERPRINTS", "500"))
+
+# Upper bounds in milliseconds, the last bucket catches everything slower.
+BUCKETS_MS = (0.5, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, float("inf"))
+
+
+class Histogram:
+	"""Fixed bucket latency histogram, quantiles are estimated as the upper bound of their bucket."""
+
+	def __init__(self, buckets=BUCKETS_MS):
+		self.buckets = buckets
+		self.counts = [0] * len(buckets)
+		self.count = 0
+		self.total = 0.0
+		self.max = 0.0
+		self._lock = threading.Lock()
+
+	def observe(self, value_ms: float):
+		index = bisect.bisect_left(self.buckets, value_ms)
+		with self._lock:
+			self.counts[index] += 1
+			self.count += 1
+			self.total += value_ms
+			self.max = max(self.max, value_ms)
+
+	def quantile(self, q: float) -> Optional[float]:
+		if not self.count:
+			return None
+		rank, seen = q * self.count, 0
+		for bound, count in zip(self.buckets, self.counts):
+			seen += count
+			if seen >= rank:
+				return self.max if bound == float("inf") else min(bound, self.max)
+		return self.max
+
+	def to_dict(self) -> Dict[str, Any]:
+		with self._lock:
+			return {
+				"count": self.count,
+				"sum_ms": round(self.total, 3),
+				"avg_ms": round(self.total / self.count, 3) if self.count else None,
+				"p50_ms": self.quantile(0.5),
+				"p95_ms": self.quantile(0.95),
+				"p99_ms": self.quantile(0.99),
+				"max_ms": round(self.max, 3),
+				"buckets": {str(bound): count for bound, count in zip(self.buckets, self.counts) if count}
+			}
+
+
+_STRING_LITERAL = re.compile(r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.)*\"")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_VALUE_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_PLACEHOLDER = re.compile(r"%\(\w+\)s|%s|:\w+")
+_WHITESPACE = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=4096)
+def fingerprint(statement: str) -> str:
+	"""The statement with literals and placeholders replaced by ?, so the same query shape is grouped together."""
+	normalised = _STRING_LITERAL.sub("?", statement)
+	normalised = _PLACEHOLDER.sub("?", normalised)
+	normalised = _NUMBER_LITERAL.sub("?", normalised)
+	normalised = _VALUE_LIST.sub("(?)", normalised)  # IN (?, ?, ?) and multi-row VALUES of any length.
+	return _WHITESPACE.sub(" ", normalised).strip()
+
+
+class PoolStats:
+	def __init__(self):
+		self.checkouts = 0
+		self.checkout_wait = Histogram()
+		self.connection_lifetime = Histogram(buckets=(1e3, 1e4, 6e4, 3e5, 9e5, 3.6e6, 1.44e7, float("inf")))
+		self.connects = 0
+		self.invalidations = 0
+
+
+class DBMetrics:
+	"""Process wide registry of pool and query metrics, per engine label."""
+
+	def __init__(self, slow_query_ms: float = DB_SLOW_QUERY_MS, max_fingerprints: int = DB_METRICS_MAX_FINGERPRINTS):
+		self.slow_query_ms = slow_query_ms
+		self.max_fingerprints = max_fingerprints
+		self._engines: Dict[str, Engine] = {}
+		self._pools: Dict[str, PoolStats] = {}
+		self._queries: Dict[tuple, Histogram] = {}
+		self._slow_queries = 0
+		self._lock = threading.Lock()
+
+	def pool_stats(self, label: str) -> PoolStats:
+		with self._lock:
+			if label not in self._pools:
+				self._pools[label] = PoolStats()
+			return self._pools[label]
+
+	def _query_histogram(self, label: str, statement_fingerprint: str) -> Histogram:
+		key = (label, statement_fingerprint)
+		histogram = self._queries.get(key)
+		if histogram is None:
+			with self._lock:
+				if key not in self._queries and len(self._queries) >= self.max_fingerprints:
+					# Bound the memory used by ad hoc (NL2SQL) queries.
+					key = (label, "other")
+				histogram = self._queries.setdefault(key, Histogram())
+		return histogram
+
+	def instrument(self, engine: Engine, label: str):
+		"""Attach the pool and cursor event listeners to the engine."""
+		if label in self._engines:
+			return
+		self._engines[label] = engine
+		stats = self.pool_stats(label)
+
+		@event.listens_for(engine, "connect")
+		def on_connect(dbapi_connection, connection_record):
+			connection_record.info["created_at"] = time.monotonic()
+			stats.connects += 1
+
+		@event.listens_for(engine, "checkout")
+		def on_checkout(dbapi_connection, connection_record, connection_proxy):
+			stats.checkouts += 1
+
+		def on_close(dbapi_connection, connection_record):
+			created_at = connection_record.info.pop("created_at", None)
+			if created_at is not None:
+				stats.connection_lifetime.observe((time.monotonic() - created_at) * 1000)
+
+		event.listen(engine, "close", on_close)
+
+		@event.listens_for(engine, "invalidate")
+		def on_invalidate(dbapi_connection, connection_record, exception):
+			stats.invalidations += 1
+
+		@event.listens_for(engine, "before_cursor_execute")
+		def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+			conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+		@event.listens_for(engine, "after_cursor_execute")
+		def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+			elapsed_ms = (time.perf_counter() - conn.info["query_start"].pop()) * 1000
+			statement_fingerprint = fingerprint(statement)
+			self._query_histogram(label, statement_fingerprint).observe(elapsed_ms)
+			if elapsed_ms >= self.slow_query_ms:
+				self._slow_queries += 1
+				logger.warning(f"Slow query on {label} ({elapsed_ms:.0f} ms): {statement_fingerprint[:500]}")
+
+		@event.listens_for(engine, "handle_error")
+		def handle_error(context):
+			# The after event does not fire for a failed statement, drop its start time.
+			starts = context.connection.info.get("query_start") if context.connection is not None else None
+			if starts:
+				starts.pop()
+
+	def snapshot(self, top: int = 50) -> Dict[str, Any]:
+		"""Current pool state and the top query fingerprints by total time."""
+		pools = {}
+		for label, engine in list(self._engines.items()):
+			pool, stats = engine.pool, self.pool_stats(label)
+			state = {
+				"checkouts": stats.checkouts,
+				"connects": stats.connects,
+				"invalidations": stats.invalidations,
+				"checkout_wait": stats.checkout_wait.to_dict(),
+				"connection_lifetime": stats.connection_lifetime.to_dict()
+			}
+			if isinstance(pool, QueuePool):
+				state.update({
+					"size": pool.size(),
+					"checked_out": pool.checkedout(),
+					"checked_in": pool.checkedin(),
+					"overflow": max(pool.overflow(), 0)
+				})
+			pools[label] = state
+
+		with self._lock:
+			queries = list(self._queries.items())
+		query_stats = [
+			{"engine": label, "fingerprint": statement_fingerprint, **histogram.to_dict()}
+			for (label, statement_fingerprint), histogram in queries
+		]
+		query_stats.sort(key=lambda stats: stats["sum_ms"], reverse=True)
+		return {
+			"enabled": DB_METRICS_ENABLED,
+			"slow_query_ms": self.slow_query_ms,
+			"slow_queries": self._slow_queries,
+			"pools": pools,
+			"queries": query_stats[:top]
+		}
+
+
+db_metrics = DBMetrics()
+
+
+class TimedQueuePool(QueuePool):
+	"""QueuePool that records how long each checkout waited for a free connection (labelled by pool_logging_name)."""
+
+	def _do_get(self):
+		start = time.perf_counter()
+		try:
+			return super()._do_get()
+		finally:
+			label = getattr(self, "_orig_logging_name", None) or "default"
+			db_metrics.pool_stats(label).checkout_wait.observe((time.perf_counter() - start) * 1000)
+
+
+def engine_options(label: str) -> Dict[str, Any]:
+	"""Extra create_engine arguments for an instrumented engine."""
+	if not DB_METRICS_ENABLED:
+		return {}
+	return {"poolclass": TimedQueuePool, "pool_logging_name": label}
+
+
+def instrument_engine(engine: Engine, label: str) -> Engine:
+	if DB_METRICS_ENABLED:
+		db_metrics.instrument(engine, label)
+	return engine
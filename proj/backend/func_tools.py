@@ -4,8 +4,11 @@ from langchain.agents import Tool
 from dotenv import load_dotenv
 from sqlalchemy import select, func, and_
 
+from proj.backend.change_feed import get_publisher
 from proj.backend.database_orm import DatabaseManager
 from proj.backend.model_schema import Product, ProductExpiry
+from proj.backend.product_index import get_product_index
+from proj.backend.report_snapshots import REPORT_NAMES, load_snapshot, mark_dirty_on_write
 from proj.backend.tool_schema import ProductSchema, DBOverviewSchema
 from proj.chain.tools.date_tool import get_current_date_tool
 
@@ -13,6 +16,10 @@ load_dotenv()
 
 # Initialize database manager as a singleton
 db = DatabaseManager()
+# Product / expiry writes from the agent flag the precomputed reports for a refresh.
+db.add_write_listener(mark_dirty_on_write)
+# And are forwarded to the backend's change feed, so open dashboards update live.
+db.add_write_listener(get_publisher().on_write)
 
 
 def add_product(product: ProductSchema) -> str:
@@ -54,7 +61,7 @@ def get_db_overview(query: DBOverviewSchema) -> str:
 	Returns product count, total count and expired quantity for given days.
 	"""
 	try:
-		with db.session() as session:
+		with db.session(readonly=True) as session:
 			# Calculate date range
 			try:
 				if isinstance(query, str):
@@ -100,6 +107,40 @@ def get_db_overview(query: DBOverviewSchema) -> str:
 		return f"Error occurred while fetching database overview. {e}"
 
 
+def get_report_snapshot(name: str) -> str:
+	"""Return the latest precomputed expiry / low stock report, without running any SQL."""
+	name = (name or "").strip().strip("'\"").lower()
+	if name not in REPORT_NAMES:
+		return f"Unknown report '{name}', choose one of: {', '.join(REPORT_NAMES)}."
+
+	snapshot = load_snapshot(name)
+	if snapshot is None:
+		return f"The {name} report has not been generated yet, please use the Text to SQL Database Tool instead."
+
+	rows = snapshot["rows"]
+	lines = [f"{name} report generated at {snapshot['generated_at']}, {snapshot['row_count']} rows."]
+	for row in rows[:10]:
+		lines.append(", ".join(f"{key}: {value}" for key, value in row.items()))
+	if len(rows) > 10:
+		lines.append(f"... and {len(rows) - 10} more rows.")
+	return "\n".join(lines)
+
+
+def find_product(name: str) -> str:
+	"""Look up the stored product names closest to the given (possibly misspelled) name, from the in-memory index."""
+	name = (name or "").strip().strip("'\"")
+	if not name:
+		return "Please provide a product name to look up."
+
+	matches = get_product_index().lookup(name)
+	if not matches:
+		return f"No product found matching '{name}'."
+	lines = [f"Products matching '{name}':"]
+	for match in matches:
+		lines.append(f"{match.name} (id {match.id}, match {match.score:.0%})")
+	return "\n".join(lines)
+
+
 # Once all functions are converted, do the following,
 DB_OverviewTool = Tool.from_function(
 	get_db_overview,
@@ -122,6 +163,27 @@ AddProductTool = Tool.from_function(
 				"This function returns a message if the product was added successfully or not."
 )
 
+ReportSnapshotTool = Tool.from_function(
+	get_report_snapshot,
+	return_direct=False,
+	args_schema=None,
+	name="Precomputed Report Tool",
+	description="This tool should be used first for common questions about stock expiring soon, expired stock or low stock. "
+				"This function takes one input, the report name, one of: expiring_7, expiring_30, expiring_90 (products expiring within 7, 30 or 90 days), "
+				"expired (batches already out of date) or low_stock (products that need reordering). "
+				"This function returns the latest precomputed report instantly."
+)
+
+ProductLookupTool = Tool.from_function(
+	find_product,
+	return_direct=False,
+	args_schema=None,
+	name="Product Name Lookup Tool",
+	description="This tool should be used when you need the exact name or id of a product the user mentioned, e.g. when it may be misspelled. "
+				"This function takes one input, the product name as the user wrote it. "
+				"This function returns the closest stored product names with their ids, instantly and without running any SQL."
+)
+
 DatetimeTool = Tool.from_function(
 	get_current_date_tool,
 	return_direct=False,
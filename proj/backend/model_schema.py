@@ -1,6 +1,6 @@
 from typing import List, Optional
 from datetime import date
-from sqlalchemy import ForeignKey, String, Text, Date, Numeric
+from sqlalchemy import ForeignKeyConstraint, Index, String, Text, Date, Numeric, UniqueConstraint
 from sqlalchemy.orm import DeclarativeBase
 from sqlalchemy.orm import Mapped
 from sqlalchemy.orm import mapped_column
@@ -11,8 +11,22 @@ class Base(DeclarativeBase):
 	pass
 
 
-class Product(Base):
+class TenantMixin:
+	"""
+	Rows of one pharmacy branch (store), see tenancy.py. store_id is filled in from the current store on flush,
+	and every index used by the queries starts with it.
+	"""
+	store_id: Mapped[int] = mapped_column(nullable=False)
+
+
+class Product(TenantMixin, Base):
     __tablename__ = "products"
+    __table_args__ = (
+        # Target of the (store_id, product_id) foreign keys, a branch can only reference its own products.
+        UniqueConstraint("store_id", "id", name="uq_products_store_id"),
+        Index("ix_products_store_name", "store_id", "product_name"),
+        Index("ix_products_store_stock", "store_id", "stock_count"),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     product_name: Mapped[Optional[str]] = mapped_column(String(100))
@@ -28,11 +42,16 @@ class Product(Base):
 
 
 
-class Order(Base):
+class Order(TenantMixin, Base):
 	__tablename__ = "orders"
+	__table_args__ = (
+		ForeignKeyConstraint(["store_id", "product_id"], ["products.store_id", "products.id"], ondelete="CASCADE"),
+		Index("ix_orders_store_date", "store_id", "order_date"),
+		Index("ix_orders_store_product", "store_id", "product_id"),
+	)
 
 	order_id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
-	product_id: Mapped[int] = mapped_column(ForeignKey("products.id", ondelete="CASCADE"))
+	product_id: Mapped[int]
 	order_date: Mapped[date] = mapped_column(Date)
 	quantity: Mapped[int]
 	date_expected: Mapped[Optional[date]] = mapped_column(Date)
@@ -41,11 +60,16 @@ class Order(Base):
 	product: Mapped["Product"] = relationship(back_populates="orders")
 
 
-class ProductExpiry(Base):
+class ProductExpiry(TenantMixin, Base):
     __tablename__ = "expiry"
+    __table_args__ = (
+        ForeignKeyConstraint(["store_id", "product_id"], ["products.store_id", "products.id"], ondelete="CASCADE"),
+        Index("ix_expiry_store_date", "store_id", "expiry_date"),
+        Index("ix_expiry_store_product", "store_id", "product_id"),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
-    product_id: Mapped[int] = mapped_column(ForeignKey("products.id", ondelete="CASCADE"), nullable=False)
+    product_id: Mapped[int] = mapped_column(nullable=False)
     expiry_date: Mapped[date] = mapped_column(Date, nullable=False)
     quantity: Mapped[int] = mapped_column(nullable=False)
 
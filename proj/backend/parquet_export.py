@@ -0,0 +1,199 @@
+# Columnar Parquet snapshots of products, orders and expiry for BI and forecasting jobs.
+# Rows are streamed from a read replica through a server-side cursor and written in record batches,
+# partitioned by store, and orders and expiry also by month (hive style, store_id=N/month=YYYY-MM), so a year of
+# history of a branch is scanned without paging through the JSON endpoints. Each snapshot is written to a
+# temporary directory and renamed into place, with a manifest listing its files, and the backend serves the
+# files with range support (see backend.py).
+#
+# Runs on an interval inside the backend process, or on demand:
+#   python -m proj.backend.parquet_export
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import Date, Integer, Numeric, select
+
+from proj.backend.database_orm import DatabaseManager
+from proj.backend.model_schema import Product, Order, ProductExpiry
+from proj.backend.tenancy import store_ids, tenant
+
+try:
+	import pyarrow as pa
+	import pyarrow.parquet as pq
+except ImportError:  # pyarrow is optional, without it the export is disabled.
+	pa = pq = None
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+EXPORT_DIR = os.getenv("PARQUET_EXPORT_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "exports"))
+EXPORT_BATCH_ROWS = int(os.getenv("PARQUET_BATCH_ROWS", "50000"))
+EXPORT_KEEP = int(os.getenv("PARQUET_KEEP", "3"))  # Snapshots kept, older ones are removed.
+EXPORT_INTERVAL_S = float(os.getenv("PARQUET_EXPORT_INTERVAL_S", "86400"))  # 0 disables the in-process schedule.
+MANIFEST = "manifest.json"
+
+# Table -> (model, month partition column or None).
+EXPORT_TABLES = {
+	"products": (Product, None),
+	"orders": (Order, "order_date"),
+	"expiry": (ProductExpiry, "expiry_date"),
+}
+
+
+def _arrow_type(column):
+	if isinstance(column.type, Integer):
+		return pa.int64()
+	if isinstance(column.type, Date):
+		return pa.date32()
+	if isinstance(column.type, Numeric):
+		return pa.decimal128(column.type.precision, column.type.scale)
+	return pa.string()
+
+
+def arrow_schema(model) -> "pa.Schema":
+	return pa.schema([pa.field(column.name, _arrow_type(column)) for column in model.__table__.columns])
+
+
+class _PartitionWriters:
+	"""One ParquetWriter per partition, opened on the first batch for that partition."""
+
+	def __init__(self, table_dir: str, schema: "pa.Schema"):
+		self.table_dir = table_dir
+		self.schema = schema
+		self._writers: Dict[str, Any] = {}
+		self.rows: Dict[str, int] = defaultdict(int)
+
+	def path(self, partition: str) -> str:
+		return os.path.join(self.table_dir, partition, "part-0.parquet")
+
+	def write(self, partition: str, rows: List[tuple]):
+		writer = self._writers.get(partition)
+		if writer is None:
+			os.makedirs(os.path.dirname(self.path(partition)), exist_ok=True)
+			writer = self._writers[partition] = pq.ParquetWriter(self.path(partition), self.schema, compression="zstd")
+		columns = list(zip(*rows))
+		writer.write_batch(pa.RecordBatch.from_arrays(
+			[pa.array(values, type=field.type) for values, field in zip(columns, self.schema)], schema=self.schema
+		))
+		self.rows[partition] += len(rows)
+
+	def close(self) -> List[Dict[str, Any]]:
+		files = []
+		for partition, writer in self._writers.items():
+			writer.close()
+			files.append({
+				"partition": partition,
+				"path": os.path.relpath(self.path(partition), os.path.dirname(self.table_dir)),
+				"rows": self.rows[partition],
+				"bytes": os.path.getsize(self.path(partition))
+			})
+		return sorted(files, key=lambda file: file["path"])
+
+
+def export_table(db: DatabaseManager, table: str, snapshot_dir: str) -> Dict[str, Any]:
+	"""Stream one table into Parquet, store by store, partitioned by month when the table has a partition column."""
+	model, partition_column = EXPORT_TABLES[table]
+	schema = arrow_schema(model)
+	writers = _PartitionWriters(os.path.join(snapshot_dir, table), schema)
+	partition_index = schema.get_field_index(partition_column) if partition_column else None
+
+	try:
+		for store_id in store_ids():
+			query = select(*model.__table__.columns).where(model.__table__.c.store_id == store_id)
+			if partition_column:
+				# Ordered by month, so each partition's rows arrive together and its writer gets large batches.
+				query = query.order_by(model.__table__.c[partition_column])
+			# Each store is read from its own database host.
+			with tenant(store_id), db.session(readonly=True) as session:
+				result = session.execute(query.execution_options(stream_results=True, yield_per=EXPORT_BATCH_ROWS))
+				for rows in result.partitions(EXPORT_BATCH_ROWS):
+					if partition_index is None:
+						writers.write(f"store_id={store_id}", rows)
+						continue
+					by_month = defaultdict(list)
+					for row in rows:
+						value = row[partition_index]
+						by_month[value.strftime("%Y-%m") if value else "unknown"].append(row)
+					for month, month_rows in by_month.items():
+						writers.write(os.path.join(f"store_id={store_id}", f"month={month}"), month_rows)
+	finally:
+		files = writers.close()
+	return {
+		"rows": sum(file["rows"] for file in files),
+		"partitioned_by": ["store_id"] + ([partition_column] if partition_column else []),
+		"files": files
+	}
+
+
+def run_export(db: DatabaseManager, export_dir: str = EXPORT_DIR) -> Dict[str, Any]:
+	"""Write a new snapshot of every table and return its manifest."""
+	if pa is None:
+		raise RuntimeError("pyarrow is not installed, the Parquet export is disabled")
+
+	snapshot_id = datetime.now().strftime("%Y%m%dT%H%M%S")
+	tmp_dir = os.path.join(export_dir, f".{snapshot_id}.tmp")
+	os.makedirs(tmp_dir, exist_ok=True)
+	try:
+		tables = {table: export_table(db, table, tmp_dir) for table in EXPORT_TABLES}
+		manifest = {"snapshot_id": snapshot_id, "generated_at": datetime.now().isoformat(timespec="seconds"), "tables": tables}
+		with open(os.path.join(tmp_dir, MANIFEST), "w") as f:
+			json.dump(manifest, f)
+		os.replace(tmp_dir, os.path.join(export_dir, snapshot_id))
+	except Exception:
+		shutil.rmtree(tmp_dir, ignore_errors=True)
+		raise
+
+	for old_snapshot in list_snapshots(export_dir)[EXPORT_KEEP:]:
+		shutil.rmtree(os.path.join(export_dir, old_snapshot), ignore_errors=True)
+	logger.info(f"Parquet snapshot {snapshot_id} written: { {table: info['rows'] for table, info in tables.items()} }")
+	return manifest
+
+
+def list_snapshots(export_dir: str = EXPORT_DIR) -> List[str]:
+	"""Completed snapshot ids, newest first."""
+	if not os.path.isdir(export_dir):
+		return []
+	return sorted(
+		(
+			name for name in os.listdir(export_dir)
+			if not name.startswith(".") and os.path.isfile(os.path.join(export_dir, name, MANIFEST))
+		),
+		reverse=True
+	)
+
+
+def load_manifest(snapshot_id: str = None, export_dir: str = EXPORT_DIR) -> Optional[Dict[str, Any]]:
+	"""The manifest of the given (or the latest) snapshot, None if there is none."""
+	snapshot_id = snapshot_id or next(iter(list_snapshots(export_dir)), None)
+	if snapshot_id is None or snapshot_id not in list_snapshots(export_dir):
+		return None
+	with open(os.path.join(export_dir, snapshot_id, MANIFEST)) as f:
+		return json.load(f)
+
+
+def start_export_scheduler(db: DatabaseManager, interval_s: float = EXPORT_INTERVAL_S) -> Optional[threading.Thread]:
+	"""Export on start and then every interval_s, in a daemon thread."""
+	if pa is None or interval_s <= 0:
+		return None
+
+	def run():
+		while True:
+			try:
+				run_export(db)
+			except Exception as e:
+				logger.error(f"Parquet export failed: {str(e)}")
+			time.sleep(interval_s)
+
+	thread = threading.Thread(target=run, name="parquet-export", daemon=True)
+	thread.start()
+	return thread
+
+
+if __name__ == "__main__":
+	print(json.dumps(run_export(DatabaseManager()), indent=2))
@@ -0,0 +1,180 @@
+# In-memory product name index.
+# Resolves a product name as typed by a user (or written by the LLM into a WHERE clause) to the stored product,
+# by normalised exact match or trigram similarity, in microseconds instead of another LLM iteration.
+# Built from the products table and kept current by the DatabaseManager write listener; writes made elsewhere
+# (other processes, NL2SQL DML) are picked up by a rebuild once the index is marked stale or gets old.
+# Each store (see tenancy.py) has its own index, names only resolve to the current store's products.
+import logging
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import select
+
+from proj.backend.database_orm import DatabaseManager
+from proj.backend.model_schema import Product
+from proj.backend.tenancy import current_store_id
+
+logger = logging.getLogger(__name__)
+
+PRODUCT_INDEX_REFRESH_S = float(os.getenv("PRODUCT_INDEX_REFRESH_S", "300"))
+PRODUCT_MATCH_MIN_SCORE = float(os.getenv("PRODUCT_MATCH_MIN_SCORE", "0.55"))
+PRODUCT_MATCH_MARGIN = 0.1  # A fuzzy match is only trusted when it beats the runner up by this much.
+
+_NON_WORD = re.compile(r"[^a-z0-9]+")
+
+
+def normalise(name: str) -> str:
+	return _NON_WORD.sub(" ", name.lower()).strip()
+
+
+def trigrams(normalised: str) -> Set[str]:
+	padded = f"  {normalised} "
+	return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+@dataclass
+class ProductMatch:
+	id: int
+	name: str
+	score: float  # 1.0 for an exact (normalised) match
+
+
+class ProductNameIndex:
+	"""Exact and trigram lookups over product names."""
+
+	def __init__(self):
+		self._names: Dict[int, str] = {}
+		self._exact: Dict[str, Set[int]] = defaultdict(set)
+		self._postings: Dict[str, Set[int]] = defaultdict(set)
+		self._trigram_counts: Dict[int, int] = {}
+		self._lock = threading.RLock()
+		# Held while the products are read for a rebuild, so only one lookup of the store runs the query.
+		self.rebuild_lock = threading.Lock()
+		self.built_at = 0.0
+		self.stale = True
+
+	def rebuild(self, products: Iterable[Tuple[int, str]]):
+		with self._lock:
+			self._names.clear()
+			self._exact.clear()
+			self._postings.clear()
+			self._trigram_counts.clear()
+			for product_id, name in products:
+				self.upsert(product_id, name)
+			self.built_at = time.time()
+
+	def upsert(self, product_id: int, name: Optional[str]):
+		with self._lock:
+			self.remove(product_id)
+			if not name:
+				return
+			normalised = normalise(name)
+			grams = trigrams(normalised)
+			self._names[product_id] = name
+			self._exact[normalised].add(product_id)
+			for gram in grams:
+				self._postings[gram].add(product_id)
+			self._trigram_counts[product_id] = len(grams)
+
+	def remove(self, product_id: int):
+		with self._lock:
+			name = self._names.pop(product_id, None)
+			if name is None:
+				return
+			normalised = normalise(name)
+			self._exact[normalised].discard(product_id)
+			for gram in trigrams(normalised):
+				self._postings[gram].discard(product_id)
+			self._trigram_counts.pop(product_id, None)
+
+	def lookup(self, name: str, limit: int = 5) -> List[ProductMatch]:
+		"""Best matches for the name, scored by the mean of trigram Dice similarity and query coverage."""
+		normalised = normalise(name)
+		if not normalised:
+			return []
+		with self._lock:
+			exact = [ProductMatch(product_id, self._names[product_id], 1.0) for product_id in self._exact.get(normalised, ())]
+			if exact:
+				return exact[:limit]
+
+			query_grams = trigrams(normalised)
+			shared: Dict[int, int] = defaultdict(int)
+			for gram in query_grams:
+				for product_id in self._postings.get(gram, ()):
+					shared[product_id] += 1
+
+			matches = []
+			for product_id, count in shared.items():
+				dice = 2 * count / (len(query_grams) + self._trigram_counts[product_id])
+				coverage = count / len(query_grams)  # "paracetamol" fully inside "Paracetamol 500mg Tablets"
+				matches.append(ProductMatch(product_id, self._names[product_id], round((dice + coverage) / 2, 3)))
+		matches.sort(key=lambda match: match.score, reverse=True)
+		return matches[:limit]
+
+	def resolve(self, name: str) -> Optional[ProductMatch]:
+		"""The one product the name refers to, None when there is no confident match."""
+		matches = self.lookup(name, limit=2)
+		if not matches or matches[0].score < PRODUCT_MATCH_MIN_SCORE:
+			return None
+		if matches[0].score < 1.0 and len(matches) > 1 and matches[0].score - matches[1].score < PRODUCT_MATCH_MARGIN:
+			return None
+		return matches[0]
+
+	def mark_stale(self):
+		"""Products changed where no listener saw it (e.g. NL2SQL DML), rebuild on the next lookup."""
+		self.stale = True
+
+	def needs_rebuild(self) -> bool:
+		return self.stale or time.time() - self.built_at > PRODUCT_INDEX_REFRESH_S
+
+	def __len__(self):
+		return len(self._names)
+
+
+_indexes: Dict[int, ProductNameIndex] = {}
+_index_lock = threading.Lock()
+
+
+def _on_write(action: str, entity: object):
+	"""DatabaseManager write listener for product inserts, renames and deletes."""
+	if getattr(entity, "__tablename__", None) != "products" or entity.store_id not in _indexes:
+		return
+	index = _indexes[entity.store_id]
+	if action == "delete":
+		index.remove(entity.id)
+	else:
+		index.upsert(entity.id, entity.product_name)
+
+
+def get_product_index() -> ProductNameIndex:
+	"""The current store's index, (re)built from the products table when stale or older than PRODUCT_INDEX_REFRESH_S."""
+	store_id = current_store_id()
+	with _index_lock:
+		if not _indexes:
+			DatabaseManager().add_write_listener(_on_write)
+		index = _indexes.setdefault(store_id, ProductNameIndex())
+	if not index.needs_rebuild():
+		return index
+
+	# Outside _index_lock, so other stores' lookups do not wait for this store's query.
+	with index.rebuild_lock:
+		if not index.needs_rebuild():
+			return index  # Rebuilt by the lookup this one waited for.
+		# After a mark_stale the write may not have reached the replicas yet, so that rebuild reads the primary.
+		was_stale, use_replica = index.stale, not index.stale or not index.built_at
+		# Cleared before reading, so a mark_stale during the rebuild still triggers the next one.
+		index.stale = False
+		try:
+			with DatabaseManager().session(readonly=True, use_replica=use_replica) as session:
+				index.rebuild(session.execute(select(Product.id, Product.product_name)).all())
+			logger.info(f"Product name index of store {store_id} built with {len(index)} products")
+		except Exception as e:
+			# Keep serving the previous index, it is retried on the next lookup.
+			index.stale = index.stale or was_stale
+			logger.error(f"Failed to build the product name index of store {store_id}: {str(e)}")
+	return index
@@ -0,0 +1,111 @@
+# Storage for the precomputed expiry / stock reports.
+# Snapshots are JSON files, so the backend, the agent process and a sidecar scheduler can all share them
+# without importing the ORM models. Writes anywhere touch a marker file, which tells the scheduler to refresh,
+# and one per store and table, which tells the analytics mirror which tables to resync.
+# Each store (see tenancy.py) has its own directory of snapshots.
+import json
+import os
+import tempfile
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from proj.backend.tenancy import current_store_id
+
+SNAPSHOT_DIR = os.getenv("REPORT_SNAPSHOT_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "report_snapshots"))
+REPORT_NAMES = ("expiring_7", "expiring_30", "expiring_90", "expired", "low_stock")
+DIRTY_MARKER = ".dirty"
+
+# Tables whose writes change the reports.
+REPORT_TABLES = {"products", "expiry"}
+
+# (store, name) -> (file mtime, snapshot), so repeated reads of an unchanged file are free.
+_cache: Dict[Tuple[int, str], tuple] = {}
+_cache_lock = threading.Lock()
+
+
+def _snapshot_path(name: str, store_id: int) -> str:
+	return os.path.join(SNAPSHOT_DIR, str(store_id), f"{name}.json")
+
+
+def save_snapshot(name: str, rows: List[Dict[str, Any]], store_id: int = None) -> Dict[str, Any]:
+	"""Write the (current store's) report atomically, readers never see a half written file."""
+	store_id = current_store_id() if store_id is None else store_id
+	snapshot = {
+		"name": name,
+		"store_id": store_id,
+		"generated_at": datetime.now().isoformat(timespec="seconds"),
+		"row_count": len(rows),
+		"rows": rows,
+	}
+	path = _snapshot_path(name, store_id)
+	os.makedirs(os.path.dirname(path), exist_ok=True)
+	# A temporary file of its own per write (the backend, the agent and a sidecar may write at once),
+	# in the same directory, so the replace stays on one filesystem and is atomic.
+	f = tempfile.NamedTemporaryFile("w", dir=os.path.dirname(path), prefix=f".{name}.", suffix=".tmp", delete=False)
+	try:
+		with f:
+			json.dump(snapshot, f, default=str)
+		os.replace(f.name, path)
+	except BaseException:
+		os.unlink(f.name)
+		raise
+	return snapshot
+
+
+def load_snapshot(name: str, store_id: int = None) -> Optional[Dict[str, Any]]:
+	"""Latest snapshot of the (current store's) report, or None if it has not been generated yet."""
+	if name not in REPORT_NAMES:
+		return None
+	store_id = current_store_id() if store_id is None else store_id
+	path = _snapshot_path(name, store_id)
+	try:
+		mtime = os.path.getmtime(path)
+	except OSError:
+		return None
+
+	with _cache_lock:
+		cached = _cache.get((store_id, name))
+		if cached and cached[0] == mtime:
+			return cached[1]
+
+	with open(path) as f:
+		snapshot = json.load(f)
+	with _cache_lock:
+		_cache[(store_id, name)] = (mtime, snapshot)
+	return snapshot
+
+
+def _dirty_path(table: str = None, store_id: int = None) -> str:
+	if table is None:
+		return os.path.join(SNAPSHOT_DIR, DIRTY_MARKER)
+	return os.path.join(SNAPSHOT_DIR, str(store_id), f"{DIRTY_MARKER}.{table}")
+
+
+def mark_dirty(table: str = None, store_id: int = None) -> None:
+	"""
+	Flag that report data changed, the scheduler refreshes the snapshots shortly after. With a table, also flag
+	that table of the (current) store as changed.
+	"""
+	paths = [_dirty_path()]
+	if table:
+		paths.append(_dirty_path(table, current_store_id() if store_id is None else store_id))
+	for path in paths:
+		os.makedirs(os.path.dirname(path), exist_ok=True)
+		with open(path, "w") as f:
+			f.write(datetime.now().isoformat())
+
+
+def mark_dirty_on_write(action: str, entity: object) -> None:
+	"""DatabaseManager write listener, only product and expiry writes affect the reports."""
+	table = getattr(entity, "__tablename__", None)
+	if table in REPORT_TABLES:
+		mark_dirty(table, getattr(entity, "store_id", None))
+
+
+def dirty_since(table: str = None, store_id: int = None) -> float:
+	"""Time of the last relevant write (to the table of the store, if given), 0 if there was none."""
+	try:
+		return os.path.getmtime(_dirty_path(table, store_id))
+	except OSError:
+		return 0.0
@@ -0,0 +1,150 @@
+# Precomputed expiry and reorder reports.
+# A scheduler refreshes the expiring-in-7/30/90-days, expired and low-stock reports at configured times
+# and shortly after relevant writes, so the API, agent tools and UI can read the latest snapshot instantly
+# instead of every morning question running its own LLM + SQL round trip.
+#
+# Runs inside the backend process (see backend.py), or as a sidecar worker:
+#   python -m proj.backend.reports
+import logging
+import os
+import threading
+import time
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List
+
+from sqlalchemy import select
+
+from proj.backend.database_orm import DatabaseManager
+from proj.backend.model_schema import Product, ProductExpiry
+from proj.backend.report_snapshots import REPORT_NAMES, save_snapshot, dirty_since, mark_dirty_on_write
+from proj.backend.tenancy import store_ids, tenant
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+LOW_STOCK_THRESHOLD = int(os.getenv("LOW_STOCK_THRESHOLD", "20"))
+REPORT_TIMES = os.getenv("REPORT_TIMES", "06:30,12:00")  # Daily refresh times, HH:MM local time.
+REPORT_DEBOUNCE_S = float(os.getenv("REPORT_DEBOUNCE_S", "10"))  # Wait for a burst of writes to settle.
+REPORT_POLL_S = 5.0
+
+
+def _expiry_rows(session, start: date = None, end: date = None) -> List[Dict[str, Any]]:
+	query = select(ProductExpiry, Product.product_name).join(Product).order_by(ProductExpiry.expiry_date)
+	if start:
+		query = query.where(ProductExpiry.expiry_date >= start)
+	if end:
+		query = query.where(ProductExpiry.expiry_date <= end)
+	return [{
+		"batch_id": expiry.id,
+		"product_id": expiry.product_id,
+		"product_name": product_name,
+		"expiry_date": expiry.expiry_date.isoformat(),
+		"quantity": expiry.quantity
+	} for expiry, product_name in session.execute(query)]
+
+
+def _low_stock_rows(session) -> List[Dict[str, Any]]:
+	query = select(Product).where(Product.stock_count < LOW_STOCK_THRESHOLD).order_by(Product.stock_count)
+	return [{
+		"id": product.id,
+		"product_name": product.product_name,
+		"supplier": product.supplier,
+		"category": product.category,
+		"stock_count": product.stock_count
+	} for product in session.execute(query).scalars()]
+
+
+def build_report(session, name: str, today: date) -> List[Dict[str, Any]]:
+	if name.startswith("expiring_"):
+		return _expiry_rows(session, today, today + timedelta(days=int(name.split("_")[1])))
+	if name == "expired":
+		return _expiry_rows(session, end=today - timedelta(days=1))
+	if name == "low_stock":
+		return _low_stock_rows(session)
+	raise ValueError(f"Unknown report: {name}")
+
+
+def refresh_reports(db: DatabaseManager) -> Dict[int, Dict[str, int]]:
+	"""Recompute every report of every store, one session per store, returns the row count per store and report."""
+	today = date.today()
+	counts = {}
+	for store_id in store_ids():
+		# A replica may be a few seconds behind, well within the write debounce.
+		with tenant(store_id), db.session(readonly=True) as session:
+			counts[store_id] = {name: save_snapshot(name, build_report(session, name, today))["row_count"] for name in REPORT_NAMES}
+	logger.info(f"Refreshed report snapshots: {counts}")
+	return counts
+
+
+def _parse_times(times: str) -> List[tuple]:
+	parsed = []
+	for value in times.split(","):
+		if value.strip():
+			hour, minute = value.strip().split(":")
+			parsed.append((int(hour), int(minute)))
+	return sorted(parsed)
+
+
+def next_run_after(now: datetime, times: List[tuple]) -> datetime:
+	"""The next configured time of day after now."""
+	for day in range(2):
+		for hour, minute in times:
+			candidate = (now + timedelta(days=day)).replace(hour=hour, minute=minute, second=0, microsecond=0)
+			if candidate > now:
+				return candidate
+	return now + timedelta(days=1)
+
+
+class ReportScheduler(threading.Thread):
+	"""Refreshes the snapshots at the configured times and after writes to products or expiry."""
+
+	def __init__(self, db: DatabaseManager, times: str = REPORT_TIMES, debounce_s: float = REPORT_DEBOUNCE_S):
+		super().__init__(name="report-scheduler", daemon=True)
+		self.db = db
+		self.times = _parse_times(times)
+		self.debounce_s = debounce_s
+		self._stop_event = threading.Event()
+		self._last_run = 0.0
+
+	def refresh(self):
+		self._last_run = time.time()
+		try:
+			refresh_reports(self.db)
+		except Exception as e:
+			logger.error(f"Failed to refresh report snapshots: {str(e)}")
+
+	def run(self):
+		# Fresh snapshots on start, so a restart never serves yesterday's expiry list.
+		self.refresh()
+		next_run = next_run_after(datetime.now(), self.times) if self.times else None
+
+		while not self._stop_event.wait(REPORT_POLL_S):
+			if next_run and datetime.now() >= next_run:
+				self.refresh()
+				next_run = next_run_after(datetime.now(), self.times)
+				continue
+
+			last_write = dirty_since()
+			if last_write > self._last_run and time.time() - last_write >= self.debounce_s:
+				self.refresh()
+
+	def stop(self):
+		self._stop_event.set()
+
+
+def start_report_scheduler(db: DatabaseManager) -> ReportScheduler:
+	"""Start the scheduler and have writes made through this DatabaseManager trigger a refresh."""
+	db.add_write_listener(mark_dirty_on_write)
+	scheduler = ReportScheduler(db)
+	scheduler.start()
+	return scheduler
+
+
+if __name__ == "__main__":
+	# Sidecar mode: refresh on schedule and after writes flagged by the other processes.
+	scheduler = start_report_scheduler(DatabaseManager())
+	try:
+		while scheduler.is_alive():
+			scheduler.join(timeout=1)
+	except KeyboardInterrupt:
+		scheduler.stop()
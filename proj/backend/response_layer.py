@@ -0,0 +1,81 @@
+# Response layer for the Flask backend.
+# Rows are serialised with orjson (dates natively, Decimal through a default hook) instead of stdlib json,
+# responses carry an ETag so unchanged data is answered with 304, and large bodies are compressed
+# with zstd or gzip depending on what the client accepts.
+import gzip
+import hashlib
+import os
+from decimal import Decimal
+from typing import Any, Optional
+
+import orjson
+from flask import Response, request
+
+try:
+	import zstandard
+except ImportError:  # zstd is optional, gzip is always available.
+	zstandard = None
+
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "5"))
+ZSTD_LEVEL = int(os.getenv("ZSTD_LEVEL", "3"))
+
+
+def _default(obj: Any) -> Any:
+	# orjson handles date / datetime itself, Decimal (Numeric columns like cost) needs a hook.
+	if isinstance(obj, Decimal):
+		return float(obj)
+	raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def dumps(data: Any) -> bytes:
+	return orjson.dumps(data, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+	"""Pick zstd or gzip from the Accept-Encoding header, honouring q=0."""
+	accepted = {}
+	for part in (accept_encoding or "").split(","):
+		name, _, params = part.strip().partition(";")
+		quality = 1.0
+		if params.strip().startswith("q="):
+			try:
+				quality = float(params.strip()[2:])
+			except ValueError:
+				quality = 0.0
+		if name:
+			accepted[name.strip().lower()] = quality
+
+	if zstandard is not None and accepted.get("zstd", 0) > 0:
+		return "zstd"
+	if accepted.get("gzip", 0) > 0 or accepted.get("*", 0) > 0:
+		return "gzip"
+	return None
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+	if encoding == "zstd":
+		return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(body)
+	return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+
+def json_response(data: Any, status: int = 200) -> Response:
+	"""orjson response with an ETag (304 when unchanged) and compression above COMPRESS_MIN_BYTES."""
+	body = dumps(data)
+	response = Response(body, status=status, mimetype="application/json")
+	response.vary.add("Accept-Encoding")
+	if status != 200:
+		return response
+
+	# Weak, as the compressed representations differ byte-wise but carry the same data.
+	response.set_etag(hashlib.sha1(body).hexdigest(), weak=True)
+	response = response.make_conditional(request)
+	if response.status_code == 304:
+		return response
+
+	if len(body) >= COMPRESS_MIN_BYTES:
+		encoding = negotiate_encoding(request.headers.get("Accept-Encoding", ""))
+		if encoding:
+			response.set_data(compress(body, encoding))
+			response.headers["Content-Encoding"] = encoding
+	return response
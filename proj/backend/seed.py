@@ -0,0 +1,118 @@
+from datetime import date, timedelta
+from typing import Iterable
+
+from sqlalchemy import ForeignKeyConstraint, UniqueConstraint, create_engine, inspect, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from sqlalchemy.schema import AddConstraint, CreateIndex
+
+from proj.backend.model_schema import Base, Product, Order, ProductExpiry
+from proj.backend.tenancy import DEFAULT_STORE_ID
+
+
+# Deterministic seed data for local evaluation and load testing.
+# Product names match the few-shot examples and the example prompts shown in the UI.
+SEED_PRODUCTS = [
+	# (product_name, supplier, category, stock_count, cost)
+	("Paracetamol", "Boots", "Medicine", 240, 1.99),
+	("Aspirin", "Bayer", "General", 100, 2.49),
+	("Ibuprofen", "Nurofen", "Medicine", 15, 3.25),
+	("Carrington Antifungal", "Carrington", "Medicine", 8, 6.75),
+	("Midodrine Hydrochloride", "Mylan", "Prescription", 42, 12.50),
+	("Amoxicillin", "Sandoz", "Prescription", 12, 8.99),
+	("Cetirizine", "Zyrtec", "Medicine", 64, 4.10),
+	("Omeprazole", "Teva", "Prescription", 5, 5.60),
+	("Vitamin C", "Holland", "Supplement", 180, 3.99),
+	("Plasters", "Elastoplast", "First Aid", 300, 1.50),
+]
+
+
+def seed_database(engine: Engine, today: date = None, store_ids: Iterable[int] = (DEFAULT_STORE_ID,)) -> None:
+	"""
+	Recreate the schema on the given engine and fill it with deterministic rows, relative to today.
+	Every store in store_ids gets the same rows, e.g. to load test a multi-branch deployment.
+	"""
+	today = today or date.today()
+
+	Base.metadata.drop_all(engine)
+	Base.metadata.create_all(engine)
+
+	for store_id in store_ids:
+		_seed_store(engine, today, store_id)
+
+
+def _seed_store(engine: Engine, today: date, store_id: int) -> None:
+	# The session's store as well, for the tenant checks when database_orm is loaded (see database_orm._assign_store).
+	with Session(engine, info={"store_id": store_id}) as session:
+		products = [
+			Product(
+				store_id=store_id,
+				product_name=name,
+				supplier=supplier,
+				category=category,
+				stock_count=stock_count,
+				cost=cost,
+				description=f"Seeded {category.lower()} product."
+			)
+			for name, supplier, category, stock_count, cost in SEED_PRODUCTS
+		]
+		session.add_all(products)
+		session.flush()
+
+		for i, product in enumerate(products):
+			# Spread the batches from already expired to a year out.
+			session.add_all([
+				ProductExpiry(store_id=store_id, product_id=product.id, expiry_date=today + timedelta(days=(i * 37) % 400 - 30), quantity=10 + i * 5),
+				ProductExpiry(store_id=store_id, product_id=product.id, expiry_date=today + timedelta(days=(i * 53) % 200 + 3), quantity=20 + i),
+			])
+			# Some products are ordered more than others, so "most popular" has a single answer.
+			for n in range(len(products) - i):
+				order_date = today - timedelta(days=n * 9 + i)
+				session.add(Order(
+					store_id=store_id,
+					product_id=product.id,
+					order_date=order_date,
+					quantity=50 + n * 10,
+					date_expected=order_date + timedelta(days=5)
+				))
+
+		session.commit()
+
+
+def migrate_to_tenancy(engine: Engine, store_id: int = DEFAULT_STORE_ID) -> None:
+	"""
+	Add the store_id column, keys and indexes (see model_schema.TenantMixin) to a database created before
+	the tenancy change. Existing rows are assigned to store_id. Tables that already have the column are skipped.
+	"""
+	inspector = inspect(engine)
+	with engine.begin() as connection:
+		# Products first, the new foreign keys of orders and expiry reference its (store_id, id) key.
+		for table in Base.metadata.sorted_tables:
+			if "store_id" in {column["name"] for column in inspector.get_columns(table.name)}:
+				continue
+			for foreign_key in inspector.get_foreign_keys(table.name):
+				connection.execute(text(f"ALTER TABLE `{table.name}` DROP FOREIGN KEY `{foreign_key['name']}`"))
+			connection.execute(text(f"ALTER TABLE `{table.name}` ADD COLUMN `store_id` INTEGER NOT NULL DEFAULT {int(store_id)}"))
+			connection.execute(text(f"ALTER TABLE `{table.name}` ALTER COLUMN `store_id` DROP DEFAULT"))
+			for constraint in table.constraints:
+				if isinstance(constraint, (UniqueConstraint, ForeignKeyConstraint)):
+					connection.execute(AddConstraint(constraint))
+			for index in table.indexes:
+				connection.execute(CreateIndex(index))
+
+
+if __name__ == "__main__":
+	import argparse
+
+	parser = argparse.ArgumentParser(description="Seed a local database with deterministic ShelfCare data.")
+	parser.add_argument("db_uri", help="SQLAlchemy database URI, e.g. mysql://root:@127.0.0.1:3306/gemma_comp_eval")
+	parser.add_argument("--stores", default=str(DEFAULT_STORE_ID), help="Comma separated store ids to seed, e.g. 1,2,3")
+	parser.add_argument("--migrate-tenancy", action="store_true", help="Add store_id to an existing database instead of seeding it")
+	args = parser.parse_args()
+
+	if args.migrate_tenancy:
+		migrate_to_tenancy(create_engine(args.db_uri))
+		print("Migrated: ", args.db_uri)
+	else:
+		seed_database(create_engine(args.db_uri), store_ids=[int(store) for store in args.stores.split(",")])
+		print("Seeded: ", args.db_uri)
@@ -0,0 +1,296 @@
+# Multi-pharmacy tenancy.
+# Every branch (store) shares the schema: products, orders and expiry rows carry a store_id, and every index the
+# queries use leads with it (see model_schema.py), so a branch's queries only ever read that branch's index range.
+# The current store lives in a context variable, set per request (X-Store-Id) or per job, and is applied:
+#   - to ORM statements and new rows by the session hooks in database_orm.py,
+#   - to model generated SQL by scope_sql() below, before NL2SQL runs it.
+# Stores can be placed on other database hosts (DB_TENANT_HOSTS), stores on the same host share one engine
+# and its pool, so connections grow with the number of hosts, not the number of branches.
+import contextlib
+import contextvars
+import os
+import re
+from typing import Dict, List, Optional
+
+DEFAULT_STORE_ID = int(os.getenv("DEFAULT_STORE_ID", "1"))
+# Hosts per store, e.g. "3=db-north,4=db-north,7=db-south", unlisted stores live on DB_HOST.
+DB_TENANT_HOSTS: Dict[int, str] = {
+	int(store.strip()): host.strip()
+	for store, _, host in (entry.partition("=") for entry in os.getenv("DB_TENANT_HOSTS", "").split(",") if "=" in entry)
+}
+# Branches served by this deployment, comma separated ids.
+STORE_IDS = sorted(
+	{int(store) for store in os.getenv("STORE_IDS", "").split(",") if store.strip()} | set(DB_TENANT_HOSTS) | {DEFAULT_STORE_ID}
+)
+STORE_HEADER = "X-Store-Id"
+
+TENANT_TABLES = ("products", "orders", "expiry")
+
+
+class TenantError(ValueError):
+	"""Unknown store, or SQL that can not be scoped to one store safely."""
+
+
+_store_id: contextvars.ContextVar[Optional[int]] = contextvars.ContextVar("store_id", default=None)
+# Set by unscoped(), for jobs that work across all stores (the analytics mirror sync, Parquet export).
+_unscoped: contextvars.ContextVar[bool] = contextvars.ContextVar("unscoped", default=False)
+
+
+def current_store_id() -> int:
+	"""The store of the current request or job, DEFAULT_STORE_ID outside of one (single branch deployments)."""
+	store_id = _store_id.get()
+	return DEFAULT_STORE_ID if store_id is None else store_id
+
+
+def is_unscoped() -> bool:
+	return _unscoped.get()
+
+
+def validate_store_id(value) -> int:
+	try:
+		store_id = int(value)
+	except (TypeError, ValueError):
+		raise TenantError(f"Invalid store id: {value!r}")
+	if store_id not in STORE_IDS:
+		raise TenantError(f"Unknown store: {store_id}")
+	return store_id
+
+
+@contextlib.contextmanager
+def tenant(store_id: int):
+	"""Run the block as the given store."""
+	token = _store_id.set(validate_store_id(store_id))
+	try:
+		yield store_id
+	finally:
+		_store_id.reset(token)
+
+
+@contextlib.contextmanager
+def unscoped():
+	"""Run the block across every store, ORM statements are not filtered by store_id."""
+	token = _unscoped.set(True)
+	try:
+		yield
+	finally:
+		_unscoped.reset(token)
+
+
+def store_ids() -> List[int]:
+	return list(STORE_IDS)
+
+
+def tenant_host(store_id: int = None) -> Optional[str]:
+	"""The database host of the store, None when it lives on the primary (DB_HOST)."""
+	return DB_TENANT_HOSTS.get(current_store_id() if store_id is None else store_id)
+
+
+def bind_request_tenant(app):
+	"""Scope every request of a Flask app to the store in the X-Store-Id header (or ?store_id=), 400 when unknown."""
+	from flask import g, jsonify, request
+
+	@app.before_request
+	def _bind_tenant():
+		try:
+			g.tenant_token = _store_id.set(validate_store_id(
+				request.headers.get(STORE_HEADER) or request.args.get("store_id") or DEFAULT_STORE_ID
+			))
+		except TenantError as e:
+			return jsonify({"error": str(e)}), 400
+
+	@app.teardown_request
+	def _unbind_tenant(exc=None):
+		token = g.pop("tenant_token", None)
+		if token is not None:
+			_store_id.reset(token)
+
+
+# --- Scoping model generated SQL ---
+# The statement is not parsed, every reference to a tenant table is replaced by a derived table holding only the
+# store's rows, e.g. "JOIN orders o" -> "JOIN (SELECT * FROM `orders` WHERE `store_id` = 3) AS `o`". MySQL merges
+# the derived table into the outer query, so the store_id index is used as with a hand written filter.
+# Anything the rewrite can not be sure about (comma joins, schema qualified tables, multi-table DML) is refused.
+# Table references are only looked for outside string literals (and comments), and the rewrite fails closed:
+# a tenant table name still left afterwards, other than as a column qualifier or an alias, refuses the statement.
+
+_KEYWORDS = (
+	"WHERE|JOIN|INNER|LEFT|RIGHT|CROSS|FULL|NATURAL|STRAIGHT_JOIN|ON|USING|GROUP|ORDER|LIMIT|HAVING|UNION|"
+	"EXCEPT|INTERSECT|WINDOW|FOR|LOCK|SET|VALUES"
+)
+# Any join form ends in JOIN: INNER JOIN, LEFT OUTER JOIN, STRAIGHT_JOIN ...
+_TABLE_REFERENCE = re.compile(
+	rf"\b(FROM|\w*JOIN)\s+`?({'|'.join(TENANT_TABLES)})`?(?![\w.`])(?:\s+(?:AS\s+)?(?!(?:{_KEYWORDS})\b)`?(\w+)`?)?",
+	re.IGNORECASE
+)
+# A tenant table name left after the rewrite: comma joined, schema qualified, in parentheses, ...
+_TENANT_NAME = re.compile(rf"(?<!\w)`?({'|'.join(TENANT_TABLES)})`?(?!\w)", re.IGNORECASE)
+_ALIAS_KEYWORD = re.compile(r"\bAS$", re.IGNORECASE)
+_UPDATE = re.compile(rf"^\s*UPDATE\s+`?({'|'.join(TENANT_TABLES)})`?(?:\s+(?:AS\s+)?(?!SET\b)`?(\w+)`?)?\s+SET\s", re.IGNORECASE)
+_DELETE = re.compile(rf"^\s*DELETE\s+FROM\s+`?({'|'.join(TENANT_TABLES)})`?(?![\w.`])", re.IGNORECASE)
+_INSERT = re.compile(rf"^\s*INSERT\s+INTO\s+`?({'|'.join(TENANT_TABLES)})`?\s*\(([^)]*)\)\s*VALUES\s*", re.IGNORECASE)
+_READ = re.compile(r"^\s*\(?\s*(?:SELECT|WITH|EXPLAIN)\b", re.IGNORECASE)
+_METADATA = re.compile(r"^\s*(?:SHOW|DESCRIBE|DESC)\b", re.IGNORECASE)
+
+
+def _top_level(query: str, pattern: re.Pattern, start: int = 0) -> Optional[re.Match]:
+	"""First match of the pattern outside of quotes and parentheses."""
+	depth, quote, i = 0, None, start
+	while i < len(query):
+		char = query[i]
+		if quote:
+			if char == "\\":
+				i += 1
+			elif char == quote:
+				quote = None
+		elif char in "'\"`":
+			quote = char
+		elif char == "(":
+			depth += 1
+		elif char == ")":
+			depth -= 1
+		elif depth == 0:
+			match = pattern.match(query, i)
+			if match and (i == 0 or not (query[i - 1].isalnum() or query[i - 1] == "_")):
+				return match
+		i += 1
+	return None
+
+
+def _strip_comments(query: str) -> str:
+	"""The query without its comments (outside of quotes), each replaced by a space."""
+	out, quote, i = [], None, 0
+	while i < len(query):
+		char = query[i]
+		if quote:
+			if char == "\\" and quote != "`":
+				out.append(query[i:i + 2])
+				i += 2
+				continue
+			if char == quote:
+				quote = None
+		elif char in "'\"`":
+			quote = char
+		elif query.startswith("/*", i):
+			if query.startswith("/*!", i):
+				# Executable comment, MySQL runs its content.
+				raise TenantError("Executable comments can not be scoped to a store")
+			end = query.find("*/", i + 2)
+			if end < 0:
+				raise TenantError("Unterminated comment")
+			out.append(" ")
+			i = end + 2
+			continue
+		elif char == "#" or (query.startswith("--", i) and (i + 2 == len(query) or query[i + 2].isspace())):
+			end = query.find("\n", i)
+			out.append(" ")
+			i = len(query) if end < 0 else end
+			continue
+		out.append(char)
+		i += 1
+	return "".join(out)
+
+
+def _mask_literals(query: str) -> str:
+	"""The query with the contents of its string literals blanked out, same length, so match positions carry over."""
+	chars, quote, i = list(query), None, 0
+	while i < len(query):
+		char = query[i]
+		if quote == "`":
+			# A quoted identifier, kept (tables are referenced as `orders` too).
+			if char == quote:
+				quote = None
+		elif quote:
+			if char == "\\" or (char == quote and query[i + 1:i + 2] == quote):
+				# An escaped character, or a doubled quote ('it''s').
+				chars[i] = " "
+				if i + 1 < len(chars):
+					chars[i + 1] = " "
+				i += 2
+				continue
+			if char == quote:
+				quote = None
+			else:
+				chars[i] = " "
+		elif char in "'\"`":
+			quote = char
+		i += 1
+	if quote:
+		raise TenantError("Unterminated string literal")
+	return "".join(chars)
+
+
+def _reject_unscoped(masked: str):
+	"""Fail closed: a tenant table name outside literals, that is not a column qualifier or an alias, was not scoped."""
+	for match in _TENANT_NAME.finditer(masked):
+		before, after = masked[:match.start()].rstrip(), masked[match.end():].lstrip()
+		qualifier = after.startswith(".") and not before.endswith(".")
+		if not (qualifier or _ALIAS_KEYWORD.search(before)):
+			raise TenantError(f"Can not scope the reference to `{match.group(1)}`, join tables with JOIN ... ON")
+
+
+def _tuples(values: str) -> List[str]:
+	"""The parenthesised rows of a VALUES list."""
+	rows, depth, quote, begin = [], 0, None, None
+	for i, char in enumerate(values):
+		if quote:
+			if char == quote and values[i - 1] != "\\":
+				quote = None
+		elif char in "'\"":
+			quote = char
+		elif char == "(":
+			depth += 1
+			if depth == 1:
+				begin = i
+		elif char == ")":
+			depth -= 1
+			if depth == 0:
+				rows.append(values[begin + 1:i])
+	return rows
+
+
+def _scope_references(query: str, store_id: int) -> str:
+	masked = _mask_literals(query)
+	parts, remaining, last = [], list(masked), 0
+	for match in _TABLE_REFERENCE.finditer(masked):
+		keyword, table, alias = match.group(1), match.group(2).lower(), match.group(3)
+		parts += [query[last:match.start()], f"{keyword} (SELECT * FROM `{table}` WHERE `store_id` = {store_id}) AS `{alias or table}`"]
+		remaining[match.start():match.end()] = " " * (match.end() - match.start())
+		last = match.end()
+	_reject_unscoped("".join(remaining))
+	return "".join(parts) + query[last:]
+
+
+def scope_sql(query: str, store_id: int = None) -> str:
+	"""Rewrite a model generated statement so it only reads or writes the rows of one store."""
+	store_id = current_store_id() if store_id is None else store_id
+	query = _strip_comments(query).strip().rstrip(";")
+	if _METADATA.match(query):
+		return query
+	if _READ.match(query):
+		return _scope_references(query, store_id)
+
+	if "store_id" in query.lower():
+		raise TenantError("The store is set automatically, the statement must not reference store_id")
+
+	if _INSERT.match(query):
+		match = _INSERT.match(query)
+		rows = _tuples(query[match.end():])
+		if not rows:
+			raise TenantError("Only INSERT ... VALUES can be scoped to a store")
+		_reject_unscoped(_mask_literals(query[match.end():]))  # No subqueries in the values.
+		values = ", ".join(f"({row}, {store_id})" for row in rows)
+		return f"INSERT INTO `{match.group(1).lower()}` ({match.group(2)}, `store_id`) VALUES {values}"
+
+	match = _UPDATE.match(query) or _DELETE.match(query)
+	if not match:
+		raise TenantError("Only single table UPDATE, DELETE and INSERT ... VALUES statements can be scoped to a store")
+	column = f"`{match.group(2)}`.`store_id`" if match.re is _UPDATE and match.group(2) else "`store_id`"
+	head, rest = query[:match.end()], query[match.end():]
+	rest = _scope_references(rest, store_id)  # Subqueries in SET / WHERE.
+	where = _top_level(rest, re.compile(r"WHERE\b", re.IGNORECASE))
+	tail = _top_level(rest, re.compile(r"(?:ORDER\s+BY|LIMIT)\b", re.IGNORECASE), where.end() if where else 0)
+	end = tail.start() if tail else len(rest)
+	if where:
+		condition = rest[where.end():end].strip()
+		return f"{head}{rest[:where.start()]}WHERE {column} = {store_id} AND ({condition}) {rest[end:]}".strip()
+	return f"{head}{rest[:end].rstrip()} WHERE {column} = {store_id} {rest[end:]}".strip()
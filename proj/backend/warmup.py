@@ -0,0 +1,91 @@
+# Process warmup and readiness.
+# After a deploy the first request used to pay for everything that is built lazily: model loads, the embedding
+# client, the example index, schema reflection and the connection pool. A Warmup runs those steps in parallel
+# at process start and retries the failed ones, /ready (see bind_readiness) answers 503 until every step has
+# succeeded, so a load balancer or a container healthcheck only sends traffic to a warm process.
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+WARMUP_RETRY_S = float(os.getenv("WARMUP_RETRY_S", "10"))  # Pause before failed steps run again.
+WARMUP_WORKERS = int(os.getenv("WARMUP_WORKERS", "8"))
+
+
+class Warmup:
+	"""Named warmup steps, run in parallel until each one has succeeded."""
+
+	def __init__(self, steps: Dict[str, Callable[[], Any]], retry_s: float = WARMUP_RETRY_S):
+		self.steps = steps
+		self.retry_s = retry_s
+		# name -> {"status": "pending" | "running" | "ok" | "failed", "duration_s", "error", "attempts"}
+		self.status: Dict[str, Dict[str, Any]] = {
+			name: {"status": "pending", "duration_s": None, "error": None, "attempts": 0} for name in steps
+		}
+		self.started_at: Optional[float] = None
+		self.ready_at: Optional[float] = None
+		self.ready = threading.Event()
+		self._thread: Optional[threading.Thread] = None
+		self._lock = threading.Lock()
+
+	def _run_step(self, name: str):
+		with self._lock:
+			state = self.status[name]
+			state["status"], state["attempts"] = "running", state["attempts"] + 1
+		start = time.monotonic()
+		try:
+			self.steps[name]()
+			status, error = "ok", None
+		except Exception as e:
+			status, error = "failed", str(e)
+			logger.error(f"Warmup step {name} failed: {error}")
+		with self._lock:
+			state.update(status=status, error=error, duration_s=round(time.monotonic() - start, 3))
+		if status == "ok":
+			logger.info(f"Warmup step {name} done in {state['duration_s']} s")
+
+	def run(self):
+		"""Run the steps that have not succeeded yet, in parallel, until all have (blocking)."""
+		self.started_at = self.started_at or time.time()
+		with ThreadPoolExecutor(max_workers=WARMUP_WORKERS, thread_name_prefix="warmup") as pool:
+			while True:
+				pending = [name for name, state in self.status.items() if state["status"] != "ok"]
+				if not pending:
+					break
+				list(pool.map(self._run_step, pending))
+				if any(self.status[name]["status"] != "ok" for name in pending):
+					time.sleep(self.retry_s)
+		self.ready_at = time.time()
+		self.ready.set()
+		logger.info(f"Warmup complete in {self.ready_at - self.started_at:.1f} s, ready for traffic")
+
+	def start(self) -> "Warmup":
+		"""Run the warmup in a background thread, once."""
+		with self._lock:
+			if self._thread is None:
+				self._thread = threading.Thread(target=self.run, name="warmup", daemon=True)
+				self._thread.start()
+		return self
+
+	def snapshot(self) -> Dict[str, Any]:
+		with self._lock:
+			return {
+				"ready": self.ready.is_set(),
+				"started_at": self.started_at,
+				"ready_at": self.ready_at,
+				"steps": {name: dict(state) for name, state in self.status.items()},
+			}
+
+
+def bind_readiness(app, warmup: Warmup):
+	"""Add GET /ready to a Flask app: 200 once the warmup is complete, 503 with the step states before."""
+	from flask import jsonify
+
+	@app.get("/ready")
+	def ready():
+		snapshot = warmup.snapshot()
+		return jsonify(snapshot), 200 if snapshot["ready"] else 503
@@ -0,0 +1,432 @@
+# Agent HTTP service.
+# Runs the agent in its own process with a bounded worker pool and a priority request queue,
+# so several tills (Streamlit sessions) sharing one Ollama box are queued fairly
+# instead of each running its own LLM chain inside the UI server.
+#
+#   POST   /jobs                {"prompt", "session_id", "priority": "interactive"|"batch", "deadline_s"}
+#   GET    /jobs/<id>           job status and result (polling)
+#   GET    /jobs/<id>/events    server-sent events until the job finishes, the job is cancelled if the client disconnects
+#   DELETE /jobs/<id>           cancel the job
+#   GET    /ready               200 once the warmup (models, embeddings, example index, schema, pools) is done
+#   POST   /examples            {"question", "query"} add a verified read query to the few-shot examples, needs the
+#                               X-Examples-Token header (EXAMPLES_TOKEN), disabled while that is not set
+#
+# A job's priority and deadline also apply to each of its LLM calls (see llm_gateway.py), a job the models
+# can not answer in time gets a fast fallback (a precomputed report or a "busy" message) instead of a late answer.
+#
+# Requests carry the branch in the X-Store-Id header (see backend/tenancy.py), a job runs as that store
+# and is only visible to it.
+#
+# Usage:
+#   python -m proj.chain.agent_service
+import heapq
+import hmac
+import itertools
+import json
+import logging
+import math
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from flask import Flask, jsonify, request, Response, stream_with_context
+
+from proj.backend.database_orm import DatabaseManager, fill_pool
+from proj.backend.db_metrics import db_metrics
+from proj.backend.product_index import get_product_index
+from proj.backend.tenancy import bind_request_tenant, current_store_id, store_ids, tenant
+from proj.backend.warmup import Warmup, bind_readiness
+from proj.chain.lc_agent import execute_agent_tools, get_agent_prompt, new_conversation_memory, router
+from proj.chain.llm_gateway import PRIORITIES, get_llm_gateway, llm_request
+from proj.chain.memory import ConversationMemory
+from proj.chain.tools import nl_2_sql
+from proj.chain.tools.nl_2_sql import get_example_store
+from proj.chain.tools.result_store import collect_result_handles, get_result_store
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+AGENT_WORKERS = int(os.getenv("AGENT_WORKERS", "2"))
+AGENT_MAX_QUEUE = int(os.getenv("AGENT_MAX_QUEUE", "32"))
+AGENT_DEFAULT_DEADLINE_S = float(os.getenv("AGENT_DEFAULT_DEADLINE_S", "120"))
+AGENT_MAX_SESSIONS = int(os.getenv("AGENT_MAX_SESSIONS", "500"))
+AGENT_JOB_TTL_S = float(os.getenv("AGENT_JOB_TTL_S", "600"))
+SSE_HEARTBEAT_S = 5.0
+# Examples steer the SQL of every later question, so adding them is limited to holders of this token.
+EXAMPLES_TOKEN = os.getenv("EXAMPLES_TOKEN", "")
+
+FINISHED = {"done", "failed", "cancelled", "expired"}
+
+
+@dataclass
+class Job:
+	prompt: str
+	session_id: str
+	priority: str  # One of llm_gateway.PRIORITIES
+	deadline: float  # time.monotonic() after which the answer is no longer wanted
+	store_id: int = field(default_factory=current_store_id)
+	id: str = field(default_factory=lambda: uuid.uuid4().hex)
+	status: str = "queued"
+	output: Optional[str] = None
+	error: Optional[str] = None
+	created_at: float = field(default_factory=time.time)
+	finished_at: Optional[float] = None
+	# Large SQL results of this job, pageable through GET /results/<handle>.
+	result_handles: List[str] = field(default_factory=list)
+	cancelled: threading.Event = field(default_factory=threading.Event)
+	finished: threading.Event = field(default_factory=threading.Event)
+
+	def finish(self, status: str, output: str = None, error: str = None):
+		self.status, self.output, self.error = status, output, error
+		self.finished_at = time.time()
+		self.finished.set()
+
+	def to_dict(self) -> Dict[str, Any]:
+		return {
+			"job_id": self.id,
+			"session_id": self.session_id,
+			"store_id": self.store_id,
+			"priority": self.priority,
+			"status": self.status,
+			"output": self.output,
+			"error": self.error,
+			"created_at": self.created_at,
+			"finished_at": self.finished_at,
+			"result_handles": self.result_handles,
+		}
+
+
+class QueueFull(Exception):
+	pass
+
+
+class JobQueue:
+	"""
+	Bounded priority queue with admission control. At most one job per session runs at a time, so its memory is
+	not updated concurrently: get skips the jobs of sessions with a running job until done is called for it.
+	"""
+
+	def __init__(self, max_depth: int):
+		self.max_depth = max_depth
+		self._heap = []
+		self._counter = itertools.count()
+		self._condition = threading.Condition()
+		self._running_sessions = set()  # (store, session id) of the jobs taken by get and not done yet
+
+	def _prune(self):
+		"""Drop cancelled jobs and expire the ones past their deadline, only live jobs count toward max_depth (lock held)."""
+		now = time.monotonic()
+		live = []
+		for entry in self._heap:
+			job = entry[2]
+			if job.status == "queued" and now > job.deadline:
+				# Nobody is waiting for this answer any more, do not spend model time on it.
+				job.finish("expired", error="Deadline passed while queued")
+			if job.status not in FINISHED and not job.cancelled.is_set():
+				live.append(entry)
+		if len(live) != len(self._heap):
+			heapq.heapify(live)
+			self._heap = live
+
+	def put(self, job: Job) -> int:
+		"""Queue the job and return its position, or raise QueueFull when the queue is at capacity."""
+		with self._condition:
+			self._prune()
+			if len(self._heap) >= self.max_depth:
+				raise QueueFull()
+			rank = PRIORITIES[job.priority]
+			heapq.heappush(self._heap, (rank, next(self._counter), job))
+			self._condition.notify()
+			return sum(1 for queued_rank, _, _ in self._heap if queued_rank <= rank)
+
+	def get(self) -> Job:
+		"""The first live job, by priority, of a session without a running job, waiting until there is one."""
+		with self._condition:
+			while True:
+				self._prune()
+				for entry in sorted(self._heap):
+					job = entry[2]
+					if (job.store_id, job.session_id) not in self._running_sessions:
+						self._heap.remove(entry)
+						heapq.heapify(self._heap)
+						self._running_sessions.add((job.store_id, job.session_id))
+						return job
+				self._condition.wait()
+
+	def done(self, job: Job):
+		"""The job taken by get has finished, its session's next job can run."""
+		with self._condition:
+			self._running_sessions.discard((job.store_id, job.session_id))
+			self._condition.notify_all()
+
+	def __len__(self):
+		with self._condition:
+			self._prune()
+			return len(self._heap)
+
+
+class AgentService:
+	"""Worker pool running agent jobs from the queue, with per-session conversation memory."""
+
+	def __init__(self, workers: int = AGENT_WORKERS, max_queue: int = AGENT_MAX_QUEUE):
+		self.queue = JobQueue(max_queue)
+		self.jobs: Dict[str, Job] = {}
+		# By (store, session id), a session id can not reach another store's conversation.
+		self._sessions: "OrderedDict[tuple[int, str], ConversationMemory]" = OrderedDict()
+		self._lock = threading.Lock()
+		self._workers = [
+			threading.Thread(target=self._worker, name=f"agent-worker-{i}", daemon=True) for i in range(workers)
+		]
+		for worker in self._workers:
+			worker.start()
+
+	def submit(self, prompt: str, session_id: str, priority: str = "interactive", deadline_s: float = None) -> tuple[Job, int]:
+		job = Job(
+			prompt=prompt,
+			session_id=session_id,
+			priority=priority if priority in PRIORITIES else "interactive",
+			deadline=time.monotonic() + (deadline_s or AGENT_DEFAULT_DEADLINE_S),
+		)
+		self._prune_jobs()
+		position = self.queue.put(job)
+		with self._lock:
+			self.jobs[job.id] = job
+		return job, position
+
+	def get(self, job_id: str) -> Optional[Job]:
+		"""The job, if it belongs to the current store."""
+		job = self.jobs.get(job_id)
+		return job if job and job.store_id == current_store_id() else None
+
+	def cancel(self, job_id: str) -> Optional[Job]:
+		job = self.get(job_id)
+		if job and job.status not in FINISHED:
+			job.cancelled.set()
+			if job.status == "queued":
+				job.finish("cancelled")
+		return job
+
+	def _session(self, store_id: int, session_id: str) -> ConversationMemory:
+		key = (store_id, session_id)
+		with self._lock:
+			if key not in self._sessions:
+				self._sessions[key] = new_conversation_memory()
+				if len(self._sessions) > AGENT_MAX_SESSIONS:
+					self._sessions.popitem(last=False)
+			self._sessions.move_to_end(key)
+			return self._sessions[key]
+
+	def _prune_jobs(self):
+		cutoff = time.time() - AGENT_JOB_TTL_S
+		with self._lock:
+			for job_id in [j.id for j in self.jobs.values() if j.finished_at and j.finished_at < cutoff]:
+				del self.jobs[job_id]
+
+	def _worker(self):
+		while True:
+			# Never a job of a session that is already running one, the worker takes the next session's instead.
+			job = self.queue.get()
+			try:
+				self._run(job)
+			finally:
+				self.queue.done(job)
+
+	def _run(self, job: Job):
+		if job.status in FINISHED or job.cancelled.is_set():
+			return  # Cancelled while it was being taken off the queue.
+		memory = self._session(job.store_id, job.session_id)
+		job.status = "running"
+		try:
+			# Every query and tool of the job is scoped to the store that submitted it,
+			# and its LLM calls are queued by the job's priority and shed past its deadline.
+			with tenant(job.store_id), llm_request(job.priority, job.deadline), collect_result_handles() as handles:
+				result = execute_agent_tools(job.prompt, memory)
+			job.result_handles = handles
+		except Exception as e:
+			logger.error(f"Agent job {job.id} failed: {e}")
+			job.finish("failed", error=str(e))
+			return
+
+		# A running LLM call cannot be interrupted, but a cancelled or late answer is discarded.
+		if job.cancelled.is_set():
+			job.finish("cancelled")
+		elif time.monotonic() > job.deadline:
+			job.finish("expired", error="Deadline passed while running")
+		elif result.get("error"):
+			job.finish("failed", output=result.get("output"), error=result.get("error_type"))
+		else:
+			job.finish("done", output=result.get("output"))
+
+
+def load_models():
+	failed = router.preload()
+	if failed:
+		raise RuntimeError(f"Models not loaded: {', '.join(failed)}")
+
+
+def fill_pools():
+	fill_pool(nl_2_sql.db._engine)
+	DatabaseManager().fill_pools()
+
+
+def build_product_indexes():
+	for store_id in store_ids():
+		with tenant(store_id):
+			get_product_index()
+
+
+def build_schema_linker():
+	if nl_2_sql.SCHEMA_LINKING:
+		nl_2_sql.get_schema_linker().vocabulary()
+
+
+# Everything the first question would otherwise wait for, run in parallel at start (see backend/warmup.py).
+warmup = Warmup({
+	"models": load_models,
+	"embeddings": lambda: nl_2_sql.get_embeddings().embed_query("warmup"),
+	"example_index": lambda: nl_2_sql.get_example_selector(nl_2_sql.SQL_TOP_K),
+	"schema_linker": build_schema_linker,
+	"table_info": nl_2_sql.get_table_info,
+	"agent_prompt": get_agent_prompt,
+	"db_pools": fill_pools,
+	"product_index": build_product_indexes,
+})
+
+app = Flask(__name__)
+bind_request_tenant(app)
+bind_readiness(app, warmup)
+service: Optional[AgentService] = None
+_service_lock = threading.Lock()
+
+
+def get_service() -> AgentService:
+	global service
+	with _service_lock:
+		if service is None:
+			service = AgentService()
+		return service
+
+
+@app.post("/jobs")
+def submit_job():
+	"""Queue a prompt for the agent, returns 429 when the queue is full."""
+	body = request.get_json(silent=True) or {}
+	prompt = (body.get("prompt") or "").strip()
+	if not prompt:
+		return jsonify({"error": "Missing prompt"}), 400
+	deadline_s = body.get("deadline_s")
+	if deadline_s is not None and (
+		isinstance(deadline_s, bool) or not isinstance(deadline_s, (int, float)) or not math.isfinite(deadline_s) or deadline_s <= 0
+	):
+		return jsonify({"error": "deadline_s must be a positive number of seconds"}), 400
+
+	try:
+		job, position = get_service().submit(
+			prompt,
+			session_id=body.get("session_id") or uuid.uuid4().hex,
+			priority=body.get("priority", "interactive"),
+			deadline_s=deadline_s,
+		)
+	except QueueFull:
+		response = jsonify({"error": "The assistant is busy, please try again shortly."})
+		response.headers["Retry-After"] = "5"
+		return response, 429
+
+	return jsonify({**job.to_dict(), "position": position}), 202
+
+
+@app.get("/jobs/<job_id>")
+def get_job(job_id: str):
+	job = get_service().get(job_id)
+	if not job:
+		return jsonify({"error": "Job not found"}), 404
+	return jsonify(job.to_dict()), 200
+
+
+@app.delete("/jobs/<job_id>")
+def cancel_job(job_id: str):
+	job = get_service().cancel(job_id)
+	if not job:
+		return jsonify({"error": "Job not found"}), 404
+	return jsonify(job.to_dict()), 200
+
+
+@app.get("/jobs/<job_id>/events")
+def job_events(job_id: str):
+	"""Stream status changes as server-sent events, cancelling the job if the client goes away."""
+	agent_service = get_service()
+	job = agent_service.get(job_id)
+	if not job:
+		return jsonify({"error": "Job not found"}), 404
+
+	def events():
+		last_status = None
+		try:
+			while True:
+				if job.status != last_status:
+					last_status = job.status
+					yield f"event: status\ndata: {json.dumps(job.to_dict())}\n\n"
+				if job.status in FINISHED:
+					return
+				if not job.finished.wait(timeout=SSE_HEARTBEAT_S) and job.status == last_status:
+					# Writing the heartbeat is how a disconnected client is noticed.
+					yield ": heartbeat\n\n"
+		except GeneratorExit:
+			if job.status not in FINISHED:
+				logger.info(f"Client disconnected, cancelling job {job.id}")
+				agent_service.cancel(job.id)
+			raise
+
+	return Response(stream_with_context(events()), mimetype="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+@app.get("/health")
+def health():
+	agent_service = get_service()
+	return jsonify({
+		"status": "ok",
+		"queue_depth": len(agent_service.queue),
+		"running": sum(job.status == "running" for job in list(agent_service.jobs.values())),
+		"llm_queue_depth": {model: gate["queue_depth"] for model, gate in get_llm_gateway().snapshot().items()},
+		"ready": warmup.ready.is_set(),
+	}), 200
+
+
+@app.get("/results/<handle>")
+def get_result_page(handle: str):
+	"""A page of a large SQL result the agent summarised, ?offset=0&limit=50."""
+	page = get_result_store().page(handle, request.args.get("offset", 0, type=int), request.args.get("limit", 50, type=int))
+	if page is None:
+		return jsonify({"error": "Result not found or expired"}), 404
+	return app.response_class(json.dumps(page, default=str), mimetype="application/json")
+
+
+@app.post("/examples")
+def add_example():
+	"""Add a verified question / SQL pair (e.g. a confirmed answer) to the few-shot example store."""
+	if not EXAMPLES_TOKEN or not hmac.compare_digest(request.headers.get("X-Examples-Token", ""), EXAMPLES_TOKEN):
+		return jsonify({"error": "Forbidden"}), 403
+	body = request.get_json(silent=True) or {}
+	result = get_example_store().add(body.get("question") or "", body.get("query") or "")
+	status = {"added": 201, "duplicate": 409}.get(result.status, 422)
+	return jsonify(result.to_dict()), status
+
+
+@app.get("/metrics")
+def metrics():
+	"""Pool and query metrics of the agent's database engines (NL2SQL and the tools), and the LLM gate queues"""
+	return jsonify({
+		**db_metrics.snapshot(top=request.args.get("top", 50, type=int)),
+		"llm_gateway": get_llm_gateway().snapshot(),
+	}), 200
+
+
+if __name__ == '__main__':
+	warmup.start()
+	get_service()
+	# threaded, so SSE streams and polling do not block each other, the agent work itself is bounded by the pool.
+	app.run(host=os.getenv("AGENT_SERVICE_HOST", "127.0.0.1"), port=int(os.getenv("AGENT_SERVICE_PORT", "5001")), threaded=True)
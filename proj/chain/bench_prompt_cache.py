@@ -0,0 +1,99 @@
+# Prompt-eval benchmark for the SQL generation prompt.
+# Compares the old layout (question interpolated into the middle of the prefix) with the current one
+# (byte-stable instructions + schema first), using the prompt_eval_count / prompt_eval_duration Ollama reports.
+# With the stable prefix, Ollama only has to evaluate the examples and the question after the first request.
+#
+# Usage:
+#   python -m proj.chain.bench_prompt_cache --model gemma2-ft2-structured --rounds 2
+import argparse
+import statistics
+from typing import Dict, List
+
+from langchain_core.prompts import PromptTemplate, FewShotPromptTemplate
+
+from proj.chain.llm_config import get_ollama_llm
+from proj.chain.tools.nl_2_sql import (
+	SQL_PROMPT_PREFIX, SQL_PROMPT_SUFFIX, SQL_PROMPT_INSTRUCTIONS, SQL_TOP_K, get_example_selector, get_table_info
+)
+
+QUESTIONS = [
+	"Are any of my medicines going out of date?",
+	"What stock is running low?",
+	"Show me the products with the highest stock.",
+	"What is the date of my order for midodrine hydrochloride?",
+	"What is the most popular product based on orders?",
+	"List all products expiring in the next month",
+]
+
+# Previous layout, kept only for comparison: the question sat inside the prefix, before the examples.
+LEGACY_PREFIX = (
+	SQL_PROMPT_INSTRUCTIONS.replace('Please only respond with the SQL query.', '') +
+	'Only use the following tables:'
+	'{table_info}'
+	''
+	'Question: {input}'
+	'Please only respond with the SQL query.'
+	''
+	''
+	'Below are a number of examples of questions and their corresponding SQL queries.'
+)
+
+
+def build_prompt(prefix: str) -> FewShotPromptTemplate:
+	return FewShotPromptTemplate(
+		example_selector=get_example_selector(SQL_TOP_K),
+		example_prompt=PromptTemplate.from_template("User input: {input}\nSQL query: {query}"),
+		input_variables=['input', 'table_info'],
+		prefix=prefix,
+		suffix=SQL_PROMPT_SUFFIX,
+	)
+
+
+def run_layout(llm, prompt: FewShotPromptTemplate, rounds: int) -> Dict[str, float]:
+	"""Send every question through the prompt and collect the prompt-eval figures reported by Ollama."""
+	table_info = get_table_info()
+	durations_ms: List[float] = []
+	tokens: List[int] = []
+
+	for _ in range(rounds):
+		for question in QUESTIONS:
+			text = prompt.format(input=question, table_info=table_info)
+			result = llm.generate([text])
+			info = result.generations[0][0].generation_info or {}
+			durations_ms.append((info.get("prompt_eval_duration") or 0) / 1e6)
+			tokens.append(info.get("prompt_eval_count") or 0)
+
+	return {
+		"requests": len(durations_ms),
+		"prompt_eval_ms_mean": round(statistics.mean(durations_ms), 1),
+		"prompt_eval_ms_p50": round(statistics.median(durations_ms), 1),
+		"prompt_tokens_evaluated_mean": round(statistics.mean(tokens), 1),
+	}
+
+
+def main():
+	parser = argparse.ArgumentParser(description="Benchmark prompt-eval time for the old and the stable SQL prompt layout.")
+	parser.add_argument("--model", default="gemma2-ft2-structured")
+	parser.add_argument("--rounds", type=int, default=2, help="How many times to run the question set per layout.")
+	args = parser.parse_args()
+
+	# Only the prompt is of interest, so keep generation to a single token.
+	llm = get_ollama_llm(args.model, num_predict=1)
+	# Load the model first, so neither layout pays for the model load.
+	llm.invoke("Hello")
+
+	results = {
+		"before (question inside prefix)": run_layout(llm, build_prompt(LEGACY_PREFIX), args.rounds),
+		"after (stable prefix)": run_layout(llm, build_prompt(SQL_PROMPT_PREFIX), args.rounds),
+	}
+
+	print(f"{'Layout':<34}{'Requests':>10}{'Mean ms':>12}{'p50 ms':>12}{'Tokens evaluated':>18}")
+	for layout, stats in results.items():
+		print(
+			f"{layout:<34}{stats['requests']:>10}{stats['prompt_eval_ms_mean']:>12}"
+			f"{stats['prompt_eval_ms_p50']:>12}{stats['prompt_tokens_evaluated_mean']:>18}"
+		)
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,227 @@
+# NL2SQL evaluation harness.
+# Runs every example question through the full database chain against a seeded local database,
+# and checks whether the generated SQL returns the same rows as the reference query (not the same SQL text).
+# Also records per-stage latency, token counts and LLM call counts, so models can be compared side by side.
+#
+# Usage:
+#   python -m proj.chain.evaluate --models gemma2-ft2-structured gemma2-ft9 gemma2-ft27 --workers 4
+import argparse
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Dict, Any, List, Optional
+from uuid import UUID
+
+from dotenv import load_dotenv
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+from langchain_ollama import OllamaLLM
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import Engine
+
+from proj.backend.seed import seed_database
+from proj.chain.llm_config import get_ollama_llm
+from proj.chain.prompts_examples import examples
+from proj.chain.tools import nl_2_sql
+
+load_dotenv()
+
+DEFAULT_MODELS = ["gemma2-ft2-structured", "gemma2-ft9", "gemma2-ft27"]
+
+# Chain steps in get_database_chain are plain functions, LangChain names their runs after the function.
+STAGE_NAMES = {
+	"log_and_generate_sql": "generate_sql",
+	"log_and_execute_sql": "execute_sql",
+	"log_and_rephrase": "rephrase",
+}
+
+
+class EvalCallbackHandler(BaseCallbackHandler):
+	"""Collects stage latencies, LLM call counts and token usage for a single chain run."""
+
+	def __init__(self):
+		self._lock = threading.Lock()
+		self._stage_starts: Dict[UUID, tuple] = {}
+		self.stage_latency: Dict[str, float] = {}
+		self.generated_sql: Optional[str] = None
+		self.llm_calls = 0
+		self.prompt_tokens = 0
+		self.completion_tokens = 0
+
+	def on_chain_start(self, serialized, inputs, *, run_id: UUID, **kwargs: Any) -> None:
+		stage = STAGE_NAMES.get(kwargs.get("name"))
+		if stage:
+			with self._lock:
+				self._stage_starts[run_id] = (stage, time.perf_counter())
+
+	def on_chain_end(self, outputs, *, run_id: UUID, **kwargs: Any) -> None:
+		with self._lock:
+			started = self._stage_starts.pop(run_id, None)
+			if not started:
+				return
+			stage, start = started
+			self.stage_latency[stage] = self.stage_latency.get(stage, 0.0) + time.perf_counter() - start
+			if stage == "generate_sql":
+				self.generated_sql = outputs if isinstance(outputs, str) else str(outputs)
+
+	def on_llm_start(self, serialized, prompts, **kwargs: Any) -> None:
+		with self._lock:
+			self.llm_calls += 1
+
+	def on_llm_end(self, response: LLMResult, **kwargs: Any) -> None:
+		# Ollama reports prompt_eval_count / eval_count in the generation info of the final chunk.
+		with self._lock:
+			for generations in response.generations:
+				for generation in generations:
+					info = generation.generation_info or {}
+					self.prompt_tokens += info.get("prompt_eval_count") or 0
+					self.completion_tokens += info.get("eval_count") or 0
+
+
+def _normalise_value(value: Any) -> Any:
+	if isinstance(value, Decimal):
+		return round(float(value), 4)
+	if isinstance(value, float):
+		return round(value, 4)
+	if isinstance(value, (date, datetime)):
+		return value.isoformat()
+	return value
+
+
+def run_select(engine: Engine, query: str) -> List[tuple]:
+	"""Execute a SELECT and return its rows as a sorted list of normalised tuples (order and column names ignored)."""
+	with engine.connect() as conn:
+		rows = conn.execute(text(query)).fetchall()
+	return sorted((tuple(_normalise_value(v) for v in row) for row in rows), key=repr)
+
+
+def is_select(query: str) -> bool:
+	return query.strip().upper().startswith(("SELECT", "WITH"))
+
+
+def evaluate_example(engine: Engine, llm: OllamaLLM, example: Dict[str, str]) -> Dict[str, Any]:
+	"""Run one example through the full chain and compare execution results with the reference query."""
+	record = {"question": example["input"], "reference_sql": example["query"]}
+
+	try:
+		expected = run_select(engine, example["query"])
+		record["expected_rows"] = len(expected)
+	except Exception as e:
+		# The reference itself is broken against the current schema, so it cannot be scored.
+		record.update({"status": "reference_error", "error": str(e)})
+		return record
+
+	handler = EvalCallbackHandler()
+	start = time.perf_counter()
+	try:
+		record["output"] = nl_2_sql.get_database_chain(llm).invoke(
+			{"question": example["input"]},
+			config={"callbacks": [handler]}
+		)
+		chain_error = None
+	except Exception as e:
+		chain_error = str(e)
+	record.update({
+		"latency_s": round(time.perf_counter() - start, 3),
+		"stage_latency_s": {stage: round(seconds, 3) for stage, seconds in handler.stage_latency.items()},
+		"llm_calls": handler.llm_calls,
+		"prompt_tokens": handler.prompt_tokens,
+		"completion_tokens": handler.completion_tokens,
+		"generated_sql": handler.generated_sql,
+	})
+
+	if chain_error or not handler.generated_sql:
+		record.update({"status": "chain_error", "error": chain_error or "No SQL generated"})
+		return record
+
+	try:
+		actual = run_select(engine, handler.generated_sql)
+		record["status"] = "correct" if actual == expected else "incorrect"
+	except Exception as e:
+		record.update({"status": "sql_error", "error": str(e)})
+	return record
+
+
+def _summarise(records: List[Dict[str, Any]]) -> Dict[str, Any]:
+	scored = [r for r in records if r["status"] != "reference_error"]
+	correct = sum(r["status"] == "correct" for r in scored)
+	latencies = sorted(r["latency_s"] for r in scored)
+	stages: Dict[str, float] = {}
+	for r in scored:
+		for stage, seconds in r["stage_latency_s"].items():
+			stages[stage] = stages.get(stage, 0.0) + seconds
+
+	return {
+		"scored": len(scored),
+		"skipped": len(records) - len(scored),
+		"correct": correct,
+		"accuracy": round(correct / len(scored), 4) if scored else None,
+		"latency_mean_s": round(sum(latencies) / len(latencies), 3) if latencies else None,
+		"latency_p50_s": latencies[len(latencies) // 2] if latencies else None,
+		"latency_max_s": latencies[-1] if latencies else None,
+		"stage_latency_mean_s": {stage: round(total / len(scored), 3) for stage, total in stages.items()},
+		"llm_calls": sum(r["llm_calls"] for r in scored),
+		"prompt_tokens": sum(r["prompt_tokens"] for r in scored),
+		"completion_tokens": sum(r["completion_tokens"] for r in scored),
+	}
+
+
+def evaluate_model(engine: Engine, model: str, workers: int) -> Dict[str, Any]:
+	"""Evaluate every read-only example with the given Ollama model, running questions in parallel."""
+	llm = get_ollama_llm(model)
+	# Write examples (INSERT / UPDATE) would change the seeded data under the other workers, so only SELECTs are scored.
+	selects = [example for example in examples if is_select(example["query"])]
+
+	start = time.perf_counter()
+	with ThreadPoolExecutor(max_workers=workers) as pool:
+		records = list(pool.map(lambda example: evaluate_example(engine, llm, example), selects))
+	wall_time = time.perf_counter() - start
+
+	return {"model": model, "wall_time_s": round(wall_time, 3), "summary": _summarise(records), "results": records}
+
+
+def main():
+	default_db_uri = f"mysql://{os.getenv('DB_USER')}:@{os.getenv('DB_HOST')}/{os.getenv('EVAL_DB_NAME', str(os.getenv('DB_NAME')) + '_eval')}"
+
+	parser = argparse.ArgumentParser(description="Evaluate NL2SQL accuracy and latency per model.")
+	parser.add_argument("--models", nargs="+", default=DEFAULT_MODELS, help="Ollama model names to compare.")
+	parser.add_argument("--db-uri", default=default_db_uri, help="Local database to seed and evaluate against (it is recreated).")
+	parser.add_argument("--workers", type=int, default=4, help="Questions to run in parallel per model.")
+	parser.add_argument("--output", default=None, help="Report file, defaults to eval_reports/nl2sql_<timestamp>.json")
+	parser.add_argument("--no-seed", action="store_true", help="Use the database as is, without reseeding it.")
+	args = parser.parse_args()
+
+	engine = create_engine(args.db_uri)
+	if not args.no_seed:
+		seed_database(engine)
+	nl_2_sql.use_database(args.db_uri)
+
+	report = {
+		"created_at": datetime.now().isoformat(timespec="seconds"),
+		"db_uri": args.db_uri,
+		"workers": args.workers,
+		"models": [evaluate_model(engine, model, args.workers) for model in args.models],
+	}
+
+	output = args.output or os.path.join("eval_reports", f"nl2sql_{datetime.now():%Y%m%d_%H%M%S}.json")
+	os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+	with open(output, "w") as f:
+		json.dump(report, f, indent=2, default=str)
+
+	print(f"{'Model':<24}{'Accuracy':>10}{'Mean s':>10}{'p50 s':>10}{'LLM calls':>12}{'Tokens':>10}")
+	for result in report["models"]:
+		summary = result["summary"]
+		print(
+			f"{result['model']:<24}{str(summary['accuracy']):>10}{str(summary['latency_mean_s']):>10}"
+			f"{str(summary['latency_p50_s']):>10}{summary['llm_calls']:>12}"
+			f"{summary['prompt_tokens'] + summary['completion_tokens']:>10}"
+		)
+	print("Report written to: ", output)
+
+
+if __name__ == "__main__":
+	main()
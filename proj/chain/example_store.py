@@ -0,0 +1,155 @@
+# Persistent few-shot example store for the SQL prompt.
+# The hand-written examples in prompts_examples.py are the seed. Verified question / SQL pairs from production use
+# (e.g. answers a user confirmed) are added at runtime: each is validated against the current schema, skipped when
+# it is a near duplicate of an existing example, appended to a JSONL file and added to the FAISS index in place.
+# The index is saved next to the JSONL file, so a restart loads it instead of embedding every example again.
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional
+
+from langchain_community.vectorstores import FAISS
+from langchain_core.embeddings import Embeddings
+from langchain_core.example_selectors import SemanticSimilarityExampleSelector
+
+from proj.chain.prompts_examples import examples as seed_examples
+
+logger = logging.getLogger(__name__)
+
+EXAMPLE_STORE_DIR = os.getenv("EXAMPLE_STORE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "example_store"))
+# Squared L2 distance between (unit) question embeddings below which a new example counts as a duplicate,
+# about a cosine similarity of 0.97.
+EXAMPLE_DEDUPE_DISTANCE = float(os.getenv("EXAMPLE_DEDUPE_DISTANCE", "0.06"))
+EXAMPLES_FILE = "examples.jsonl"
+# Added examples are few-shot material for every future question, so only single read queries are accepted: a
+# write example would teach the model to run it (EXPLAIN validates writes just as well as reads).
+READ_QUERY_PATTERN = re.compile(r"^\s*(?:SELECT|WITH)\b", re.IGNORECASE)
+WRITE_KEYWORD_PATTERN = re.compile(
+	r"\b(?:INSERT|UPDATE|DELETE|REPLACE|MERGE|CREATE|ALTER|DROP|TRUNCATE|RENAME|GRANT|REVOKE|LOCK|CALL|INTO\s+OUTFILE)\b",
+	re.IGNORECASE
+)
+_QUOTED_PATTERN = re.compile(r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.)*\"|`[^`]*`")
+INDEX_DIR = "faiss_index"
+INDEX_META = "index_meta.json"
+
+
+@dataclass
+class AddResult:
+	status: str  # "added", "duplicate" or "invalid"
+	detail: Optional[str] = None
+
+	def to_dict(self) -> Dict[str, Any]:
+		return {"status": self.status, "detail": self.detail}
+
+
+def read_query_error(query: str) -> Optional[str]:
+	"""Why the query is not a single read-only statement, or None."""
+	unquoted = _QUOTED_PATTERN.sub("''", query).strip().rstrip(";")
+	if not READ_QUERY_PATTERN.match(unquoted):
+		return "Only SELECT queries can be added as examples."
+	if ";" in unquoted:
+		return "Only a single statement can be added as an example."
+	if WRITE_KEYWORD_PATTERN.search(unquoted):
+		return "Only read-only queries can be added as examples."
+	return None
+
+
+def _examples_hash(examples: List[Dict[str, str]]) -> str:
+	return hashlib.sha1(json.dumps(examples, sort_keys=True).encode()).hexdigest()
+
+
+class ExampleStore:
+	"""Seed plus verified examples, with a FAISS index that is extended in place rather than rebuilt."""
+
+	def __init__(
+			self,
+			embeddings: Embeddings,
+			validator: Callable[[str], Optional[str]],
+			store_dir: str = EXAMPLE_STORE_DIR
+	):
+		self.embeddings = embeddings
+		# Returns the error for a query that does not work against the current schema, None when it does.
+		self.validator = validator
+		self.store_dir = store_dir
+		self._lock = threading.Lock()
+		self.examples = [{"input": example["input"], "query": example["query"]} for example in seed_examples]
+		self.examples += self._load_added()
+		self.vectorstore = self._load_or_build_index()
+
+	def _path(self, name: str) -> str:
+		return os.path.join(self.store_dir, name)
+
+	def _load_added(self) -> List[Dict[str, str]]:
+		if not os.path.isfile(self._path(EXAMPLES_FILE)):
+			return []
+		added = []
+		with open(self._path(EXAMPLES_FILE)) as f:
+			for number, line in enumerate(f, start=1):
+				if not line.strip():
+					continue
+				try:
+					record = json.loads(line)
+					added.append({"input": record["input"], "query": record["query"]})
+				except (ValueError, KeyError, TypeError) as e:
+					# E.g. the last line, half written when the process died, the other examples still load.
+					logger.warning(f"Skipping unreadable line {number} of {EXAMPLES_FILE}: {str(e)}")
+		return added
+
+	def _load_or_build_index(self) -> FAISS:
+		"""Load the saved index when it was built from exactly these examples, otherwise embed them all again."""
+		try:
+			with open(self._path(INDEX_META)) as f:
+				if json.load(f)["examples_hash"] == _examples_hash(self.examples):
+					return FAISS.load_local(self._path(INDEX_DIR), self.embeddings, allow_dangerous_deserialization=True)
+		except (OSError, ValueError, KeyError) as e:
+			logger.info(f"Example index not loaded, rebuilding: {str(e)}")
+
+		# Same text and metadata layout as SemanticSimilarityExampleSelector.from_examples(input_keys=["input"]).
+		vectorstore = FAISS.from_texts([example["input"] for example in self.examples], self.embeddings, metadatas=self.examples)
+		self._save(vectorstore)
+		return vectorstore
+
+	def _save(self, vectorstore: FAISS):
+		os.makedirs(self.store_dir, exist_ok=True)
+		vectorstore.save_local(self._path(INDEX_DIR))
+		with open(self._path(INDEX_META), "w") as f:
+			json.dump({"examples_hash": _examples_hash(self.examples), "count": len(self.examples)}, f)
+
+	def selector(self, top_k: int) -> SemanticSimilarityExampleSelector:
+		return SemanticSimilarityExampleSelector(vectorstore=self.vectorstore, k=top_k, input_keys=["input"])
+
+	def add(self, question: str, query: str) -> AddResult:
+		"""Validate, dedupe and add a verified question / SQL pair."""
+		question, query = question.strip(), query.strip()
+		if not question or not query:
+			return AddResult("invalid", "Both the question and the query are required.")
+
+		error = read_query_error(query) or self.validator(query)
+		if error:
+			return AddResult("invalid", error)
+
+		with self._lock:
+			nearest = self.vectorstore.similarity_search_with_score(question, k=1)
+			if nearest and nearest[0][1] <= EXAMPLE_DEDUPE_DISTANCE:
+				return AddResult("duplicate", f"Too close to the existing example: {nearest[0][0].page_content}")
+
+			example = {"input": question, "query": query}
+			os.makedirs(self.store_dir, exist_ok=True)
+			with open(self._path(EXAMPLES_FILE), "a+") as f:
+				# After a half written line, start on a new one, so this record is not glued to it.
+				f.seek(0, os.SEEK_END)
+				if f.tell() > 0:
+					f.seek(f.tell() - 1)
+					if f.read(1) != "\n":
+						f.write("\n")
+				f.write(json.dumps(example) + "\n")
+			# Only the new example is embedded, the index is extended in place.
+			self.vectorstore.add_texts([question], metadatas=[example])
+			self.examples.append(example)
+			self._save(self.vectorstore)
+		logger.info(f"Added few-shot example: {question}")
+		return AddResult("added")
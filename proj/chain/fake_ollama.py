@@ -0,0 +1,131 @@
+# Fake Ollama server for load tests.
+# Serves /api/generate like Ollama, with latencies drawn from a log-normal distribution (set by its median
+# and p95) and at most --parallel requests generating at once (OLLAMA_NUM_PARALLEL), later ones queue as in
+# Ollama. The replies are canned but well formed for each prompt the app sends, so the whole request path runs:
+#   - SQL prompts get the few-shot query of the question (prompts_examples.py), or a low stock query,
+#   - the ReAct agent calls the Text to SQL tool once, then gives a final answer,
+#   - the planner gets a one-call plan, summaries, rephrasing and synthesis get a short answer.
+# Point the agent service at it with OLLAMA_HOST, the models are not loaded (or needed) at all.
+#
+# Usage:
+#   python -m proj.chain.fake_ollama --port 11435 --latency-ms 1500 --p95-ms 6000 --parallel 2
+#   OLLAMA_HOST=http://127.0.0.1:11435 python -m proj.chain.agent_service
+import argparse
+import asyncio
+import json
+import logging
+import math
+import random
+import re
+from datetime import datetime, timezone
+
+from aiohttp import web
+
+from proj.chain.prompts_examples import examples
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SQL_TOOL = "Pass User Query to Text to SQL Database Tool"
+DEFAULT_QUERY = "SELECT `product_name`, `stock_count` FROM `products` WHERE `stock_count` < 20 ORDER BY `stock_count` LIMIT 10;"
+EXAMPLE_QUERIES = {example["input"].strip().lower(): example["query"] for example in examples}
+
+_SQL_QUESTION = re.compile(r"User input: (.*)\nSQL query:\s*$", re.DOTALL)
+_AGENT_QUESTION = re.compile(r"New input: (.*?)(?:\n|$)")
+_PLAN_QUESTION = re.compile(r"Question: (.*?)\n\s*Plan:\s*$", re.DOTALL)
+
+
+def reply_for(prompt: str) -> str:
+	"""A canned reply of the shape the app expects for this prompt."""
+	sql = _SQL_QUESTION.search(prompt)
+	if sql:
+		return EXAMPLE_QUERIES.get(sql.group(1).strip().lower(), DEFAULT_QUERY)
+	if "Do I need to use a tool?" in prompt:
+		question = _AGENT_QUESTION.search(prompt)
+		if "Observation:" in prompt.rsplit("New input:", 1)[-1]:
+			return "Thought: Do I need to use a tool? No\nFinal Answer: Here is what the database returned."
+		return (
+			f"Thought: Do I need to use a tool? Yes\nAction: {SQL_TOOL}\n"
+			f"Action Input: {question.group(1).strip() if question else 'Which products are low on stock?'}"
+		)
+	plan = _PLAN_QUESTION.search(prompt)
+	if plan:
+		return json.dumps([{"id": 1, "tool": SQL_TOOL, "input": plan.group(1).strip(), "depends_on": []}])
+	return "Three products are low on stock: Omeprazole, Carrington Antifungal and Amoxicillin."
+
+
+class FakeOllama:
+	"""Ollama's generate endpoint with simulated generation time and a bounded number of parallel requests."""
+
+	def __init__(self, latency_ms: float, p95_ms: float, parallel: int, error_rate: float = 0.0):
+		self.median_s = latency_ms / 1000
+		# p95 of a log-normal is median * exp(1.645 * sigma).
+		self.sigma = math.log(max(p95_ms, latency_ms) / latency_ms) / 1.645 if latency_ms > 0 else 0.0
+		self.slots = asyncio.Semaphore(parallel)
+		self.error_rate = error_rate
+		self.waiting = 0
+		self.generating = 0
+
+	def latency_s(self) -> float:
+		return self.median_s * math.exp(self.sigma * random.gauss(0, 1))
+
+	async def generate(self, request: web.Request) -> web.StreamResponse:
+		body = await request.json()
+		model, prompt = body.get("model", ""), body.get("prompt", "")
+		created_at = datetime.now(timezone.utc).isoformat()
+		if not prompt:
+			# Model load request (preload), answered straight away.
+			return web.json_response({"model": model, "created_at": created_at, "response": "", "done": True, "done_reason": "load"})
+
+		self.waiting += 1
+		async with self.slots:
+			self.waiting -= 1
+			self.generating += 1
+			try:
+				if random.random() < self.error_rate:
+					return web.json_response({"error": "simulated model error"}, status=500)
+				await asyncio.sleep(self.latency_s())
+			finally:
+				self.generating -= 1
+
+		reply = reply_for(prompt)
+		final = {
+			"model": model, "created_at": created_at, "response": "", "done": True, "done_reason": "stop",
+			"prompt_eval_count": len(prompt) // 4, "eval_count": len(reply) // 4,
+		}
+		if body.get("stream", True) is False:
+			return web.json_response({**final, "response": reply})
+		response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+		await response.prepare(request)
+		await response.write((json.dumps({"model": model, "created_at": created_at, "response": reply, "done": False}) + "\n").encode())
+		await response.write((json.dumps(final) + "\n").encode())
+		await response.write_eof()
+		return response
+
+	async def status(self, request: web.Request) -> web.Response:
+		return web.json_response({"waiting": self.waiting, "generating": self.generating})
+
+	def app(self) -> web.Application:
+		app = web.Application()
+		app.router.add_post("/api/generate", self.generate)
+		app.router.add_get("/status", self.status)
+		return app
+
+
+def main():
+	parser = argparse.ArgumentParser(description="Serve a fake Ollama /api/generate with configurable latency.")
+	parser.add_argument("--host", default="127.0.0.1")
+	parser.add_argument("--port", type=int, default=11435)
+	parser.add_argument("--latency-ms", type=float, default=1500, help="Median generation time.")
+	parser.add_argument("--p95-ms", type=float, default=6000, help="95th percentile generation time.")
+	parser.add_argument("--parallel", type=int, default=2, help="Requests generating at once, like OLLAMA_NUM_PARALLEL.")
+	parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with a 500.")
+	args = parser.parse_args()
+
+	fake = FakeOllama(args.latency_ms, args.p95_ms, args.parallel, args.error_rate)
+	logger.info(f"Fake Ollama on {args.host}:{args.port}, median {args.latency_ms} ms, p95 {args.p95_ms} ms, {args.parallel} parallel")
+	web.run_app(fake.app(), host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+	main()
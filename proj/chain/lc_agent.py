@@ -25,14 +25,22 @@ import os
 # LLM Imports.
 from langchain_openai import ChatOpenAI
 from langchain_ollama import OllamaLLM
+from proj.chain.llm_gateway import LLMBusy
+from proj.chain.model_router import get_model_router
+from proj.chain.planner import execute_planned_tools, PlanError
+from proj.chain.memory import ConversationMemory, llm_summariser
 
-from proj.backend.func_tools import DB_OverviewTool, AddProductTool, DatetimeTool
+from proj.backend.database_orm import track_writes
+from proj.backend.func_tools import DB_OverviewTool, AddProductTool, DatetimeTool, ReportSnapshotTool, ProductLookupTool, get_report_snapshot
 from proj.chain.tools.date_tool import get_current_date_tool
 # from backend.func_tools import AddProductTool
 from proj.chain.tools.nl_2_sql import get_database_chain
 # import schemas and tools from user defined space.
 
 import logging
+import re
+import threading
+from functools import lru_cache
 
 from utils import get_credentials_path
 
@@ -53,14 +61,10 @@ os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = get_credentials_path()
 # 		max_retries=2,
 # 	)
 
-# Try using local LLM model. (gemma-2-9B-it-function-calling-Q6_K.gguf)
-# We have created the custom model on our PC, named gemma2-ft9
-gm_llm = OllamaLLM(
-	# model="gemma2-ft9",
-	model="gemma2-ft2-structured",  # https://huggingface.co/bastienp/Gemma-2-2B-Instruct-structured-output
-	temperature=0,
-)
-selected_llm = gm_llm
+# Each stage (agent, SQL generation, rephrasing) gets its own model from the router, cheapest first,
+# and only escalates to the 9B / 27B model when the smaller one fails, see model_router.py.
+router = get_model_router()
+# The routed models are loaded by the agent service's warmup (or below, for the CLI), not on import.
 
 # Prompt for Agent.
 
@@ -69,18 +73,26 @@ selected_llm = gm_llm
 def text_to_sql_database_tool(prompt: str) -> str:
 	"""Convert text to SQL and execute database query."""
 	try:
-		db_chain = get_database_chain(selected_llm)
+		db_chain = get_database_chain(router)
 		result = db_chain.invoke({"question": prompt})
 		logging.info(f"Database query result: {result}")
 		return result
+	except LLMBusy:
+		# Stop the agent, it would only be shed again on its next step.
+		raise
 	except Exception as e:
 		return f"Error executing database query: {str(e)}"
 
 
-# Tool Defining
-def execute_agent_tools(prompt: str, chat_history: List[Dict[str, str]] = None) -> Dict[str, Any]:
-	"""Execute agent tools with error handling and input validation."""
-	tools = [
+def agent_reached_answer(result: Dict[str, Any]) -> bool:
+	"""False when the agent gave up (iteration limit or early stop), so the router can escalate."""
+	output = str(result.get("output", "")) if isinstance(result, dict) else str(result)
+	return bool(output.strip()) and not output.startswith("Agent stopped")
+
+
+def build_agent_tools() -> List[Tool]:
+	"""The tools available to the agent."""
+	return [
 		Tool.from_function(
 			text_to_sql_database_tool,
 			return_direct=False,
@@ -93,6 +105,8 @@ def execute_agent_tools(prompt: str, chat_history: List[Dict[str, str]] = None)
 			            "If an error occurs, pass the error message along with the initial input to resolve the issue."
 		),
 		DB_OverviewTool,
+		ReportSnapshotTool,
+		ProductLookupTool,
 		# https://python.langchain.com/api_reference/community/tools/langchain_community.tools.human.tool.HumanInputRun.html
 		# This is a tool that allows for human input to be run.
 		Tool.from_function(
@@ -106,23 +120,91 @@ def execute_agent_tools(prompt: str, chat_history: List[Dict[str, str]] = None)
 		DatetimeTool,
 	]
 
+
+# Tools the planner may run: no human input and no writes through the ORM.
+PLANNER_TOOL_NAMES = {
+	"Pass User Query to Text to SQL Database Tool",
+	DB_OverviewTool.name,
+	ReportSnapshotTool.name,
+	ProductLookupTool.name,
+	DatetimeTool.name,
+}
+# Of those, the ones that may still write (Text to SQL runs the DML it generates), run one at a time by the planner.
+PLANNER_SEQUENTIAL_TOOL_NAMES = {"Pass User Query to Text to SQL Database Tool"}
+
+# "react" runs the ReAct loop, "plan" plans all tool calls up front and runs independent ones concurrently.
+AGENT_MODE = os.getenv("AGENT_MODE", "react")
+
+
+# Questions a precomputed report answers when the models are too busy, checked in order.
+BUSY_REPORTS = [
+	(re.compile(r"\bexpired\b", re.IGNORECASE), "expired"),
+	(re.compile(r"\bexpir\w*\b.*\b(?:week|7 days)\b", re.IGNORECASE), "expiring_7"),
+	(re.compile(r"\bexpir\w*\b.*\b(?:90 days|3 months|three months|quarter)\b", re.IGNORECASE), "expiring_90"),
+	(re.compile(r"\bexpir\w*\b|\bout of date\b", re.IGNORECASE), "expiring_30"),
+	(re.compile(r"\blow stock\b|\brunning low\b|\breorder\w*\b|\bout of stock\b", re.IGNORECASE), "low_stock"),
+]
+BUSY_MESSAGE = "The assistant is busy with other requests right now, please try again in a moment."
+
+
+def busy_answer(prompt: str) -> str:
+	"""Answer without any model: the matching precomputed report, or a message to try again."""
+	for pattern, report in BUSY_REPORTS:
+		if pattern.search(prompt):
+			return f"The assistant is busy right now, here is the latest {report} report instead.\n{get_report_snapshot(report)}"
+	return BUSY_MESSAGE
+
+
+def new_conversation_memory() -> ConversationMemory:
+	"""Conversation memory whose older turns are summarised by the cheap summary model, in the background."""
+	return ConversationMemory(summariser=llm_summariser(router.llm("summary")))
+
+
+@lru_cache(maxsize=1)
+def get_agent_prompt():
+	"""The ReAct chat prompt, pulled from the LangChain hub once per process instead of on every question."""
+	return hub.pull("hwchase17/react-chat")
+
+
+# Tool Defining
+def execute_agent_tools(prompt: str, chat_history: ConversationMemory | List[Dict[str, str]] = None, mode: str = None) -> Dict[str, Any]:
+	"""
+	Execute agent tools with error handling and input validation.
+	chat_history should be a ConversationMemory, which is updated with this turn.
+	A plain list of messages is still accepted, it is read but not modified.
+	"""
+	mode = mode or AGENT_MODE
+	tools = build_agent_tools()
+
 	# Modified prompt template to handle general queries
-	prompt_template = hub.pull("hwchase17/react-chat")  # Using chat version instead
-
-	agent = create_react_agent(selected_llm, tools, prompt_template)
-	agent_executor = AgentExecutor(
-		agent=agent,
-		tools=tools,
-		handle_parsing_errors=True,  # Enable error handling
-		max_iterations=20,  # Limit iterations to prevent infinite loops
-		early_stopping_method="generate",  # Stop early if we can't make progress
-		verbose=True,  # Enable verbose logging
-		return_intermediate_steps=True,  # This can help with debugging
-	)
+	prompt_template = get_agent_prompt()  # Using chat version instead
+
+	def run_agent(agent_llm) -> Dict[str, Any]:
+		agent = create_react_agent(agent_llm, tools, prompt_template)
+		agent_executor = AgentExecutor(
+			agent=agent,
+			tools=tools,
+			handle_parsing_errors=True,  # Enable error handling
+			max_iterations=20,  # Limit iterations to prevent infinite loops
+			early_stopping_method="generate",  # Stop early if we can't make progress
+			verbose=True,  # Enable verbose logging
+			return_intermediate_steps=True,  # This can help with debugging
+		)
+		# Invoke the agent with prompt and chat history
+		return agent_executor.invoke(
+			{
+				"input": prompt,
+				"chat_history": history
+			}
+		)
 
 	# Initialise chat history if not provided
-	if chat_history is None:
-		chat_history = []
+	if isinstance(chat_history, ConversationMemory):
+		memory = chat_history
+	else:
+		memory = ConversationMemory.from_messages(chat_history or [])
+	# Bounded: summary of older turns plus the latest turns, rendered before this prompt is added.
+	history = memory.render()
 
 	try:
 		# Add basic input validation
@@ -133,22 +215,33 @@ def execute_agent_tools(prompt: str, chat_history: List[Dict[str, str]] = None)
 			return {"output": "Could you please provide more details about what you'd like to know?"}
 
 		# Add the current user input to chat history
-		chat_history.append({"role": "user", "content": prompt})
-
-		# Invoke the agent with prompt and chat history
-		result = agent_executor.invoke(
-			{
-				"input": prompt,
-				"chat_history": chat_history
-			}
-		)
+		memory.add("user", prompt)
+
+		result = None
+		if mode == "plan":
+			try:
+				# One planning call, concurrent tool calls, one synthesis call.
+				planner_tools = [tool for tool in tools if tool.name in PLANNER_TOOL_NAMES]
+				result = execute_planned_tools(router, planner_tools, prompt, history, PLANNER_SEQUENTIAL_TOOL_NAMES)
+			except PlanError as e:
+				logging.warning(f"Planner could not plan the request, falling back to the ReAct agent: {e}")
+
+		if result is None:
+			# Run on the cheapest agent model, escalating when it cannot reach an answer. Escalation reruns the
+			# whole agent with its tool calls, so a turn that already wrote (a product added, an NL2SQL update)
+			# is not escalated, the rerun would repeat the writes.
+			with track_writes() as writes:
+				result = router.run("agent", run_agent, accept=agent_reached_answer, can_escalate=lambda: not writes)
 
 		# If the agent returns successfully, append the assistant's response to chat history
 		if isinstance(result, dict):
-			chat_history.append({"role": "assistant", "content": result.get("output", "")})
+			memory.add("assistant", result.get("output", ""))
 
 		return result if isinstance(result, dict) else {"output": str(result)}
 
+	except LLMBusy as e:
+		logging.warning(f"Agent request shed: {e}")
+		return {"output": busy_answer(prompt), "error": True, "error_type": LLMBusy.__name__}
 	except Exception as e:
 		return {
 			"output": f"I'm having trouble processing that request. Could you please rephrase it? Error: {str(e)}",
@@ -158,6 +251,9 @@ def execute_agent_tools(prompt: str, chat_history: List[Dict[str, str]] = None)
 
 
 if __name__ == "__main__":
+	# Load the routed models in the background, so the first question does not wait for them.
+	threading.Thread(target=router.preload, daemon=True).start()
+	memory = new_conversation_memory()
 	while True:
 		try:
 			prompt = input("Enter a prompt (or 'exit' to quit): ")
@@ -165,7 +261,7 @@ if __name__ == "__main__":
 				break
 
 			print("Prompt: ", prompt)
-			response = execute_agent_tools(prompt)
+			response = execute_agent_tools(prompt, memory)
 
 			# Handle the response output
 			if isinstance(response, dict) and "output" in response:
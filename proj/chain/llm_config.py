@@ -0,0 +1,25 @@
+# Shared construction of the local Ollama models.
+# Every request carries the same keep_alive and num_ctx, so the model stays resident between questions
+# and Ollama never reloads it because of a different context size, which lets it reuse the KV cache
+# of the (byte-stable) prompt prefix.
+import os
+
+from dotenv import load_dotenv
+from langchain_ollama import OllamaLLM
+
+load_dotenv()
+
+DEFAULT_MODEL = "gemma2-ft2-structured"  # https://huggingface.co/bastienp/Gemma-2-2B-Instruct-structured-output
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+OLLAMA_NUM_CTX = int(os.getenv("OLLAMA_NUM_CTX", "4096"))
+
+
+def get_ollama_llm(model: str = DEFAULT_MODEL, **kwargs) -> OllamaLLM:
+	"""Create an OllamaLLM with the pinned keep_alive / num_ctx options, any option can be overridden."""
+	options = {
+		"temperature": 0,
+		"keep_alive": OLLAMA_KEEP_ALIVE,
+		"num_ctx": OLLAMA_NUM_CTX,
+	}
+	options.update(kwargs)
+	return OllamaLLM(model=model, **options)
@@ -0,0 +1,226 @@
+# Admission control for the LLM calls.
+# Every routed model sits behind a gate with a fixed number of slots (its Ollama concurrency). Calls that find
+# the slots taken wait in a priority queue: interactive chat ahead of batch reports ahead of background work
+# (conversation summaries), FIFO within a class. A call is shed with LLMBusy instead of queued when
+#   - the queue is full and nothing of a lower priority can be evicted to make room,
+#   - its request deadline would pass before a slot frees up and the call completes (estimated from the
+#     model's recent call times), or while it waits.
+# Callers turn LLMBusy into a fast answer: a deterministic rendering, a precomputed report or a "busy" message,
+# rather than holding a till for a reply that would come too late. The priority and deadline come from the
+# request context (see llm_request), so they follow a job through the agent, its tools and the planner's threads.
+import contextlib
+import contextvars
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+from langchain_core.callbacks import CallbackManagerForLLMRun
+from langchain_core.language_models import BaseLLM
+from langchain_core.outputs import LLMResult
+
+from proj.backend.db_metrics import Histogram
+
+logger = logging.getLogger(__name__)
+
+# Lower is served first.
+PRIORITIES = {"interactive": 0, "batch": 10, "background": 20}
+DEFAULT_PRIORITY = "interactive"
+
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "16"))  # Waiting calls per model.
+# Assumed duration of a call until the model has a few measured ones.
+LLM_SERVICE_ESTIMATE_S = float(os.getenv("LLM_SERVICE_ESTIMATE_S", "5"))
+LLM_SERVICE_SMOOTHING = 0.2  # Weight of the latest call in the moving average of call times.
+
+
+class LLMBusy(Exception):
+	"""The call was shed: the model's queue is full or the answer would come after the request deadline."""
+
+
+# (priority name, time.monotonic() deadline or None) of the current request.
+_request: contextvars.ContextVar[Tuple[str, Optional[float]]] = contextvars.ContextVar(
+	"llm_request", default=(DEFAULT_PRIORITY, None)
+)
+
+
+@contextlib.contextmanager
+def llm_request(priority: str = DEFAULT_PRIORITY, deadline: float = None):
+	"""Run the block's LLM calls with the given priority and time.monotonic() deadline."""
+	token = _request.set((priority if priority in PRIORITIES else DEFAULT_PRIORITY, deadline))
+	try:
+		yield
+	finally:
+		_request.reset(token)
+
+
+def current_request() -> Tuple[str, Optional[float]]:
+	return _request.get()
+
+
+@dataclass
+class _Waiter:
+	priority: str
+	event: threading.Event = field(default_factory=threading.Event)
+	state: str = "waiting"  # "waiting", "admitted" or "shed"
+	queued_at: float = field(default_factory=time.monotonic)
+
+
+class ModelGate:
+	"""Slots and the priority wait queue of one model."""
+
+	def __init__(self, model: str, limit: int, max_queue: int = LLM_MAX_QUEUE):
+		self.model = model
+		self.limit = max(limit, 1)
+		self.max_queue = max_queue
+		self.in_flight = 0
+		self.service_s = LLM_SERVICE_ESTIMATE_S
+		self._waiters: List[Tuple[int, int, _Waiter]] = []  # heap of (priority rank, arrival, waiter)
+		self._counter = itertools.count()
+		self._lock = threading.Lock()
+		self.admitted: Counter = Counter()
+		self.shed: Counter = Counter()
+		self.wait_ms = Histogram()
+		self.call_ms = Histogram()
+
+	def expected_wait(self, rank: int) -> float:
+		"""Seconds until a call of the given priority gets a slot, from the calls queued ahead of it (lock held)."""
+		if self.in_flight < self.limit and not self._waiters:
+			return 0.0
+		ahead = sum(1 for waiter_rank, _, _ in self._waiters if waiter_rank <= rank)
+		return (ahead + 1) * self.service_s / self.limit
+
+	def _shed(self, priority: str, reason: str):
+		self.shed[priority] += 1
+		logger.warning(f"Shed {priority} call to {self.model}: {reason}")
+		raise LLMBusy(f"{self.model} is busy: {reason}")
+
+	def acquire(self, priority: str, deadline: float = None):
+		"""Take a slot, waiting behind calls of the same or a higher priority, or raise LLMBusy."""
+		rank = PRIORITIES[priority]
+		with self._lock:
+			now = time.monotonic()
+			if self.in_flight < self.limit and not self._waiters:
+				self.in_flight += 1
+				self.admitted[priority] += 1
+				self.wait_ms.observe(0.0)
+				return
+			if deadline is not None and now + self.expected_wait(rank) + self.service_s > deadline:
+				self._shed(priority, "the answer would come after the deadline")
+			if len(self._waiters) >= self.max_queue:
+				# Make room by dropping the newest waiter of the lowest priority, if it ranks below this call.
+				victim = max(self._waiters)
+				if victim[0] <= rank:
+					self._shed(priority, "queue full")
+				self._waiters.remove(victim)
+				heapq.heapify(self._waiters)
+				victim[2].state = "shed"
+				victim[2].event.set()
+			waiter = _Waiter(priority)
+			heapq.heappush(self._waiters, (rank, next(self._counter), waiter))
+
+		# Give up while a call could still finish in time, so the caller has time left for a fallback.
+		timeout = None if deadline is None else max(deadline - self.service_s - time.monotonic(), 0.0)
+		waiter.event.wait(timeout)
+		with self._lock:
+			if waiter.state == "admitted":
+				self.admitted[priority] += 1
+				self.wait_ms.observe((time.monotonic() - waiter.queued_at) * 1000)
+				return
+			if waiter.state == "waiting":
+				self._waiters = [entry for entry in self._waiters if entry[2] is not waiter]
+				heapq.heapify(self._waiters)
+				self._shed(priority, "deadline reached while queued")
+			self._shed(priority, "evicted by a higher priority call")
+
+	def release(self, duration_s: float = None):
+		"""Hand the slot to the first waiter, or free it."""
+		with self._lock:
+			if duration_s is not None:
+				self.call_ms.observe(duration_s * 1000)
+				self.service_s += LLM_SERVICE_SMOOTHING * (duration_s - self.service_s)
+			while self._waiters:
+				waiter = heapq.heappop(self._waiters)[2]
+				if waiter.state == "waiting":
+					waiter.state = "admitted"
+					waiter.event.set()
+					return
+			self.in_flight -= 1
+
+	@contextlib.contextmanager
+	def slot(self, priority: str = None, deadline: float = None):
+		"""Hold a slot for the block, priority and deadline default to the current request's."""
+		request_priority, request_deadline = current_request()
+		self.acquire(priority or request_priority, deadline if deadline is not None else request_deadline)
+		start = time.monotonic()
+		try:
+			yield
+		finally:
+			self.release(time.monotonic() - start)
+
+	def snapshot(self) -> Dict[str, Any]:
+		with self._lock:
+			queued = Counter(waiter.priority for _, _, waiter in self._waiters)
+			return {
+				"limit": self.limit,
+				"in_flight": self.in_flight,
+				"queue_depth": len(self._waiters),
+				"queued": {priority: queued[priority] for priority in PRIORITIES},
+				"admitted": dict(self.admitted),
+				"shed": dict(self.shed),
+				"service_estimate_s": round(self.service_s, 3),
+				"wait": self.wait_ms.to_dict(),
+				"call": self.call_ms.to_dict(),
+			}
+
+
+class LLMGateway:
+	"""The gates of every model, shared by all routers in the process."""
+
+	def __init__(self, max_queue: int = LLM_MAX_QUEUE):
+		self.max_queue = max_queue
+		self._gates: Dict[str, ModelGate] = {}
+		self._lock = threading.Lock()
+
+	def gate(self, model: str, limit: int) -> ModelGate:
+		with self._lock:
+			if model not in self._gates:
+				self._gates[model] = ModelGate(model, limit, self.max_queue)
+			return self._gates[model]
+
+	def snapshot(self) -> Dict[str, Any]:
+		with self._lock:
+			gates = dict(self._gates)
+		return {model: gate.snapshot() for model, gate in gates.items()}
+
+
+class GatedLLM(BaseLLM):
+	"""Wraps an LLM so its calls go through the model's gate."""
+	inner: BaseLLM
+	gate: Any  # ModelGate, shared by every wrapper of the same model.
+
+	@property
+	def _llm_type(self) -> str:
+		return f"gated-{self.inner._llm_type}"
+
+	def _generate(self, prompts: List[str], stop: Optional[List[str]] = None,
+	              run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> LLMResult:
+		# Held per LLM call rather than per stage, so nested stages (agent -> SQL tool) cannot deadlock.
+		with self.gate.slot():
+			return self.inner._generate(prompts, stop=stop, run_manager=run_manager, **kwargs)
+
+
+_gateway: Optional[LLMGateway] = None
+_gateway_lock = threading.Lock()
+
+
+def get_llm_gateway() -> LLMGateway:
+	global _gateway
+	with _gateway_lock:
+		if _gateway is None:
+			_gateway = LLMGateway()
+		return _gateway
@@ -0,0 +1,261 @@
+# Load test driver for the backend (dashboards) and the agent service (chat).
+# Virtual users run in one asyncio loop, ramped through stages of concurrency, e.g. 10 users for 30 s, then
+# 25, then 50. Every request is timed, and each stage reports throughput, p50/p95/p99 latency and the error
+# rate per endpoint, plus the server side view at the end of the stage: pool checkouts and checkout waits of
+# each DatabaseManager engine (/metrics), and the LLM gate queues of the agent service.
+# A pool whose checkout wait p95 grows with the users is too small (DB_POOL_SIZE / DB_MAX_OVERFLOW), one whose
+# checked out connections stay well under its size can be shrunk.
+#
+# Scenarios:
+#   dashboard  a Streamlit page per user: inventory, orders, expiry, reports and change feed polls, with think time
+#   chat       a till per user: POST /jobs, then the job's events until it finishes, see agent_service.py
+#
+# Run it against a seeded database and, for chat, the fake Ollama (fake_ollama.py), e.g.:
+#   python -m proj.backend.seed mysql://root:@127.0.0.1:3306/shelfcare_load --stores 1,2
+#   DB_NAME=shelfcare_load python -m proj.backend.backend
+#   python -m proj.chain.fake_ollama --latency-ms 1500 --p95-ms 6000 --parallel 2
+#   OLLAMA_HOST=http://127.0.0.1:11435 DB_NAME=shelfcare_load python -m proj.chain.agent_service
+#   python -m proj.chain.load_test --scenario dashboard --stages 10:30,25:30,50:60 --stores 1,2
+#   python -m proj.chain.load_test --scenario chat --stages 2:60,5:60,10:60 --json chat.json
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+import aiohttp
+
+from proj.chain.prompts_examples import examples
+
+DASHBOARD_PATHS = ("inventory", "orders", "expiry", "reports", "changes?format=json")
+CHAT_QUESTIONS = [example["input"] for example in examples]
+FINISHED = {"done", "failed", "cancelled", "expired"}
+
+
+@dataclass
+class Stage:
+	users: int
+	duration_s: float
+
+
+def parse_stages(value: str) -> List[Stage]:
+	"""'10:30,25:30,50:60' -> 10 users for 30 s, then 25 for 30 s, then 50 for 60 s."""
+	stages = []
+	for item in value.split(","):
+		users, _, duration = item.partition(":")
+		stages.append(Stage(int(users), float(duration or 30)))
+	return stages
+
+
+def percentile(ordered: List[float], q: float) -> Optional[float]:
+	if not ordered:
+		return None
+	return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+@dataclass
+class Recorder:
+	"""Latency samples and errors per (stage, endpoint)."""
+	stage: int = 0
+	latencies: Dict[Tuple[int, str], List[float]] = field(default_factory=lambda: defaultdict(list))
+	errors: Dict[Tuple[int, str], int] = field(default_factory=lambda: defaultdict(int))
+	outcomes: Dict[Tuple[int, str], int] = field(default_factory=lambda: defaultdict(int))
+
+	def record(self, endpoint: str, elapsed_s: float, ok: bool):
+		self.latencies[(self.stage, endpoint)].append(elapsed_s * 1000)
+		if not ok:
+			self.errors[(self.stage, endpoint)] += 1
+
+	def report(self, stage: int, duration_s: float) -> Dict[str, Dict[str, Any]]:
+		endpoints = {}
+		for (sample_stage, endpoint), samples in sorted(self.latencies.items()):
+			if sample_stage != stage:
+				continue
+			ordered = sorted(samples)
+			endpoints[endpoint] = {
+				"requests": len(ordered),
+				"rps": round(len(ordered) / duration_s, 2),
+				"error_rate": round(self.errors[(stage, endpoint)] / len(ordered), 4),
+				"p50_ms": round(percentile(ordered, 0.5), 1),
+				"p95_ms": round(percentile(ordered, 0.95), 1),
+				"p99_ms": round(percentile(ordered, 0.99), 1),
+				"max_ms": round(ordered[-1], 1),
+			}
+		return endpoints
+
+
+async def timed(recorder: Recorder, endpoint: str, request) -> Tuple[Optional[int], Any]:
+	"""Run the request, record its latency, return the status and the JSON body (None on a connection error)."""
+	start = time.perf_counter()
+	try:
+		async with request as response:
+			body = await response.json(content_type=None) if response.status != 204 else None
+			recorder.record(endpoint, time.perf_counter() - start, response.status < 400)
+			return response.status, body
+	except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+		recorder.record(endpoint, time.perf_counter() - start, False)
+		return None, None
+
+
+async def dashboard_user(session: aiohttp.ClientSession, args, recorder: Recorder, headers: Dict[str, str]):
+	while True:
+		for path in DASHBOARD_PATHS:
+			await timed(recorder, f"GET /{path.split('?')[0]}", session.get(f"{args.backend_url}/{path}", headers=headers))
+		await asyncio.sleep(random.uniform(0.5, 1.5) * args.think_s)
+
+
+async def chat_user(session: aiohttp.ClientSession, args, recorder: Recorder, headers: Dict[str, str]):
+	while True:
+		start = time.perf_counter()
+		status, job = await timed(recorder, "POST /jobs", session.post(
+			f"{args.agent_url}/jobs",
+			json={"prompt": random.choice(CHAT_QUESTIONS), "priority": args.priority, "deadline_s": args.deadline_s},
+			headers=headers,
+		))
+		outcome = "rejected" if status == 429 else "error"
+		if status == 202:
+			outcome = await follow_job(session, args, job, headers)
+		recorder.outcomes[(recorder.stage, outcome)] += 1
+		# End to end: queueing, the agent's LLM and SQL calls, until the answer (or fallback) is there.
+		recorder.record("chat answer", time.perf_counter() - start, outcome == "done")
+		await asyncio.sleep(random.uniform(0.5, 1.5) * args.think_s)
+
+
+async def follow_job(session: aiohttp.ClientSession, args, job: Dict[str, Any], headers: Dict[str, str]) -> str:
+	"""Read the job's server-sent events until it finishes, returns its final status."""
+	try:
+		async with session.get(f"{args.agent_url}/jobs/{job['job_id']}/events", headers=headers) as response:
+			async for line in response.content:
+				line = line.decode().strip()
+				if line.startswith("data: "):
+					job = json.loads(line[len("data: "):])
+					if job["status"] in FINISHED:
+						# A shed request is answered (error_type LLMBusy), but not by the model.
+						return "shed" if job.get("error") == "LLMBusy" else job["status"]
+	except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+		pass
+	return "error"
+
+
+async def server_metrics(session: aiohttp.ClientSession, url: str) -> Optional[Dict[str, Any]]:
+	"""The capacity relevant parts of a service's /metrics, None when it is not reachable."""
+	try:
+		async with session.get(f"{url}/metrics", params={"top": 0}) as response:
+			metrics = await response.json(content_type=None)
+	except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+		return None
+	summary = {
+		"pools": {
+			label: {
+				key: pool.get(key) for key in ("size", "checked_out", "overflow", "checkouts", "connects")
+			} | {"checkout_wait_p95_ms": pool["checkout_wait"]["p95_ms"], "checkout_wait_max_ms": pool["checkout_wait"]["max_ms"]}
+			for label, pool in metrics.get("pools", {}).items()
+		}
+	}
+	if "llm_gateway" in metrics:
+		summary["llm_gateway"] = {
+			model: {key: gate[key] for key in ("limit", "in_flight", "queue_depth", "admitted", "shed", "service_estimate_s")}
+			| {"wait_p95_ms": gate["wait"]["p95_ms"]}
+			for model, gate in metrics["llm_gateway"].items()
+		}
+	return summary
+
+
+async def run(args) -> List[Dict[str, Any]]:
+	stages = parse_stages(args.stages)
+	recorder = Recorder()
+	user = dashboard_user if args.scenario == "dashboard" else chat_user
+	store_ids = [store.strip() for store in args.stores.split(",") if store.strip()]
+	metrics_urls = [args.backend_url] if args.scenario == "dashboard" else [args.agent_url]
+	results = []
+
+	timeout = aiohttp.ClientTimeout(total=args.timeout_s)
+	# No per-host limit, the users are the concurrency.
+	async with aiohttp.ClientSession(timeout=timeout, connector=aiohttp.TCPConnector(limit=0)) as session:
+		users: List[asyncio.Task] = []
+		for index, stage in enumerate(stages):
+			recorder.stage = index
+			print(f"Stage {index + 1}/{len(stages)}: {stage.users} users for {stage.duration_s:.0f} s")
+			stage_start = time.monotonic()
+			# Ramp up (or down) evenly over the first part of the stage.
+			change = stage.users - len(users)
+			step_s = min(args.ramp_s, stage.duration_s) / abs(change) if change else 0
+			for _ in range(abs(change)):
+				if change > 0:
+					headers = {"X-Store-Id": random.choice(store_ids)} if store_ids else {}
+					users.append(asyncio.create_task(user(session, args, recorder, headers)))
+				else:
+					users.pop().cancel()
+				await asyncio.sleep(step_s)
+			await asyncio.sleep(max(stage.duration_s - (time.monotonic() - stage_start), 0))
+
+			stage_result = {
+				"stage": index + 1,
+				"users": stage.users,
+				"duration_s": stage.duration_s,
+				"endpoints": recorder.report(index, stage.duration_s),
+				"outcomes": {outcome: count for (s, outcome), count in recorder.outcomes.items() if s == index},
+				"servers": {url: await server_metrics(session, url) for url in metrics_urls},
+			}
+			results.append(stage_result)
+			print_stage(stage_result)
+
+		for task in users:
+			task.cancel()
+		await asyncio.gather(*users, return_exceptions=True)
+	return results
+
+
+def print_stage(result: Dict[str, Any]):
+	print(f"{'endpoint':<16}{'requests':>9}{'rps':>8}{'errors':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}")
+	for endpoint, stats in result["endpoints"].items():
+		print(
+			f"{endpoint:<16}{stats['requests']:>9}{stats['rps']:>8}{stats['error_rate']:>8.1%}"
+			f"{stats['p50_ms']:>9}{stats['p95_ms']:>9}{stats['p99_ms']:>9}{stats['max_ms']:>9}"
+		)
+	if result["outcomes"]:
+		print("outcomes: " + ", ".join(f"{outcome} {count}" for outcome, count in sorted(result["outcomes"].items())))
+	for url, metrics in result["servers"].items():
+		if metrics is None:
+			print(f"{url}/metrics not reachable")
+			continue
+		for label, pool in metrics["pools"].items():
+			print(
+				f"pool {label}: size {pool['size']}, checked out {pool['checked_out']}, overflow {pool['overflow']}, "
+				f"checkout wait p95 {pool['checkout_wait_p95_ms']} ms, max {pool['checkout_wait_max_ms']} ms"
+			)
+		for model, gate in metrics.get("llm_gateway", {}).items():
+			print(
+				f"llm {model}: {gate['in_flight']}/{gate['limit']} in flight, {gate['queue_depth']} queued, "
+				f"wait p95 {gate['wait_p95_ms']} ms, admitted {gate['admitted']}, shed {gate['shed']}"
+			)
+	print()
+
+
+def main():
+	parser = argparse.ArgumentParser(description="Ramp concurrent dashboard or chat users and report latency per endpoint.")
+	parser.add_argument("--scenario", choices=("dashboard", "chat"), default="dashboard")
+	parser.add_argument("--stages", default="10:30,25:30,50:60", help="users:seconds per stage, comma separated")
+	parser.add_argument("--ramp-s", type=float, default=10, help="Time to add (or remove) a stage's users over.")
+	parser.add_argument("--think-s", type=float, default=1.0, help="Mean pause between a user's iterations.")
+	parser.add_argument("--stores", default="", help="Comma separated store ids, each user picks one (X-Store-Id).")
+	parser.add_argument("--backend-url", default="http://127.0.0.1:5000")
+	parser.add_argument("--agent-url", default="http://127.0.0.1:5001")
+	parser.add_argument("--priority", default="interactive", help="Priority of the chat jobs.")
+	parser.add_argument("--deadline-s", type=float, default=60, help="Deadline of the chat jobs.")
+	parser.add_argument("--timeout-s", type=float, default=180, help="Client timeout of one request.")
+	parser.add_argument("--json", help="Also write the results to this file.")
+	args = parser.parse_args()
+	args.backend_url, args.agent_url = args.backend_url.rstrip("/"), args.agent_url.rstrip("/")
+
+	results = asyncio.run(run(args))
+	if args.json:
+		with open(args.json, "w") as f:
+			json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,163 @@
+# Bounded conversation memory for the agent.
+# The last few turns are kept verbatim, older turns are folded into a rolling summary in a background thread,
+# and the rendered history is held under a token budget, so prompt length (and CPU latency) stays flat
+# over a long shift instead of growing with every message.
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+from langchain_core.language_models import BaseChatModel, BaseLLM
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import PromptTemplate
+
+from proj.chain.llm_gateway import llm_request
+
+logger = logging.getLogger(__name__)
+
+MEMORY_MAX_TURNS = int(os.getenv("MEMORY_MAX_TURNS", "6"))
+MEMORY_TOKEN_BUDGET = int(os.getenv("MEMORY_TOKEN_BUDGET", "1000"))
+MEMORY_SUMMARY_TOKENS = int(os.getenv("MEMORY_SUMMARY_TOKENS", "250"))
+
+# Summaries are computed off the request path, one at a time for the whole process.
+_summary_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="memory-summary")
+
+SUMMARY_PROMPT = PromptTemplate.from_template(
+	"""
+	Update the summary of a conversation between a pharmacy employee and an inventory assistant.
+	Keep product names, quantities, dates and decisions, drop small talk. Reply with the summary only, at most {max_words} words.
+
+	Current summary:
+	{summary}
+
+	New messages:
+	{messages}
+
+	Updated summary:
+	"""
+)
+
+Summariser = Callable[[str, List[Dict[str, str]]], str]
+
+
+def estimate_tokens(text: str) -> int:
+	# Rough, tokenizer-free estimate (about 4 characters per token), good enough for a budget.
+	return len(text) // 4 + 1
+
+
+def format_turn(turn: Dict[str, str]) -> str:
+	return f"{turn['role']}: {turn['content']}"
+
+
+def truncating_summariser(summary: str, turns: List[Dict[str, str]]) -> str:
+	"""Summariser without an LLM: keeps the most recent text that fits the summary budget."""
+	text = " ".join(filter(None, [summary] + [format_turn(turn) for turn in turns]))
+	max_chars = MEMORY_SUMMARY_TOKENS * 4
+	return text[-max_chars:]
+
+
+def llm_summariser(llm: BaseChatModel | BaseLLM) -> Summariser:
+	"""Summariser that asks the (cheap) LLM to fold new turns into the rolling summary."""
+	chain = SUMMARY_PROMPT | llm | StrOutputParser()
+
+	def summarise(summary: str, turns: List[Dict[str, str]]) -> str:
+		# Lowest priority: shed first when the models are busy, the turns are truncated instead.
+		with llm_request("background"):
+			return chain.invoke({
+				"summary": summary or "(none)",
+				"messages": "\n".join(format_turn(turn) for turn in turns),
+				"max_words": MEMORY_SUMMARY_TOKENS * 3 // 4,
+			}).strip()
+
+	return summarise
+
+
+class ConversationMemory:
+	"""Chat history with a verbatim window, a rolling summary and a token budget."""
+
+	def __init__(self, summariser: Summariser = None, max_turns: int = MEMORY_MAX_TURNS,
+	             token_budget: int = MEMORY_TOKEN_BUDGET):
+		self.summariser = summariser or truncating_summariser
+		self.max_turns = max_turns
+		self.token_budget = token_budget
+		self.summary = ""
+		self._turns: List[Dict[str, str]] = []
+		self._pending: List[Dict[str, str]] = []  # Turns out of the window, not folded into the summary yet.
+		self._summarising = False
+		self._lock = threading.Lock()
+
+	@classmethod
+	def from_messages(cls, messages: List[Dict[str, str]], **kwargs) -> "ConversationMemory":
+		memory = cls(**kwargs)
+		for message in messages:
+			memory.add(message["role"], message["content"])
+		return memory
+
+	def add(self, role: str, content: str) -> None:
+		"""Add a turn, identical repeats of the previous turn are dropped."""
+		turn = {"role": role, "content": (content or "").strip()}
+		with self._lock:
+			if not turn["content"] or (self._turns and self._turns[-1] == turn):
+				return
+			self._turns.append(turn)
+			overflow = len(self._turns) - self.max_turns
+			if overflow > 0:
+				self._pending.extend(self._turns[:overflow])
+				self._turns = self._turns[overflow:]
+			start_summary = bool(self._pending) and not self._summarising
+			if start_summary:
+				self._summarising = True
+
+		if start_summary:
+			_summary_executor.submit(self._summarise)
+
+	def _summarise(self) -> None:
+		"""Fold pending turns into the summary until none are left (runs in the background)."""
+		while True:
+			with self._lock:
+				pending, summary = list(self._pending), self.summary
+				if not pending:
+					self._summarising = False
+					return
+			try:
+				new_summary = self.summariser(summary, pending)
+			except Exception as e:
+				logger.error(f"Failed to summarise conversation, truncating instead: {e}")
+				new_summary = truncating_summariser(summary, pending)
+			with self._lock:
+				self.summary = new_summary
+				self._pending = self._pending[len(pending):]
+
+	@property
+	def messages(self) -> List[Dict[str, str]]:
+		with self._lock:
+			return list(self._pending) + list(self._turns)
+
+	def render(self) -> str:
+		"""The history to put in the prompt: summary, then the most recent turns that fit the budget."""
+		with self._lock:
+			summary, turns = self.summary, list(self._pending) + list(self._turns)
+
+		lines: List[str] = []
+		budget = self.token_budget
+		if summary:
+			summary_line = f"Summary of the earlier conversation: {summary}"
+			budget -= estimate_tokens(summary_line)
+		# Newest turns first, until the budget runs out.
+		for turn in reversed(turns):
+			line = format_turn(turn)
+			cost = estimate_tokens(line)
+			if cost > budget:
+				break
+			lines.insert(0, line)
+			budget -= cost
+		if summary:
+			lines.insert(0, summary_line)
+		return "\n".join(lines)
+
+	def clear(self) -> None:
+		with self._lock:
+			self.summary = ""
+			self._turns = []
+			self._pending = []
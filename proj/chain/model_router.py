@@ -0,0 +1,152 @@
+# Model tiering for the local Ollama models.
+# Each stage (agent reasoning, SQL generation, rephrasing) gets its own ladder of models, cheapest first.
+# A stage runs on the first model and only escalates to the next (larger) one when the smaller one fails,
+# e.g. a parse error, a SQL error or an empty result, so the 27B model is only paid for when it is needed.
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, TypeVar
+
+from langchain_core.language_models import BaseChatModel, BaseLLM
+
+from proj.chain.llm_config import get_ollama_llm
+from proj.chain.llm_gateway import GatedLLM, LLMBusy, LLMGateway, get_llm_gateway
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+# Cheapest adequate model first, escalation order after it.
+DEFAULT_ROUTES: Dict[str, List[str]] = {
+	"agent": ["gemma2-ft2-structured", "gemma2-ft9", "gemma2-ft27"],
+	"sql": ["gemma2-ft2-structured", "gemma2-ft9", "gemma2-ft27"],
+	"rephrase": ["gemma2-ft2-structured", "gemma2-ft9"],
+	"default": ["gemma2-ft2-structured", "gemma2-ft9"],
+}
+
+# Concurrent calls allowed per model, bigger models get fewer slots on a CPU box.
+DEFAULT_CONCURRENCY: Dict[str, int] = {
+	"gemma2-ft2-structured": 4,
+	"gemma2-ft9": 2,
+	"gemma2-ft27": 1,
+}
+
+
+def _routes_from_env() -> Dict[str, List[str]]:
+	"""MODEL_ROUTE_<STAGE>=model_a,model_b overrides the ladder of a stage."""
+	routes = {stage: list(models) for stage, models in DEFAULT_ROUTES.items()}
+	for key, value in os.environ.items():
+		if key.startswith("MODEL_ROUTE_") and value.strip():
+			routes[key[len("MODEL_ROUTE_"):].lower()] = [m.strip() for m in value.split(",") if m.strip()]
+	return routes
+
+
+def _concurrency_from_env() -> Dict[str, int]:
+	"""OLLAMA_MODEL_CONCURRENCY=gemma2-ft9=2,gemma2-ft27=1 overrides the per-model limits."""
+	concurrency = dict(DEFAULT_CONCURRENCY)
+	for item in os.getenv("OLLAMA_MODEL_CONCURRENCY", "").split(","):
+		if "=" in item:
+			model, limit = item.rsplit("=", 1)
+			concurrency[model.strip()] = int(limit)
+	return concurrency
+
+
+class ModelRouter:
+	"""Assigns each stage its own model and escalates to a larger model when the smaller one fails."""
+
+	def __init__(self, routes: Dict[str, List[str]] = None, concurrency: Dict[str, int] = None,
+	             llm_factory: Callable[[str], BaseLLM] = get_ollama_llm, gateway: LLMGateway = None):
+		self.routes = routes if routes is not None else _routes_from_env()
+		self.concurrency = concurrency if concurrency is not None else _concurrency_from_env()
+		self._llm_factory = llm_factory
+		# Queues and sheds the calls of each model by priority and deadline, see llm_gateway.py.
+		self.gateway = gateway or get_llm_gateway()
+		self._llms: Dict[str, BaseChatModel | BaseLLM] = {}
+		self._lock = threading.Lock()
+
+	@classmethod
+	def fixed(cls, llm: BaseChatModel | BaseLLM) -> "ModelRouter":
+		"""A router that uses the given LLM for every stage, without escalation (the previous behaviour)."""
+		router = cls(routes={"default": ["fixed"]}, concurrency={})
+		router._llms["fixed"] = llm
+		return router
+
+	def ladder(self, stage: str) -> List[str]:
+		return self.routes.get(stage) or self.routes["default"]
+
+	def llm_for_model(self, model: str) -> BaseChatModel | BaseLLM:
+		with self._lock:
+			if model not in self._llms:
+				llm = self._llm_factory(model)
+				limit = self.concurrency.get(model)
+				if limit:
+					llm = GatedLLM(inner=llm, gate=self.gateway.gate(model, limit))
+				self._llms[model] = llm
+			return self._llms[model]
+
+	def llm(self, stage: str) -> BaseChatModel | BaseLLM:
+		"""The cheapest model of the stage."""
+		return self.llm_for_model(self.ladder(stage)[0])
+
+	def run(self, stage: str, fn: Callable[[BaseChatModel | BaseLLM], T], accept: Callable[[T], bool] = None,
+	        can_escalate: Callable[[], bool] = None) -> T:
+		"""
+		Run fn with the stage's models in order, until one raises no error and its result is accepted.
+		The last model's result is returned even if not accepted, errors are only raised if every model failed.
+		LLMBusy is raised straight away, a larger (slower) model would not answer sooner.
+		can_escalate is asked before each rerun, e.g. False once an attempt had side effects that a rerun would repeat.
+		"""
+		models = self.ladder(stage)
+		result, last_error, has_result = None, None, False
+		for i, model in enumerate(models):
+			if i > 0 and can_escalate is not None and not can_escalate():
+				logger.info(f"Stage '{stage}' not escalated to {model}, the previous attempt had side effects")
+				break
+			try:
+				result = fn(self.llm_for_model(model))
+				has_result = True
+			except LLMBusy:
+				raise
+			except Exception as e:
+				last_error = e
+				logger.warning(f"Stage '{stage}' failed on {model}: {e}")
+				continue
+
+			if accept is None or accept(result) or i == len(models) - 1:
+				return result
+			logger.info(f"Stage '{stage}' result from {model} not accepted, escalating to {models[i + 1]}")
+
+		if has_result:
+			return result
+		raise last_error
+
+	def preload(self) -> List[str]:
+		"""Load every routed model into Ollama in parallel, so the first request does not pay for it. Returns the failed models."""
+		models = sorted({model for ladder in self.routes.values() for model in ladder})
+
+		def load(model: str) -> bool:
+			try:
+				# An empty prompt makes Ollama load the model and return straight away.
+				self.llm_for_model(model).invoke("")
+				logger.info(f"Preloaded model: {model}")
+				return True
+			except Exception as e:
+				logger.error(f"Failed to preload model {model}: {e}")
+				return False
+
+		with ThreadPoolExecutor(max_workers=max(len(models), 1)) as pool:
+			return [model for model, loaded in zip(models, pool.map(load, models)) if not loaded]
+
+
+_default_router: Optional[ModelRouter] = None
+_default_router_lock = threading.Lock()
+
+
+def get_model_router() -> ModelRouter:
+	"""Process-wide router, shared so the per-model gates hold across requests."""
+	global _default_router
+	with _default_router_lock:
+		if _default_router is None:
+			_default_router = ModelRouter()
+		return _default_router
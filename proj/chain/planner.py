@@ -0,0 +1,168 @@
+# Planner-executor mode for the agent.
+# Instead of the ReAct loop (one LLM round trip per tool call), the model writes the whole plan of tool calls
+# in one structured output, independent calls run concurrently in a thread pool,
+# and a single synthesis call turns the tool outputs into the answer. That is two LLM calls in the common case.
+# Tools that may write (e.g. Text to SQL running an UPDATE) never run next to another call, they run one at a time.
+import logging
+import os
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Collection, Dict, List
+
+from langchain_core.output_parsers import JsonOutputParser, StrOutputParser
+from langchain_core.prompts import PromptTemplate
+from langchain_core.tools import BaseTool
+
+from proj.chain.llm_gateway import LLMBusy
+from proj.chain.model_router import ModelRouter
+
+logger = logging.getLogger(__name__)
+
+PLANNER_MAX_WORKERS = int(os.getenv("PLANNER_MAX_WORKERS", "4"))
+PLANNER_MAX_CALLS = int(os.getenv("PLANNER_MAX_CALLS", "6"))
+
+PLAN_PROMPT = PromptTemplate.from_template(
+	"""
+	You are planning which tools to call to answer a question about a pharmacy's products, orders and product expiry.
+	Available tools:
+	{tools}
+
+	Respond ONLY with a JSON list of tool calls, for example:
+	[{{"id": 1, "tool": "<tool name>", "input": "<tool input>", "depends_on": []}}]
+	Calls that do not need each other's output must have an empty "depends_on", they will run at the same time.
+	Only list the ids of earlier calls in "depends_on" when a call really needs their output.
+	Respond with [] if no tool is needed.
+
+	Previous conversation:
+	{chat_history}
+
+	Question: {input}
+	Plan:
+	"""
+)
+
+SYNTHESIS_PROMPT = PromptTemplate.from_template(
+	"""
+	Answer the user question using only the tool results below.
+	Please provide a concise answer, and ensure to only answer the user question provided.
+	If a list is returned, please make sure to also mention these items (max 5), not ignore them.
+	If a tool returned an error, say what could not be answered.
+	If no tool was called, answer from the previous conversation.
+
+	Previous conversation:
+	{chat_history}
+
+	Question: {input}
+	Tool results:
+	{results}
+	Answer:
+	"""
+)
+
+
+class PlanError(Exception):
+	"""The model did not produce a usable plan, the caller should fall back to the ReAct agent."""
+
+
+def make_plan(router: ModelRouter, tools: Dict[str, BaseTool], prompt: str, chat_history: str) -> List[Dict[str, Any]]:
+	"""Ask the planner model for the list of tool calls, escalating the model if the plan is unusable."""
+	tool_descriptions = "\n".join(f"- {name}: {tool.description}" for name, tool in tools.items())
+
+	def plan_with(llm) -> List[Dict[str, Any]]:
+		raw_plan = (PLAN_PROMPT | llm | JsonOutputParser()).invoke({
+			"tools": tool_descriptions,
+			"chat_history": chat_history,
+			"input": prompt,
+		})
+		if isinstance(raw_plan, dict):
+			raw_plan = [raw_plan]
+		if not isinstance(raw_plan, list):
+			raise PlanError(f"Plan is not a list: {raw_plan}")
+
+		plan = []
+		for i, call in enumerate(raw_plan[:PLANNER_MAX_CALLS], start=1):
+			if not isinstance(call, dict) or call.get("tool") not in tools:
+				raise PlanError(f"Unknown tool in plan: {call}")
+			plan.append({
+				"id": call.get("id", i),
+				"tool": call["tool"],
+				"input": call.get("input", ""),
+				"depends_on": [d for d in call.get("depends_on") or [] if d != call.get("id", i)],
+			})
+		return plan
+
+	try:
+		return router.run("planner", plan_with)
+	except (PlanError, LLMBusy):
+		raise
+	except Exception as e:
+		raise PlanError(str(e)) from e
+
+
+def execute_plan(plan: List[Dict[str, Any]], tools: Dict[str, BaseTool], sequential: Collection[str] = ()) -> Dict[Any, str]:
+	"""
+	Run the plan in waves, every call whose dependencies are done runs concurrently with the others,
+	except calls of the sequential tools (those that may write), which run alone after the wave's other calls.
+	"""
+	results: Dict[Any, str] = {}
+	remaining = list(plan)
+
+	def run_call(call: Dict[str, Any]) -> str:
+		tool_input = call["input"]
+		dependencies = [f"{results[d]}" for d in call["depends_on"] if d in results]
+		if dependencies and isinstance(tool_input, str):
+			tool_input = tool_input + "\n\nContext from earlier steps:\n" + "\n".join(dependencies)
+		try:
+			return str(tools[call["tool"]].invoke(tool_input))
+		except Exception as e:
+			return f"Error: {e}"
+
+	with ThreadPoolExecutor(max_workers=PLANNER_MAX_WORKERS) as pool:
+		while remaining:
+			ready = [call for call in remaining if all(d in results for d in call["depends_on"])]
+			if not ready:
+				# Dependencies on ids that are not in the plan (or a cycle), run what is left without them.
+				ready = remaining
+			if len(ready) > 1 and any(call["tool"] in sequential for call in ready):
+				ready = [call for call in ready if call["tool"] not in sequential] or ready[:1]
+			# Each call runs in a copy of this context, so context variables (e.g. the job's result handles) carry over.
+			contexts = [contextvars.copy_context() for _ in ready]
+			for call, output in zip(ready, pool.map(lambda context, call: context.run(run_call, call), contexts, ready)):
+				logger.info(f"Planned tool call {call['tool']}({call['input']}) -> {output}")
+				results[call["id"]] = output
+			remaining = [call for call in remaining if call["id"] not in results]
+
+	return results
+
+
+def execute_planned_tools(
+		router: ModelRouter,
+		tools: List[BaseTool],
+		prompt: str,
+		chat_history: str = "",
+		sequential_tools: Collection[str] = ()
+) -> Dict[str, Any]:
+	"""
+	Plan, run the tools concurrently and synthesise the answer, returns the same shape as the AgentExecutor.
+	sequential_tools are the names of tools that may write, see execute_plan.
+	"""
+	tools_by_name = {tool.name: tool for tool in tools}
+	plan = make_plan(router, tools_by_name, prompt, chat_history)
+
+	# An empty plan is the planner's answer for a question no tool is needed for, it goes straight to synthesis.
+	results = execute_plan(plan, tools_by_name, sequential_tools) if plan else {}
+	formatted_results = "\n".join(
+		f"[{call['tool']}] input: {call['input']}\n{results[call['id']]}" for call in plan
+	) or "No tool was needed."
+
+	output = router.run("synthesis", lambda llm: (SYNTHESIS_PROMPT | llm | StrOutputParser()).invoke({
+		"chat_history": chat_history,
+		"input": prompt,
+		"results": formatted_results,
+	}))
+
+	return {
+		"input": prompt,
+		"output": output.strip(),
+		"intermediate_steps": [(call, results[call["id"]]) for call in plan],
+	}
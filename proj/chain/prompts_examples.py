@@ -5,11 +5,11 @@
 examples = [
     {
         "input": "Are any of my medicines going out of date?",
-        "query": "SELECT `p`.`product_name`, `pe`.`expiry_date`  FROM `products` AS `p` JOIN `product_expiry` AS `pe` ON `p`.`id` = `pe`.`id` WHERE `p`.`category` = 'Medicine' AND `pe`.`expiry_date` > CURDATE() ORDER BY `pe`.`expiry_date` ASC LIMIT 3;",
+        "query": "SELECT `p`.`product_name`, `pe`.`expiry_date`  FROM `products` AS `p` JOIN `expiry` AS `pe` ON `p`.`id` = `pe`.`product_id` WHERE `p`.`category` = 'Medicine' AND `pe`.`expiry_date` > CURDATE() ORDER BY `pe`.`expiry_date` ASC LIMIT 3;",
     },
     {
         "input": "Are any of my products going out of date?",
-        "query": "SELECT `products`.`product_name`, `product_expiry`.`expiry_date`  FROM `products`  JOIN `product_expiry` ON `products`.`id` = `product_expiry`.`id`  WHERE `product_expiry`.`expiry_date` < CURDATE() + INTERVAL 30 DAY  LIMIT 3;"
+        "query": "SELECT `products`.`product_name`, `expiry`.`expiry_date`  FROM `products`  JOIN `expiry` ON `products`.`id` = `expiry`.`product_id`  WHERE `expiry`.`expiry_date` < CURDATE() + INTERVAL 30 DAY  LIMIT 3;"
     },
     {
         "input": "Show me all medications in the 'Prescription' category",
@@ -37,7 +37,7 @@ examples = [
     },
     {
         "input": "List all products expiring in the next month",
-        "query": "SELECT `id`, `expiry_date`, `quantity` FROM `product_expiry` WHERE `expiry_date` BETWEEN CURDATE() AND LAST_DAY(CURDATE() + INTERVAL 1 MONTH) LIMIT 3;",
+        "query": "SELECT `id`, `expiry_date`, `quantity` FROM `expiry` WHERE `expiry_date` BETWEEN CURDATE() AND LAST_DAY(CURDATE() + INTERVAL 1 MONTH) LIMIT 3;",
     },
     {
         "input": "Create new order for Paracetamol, quantity 500",
@@ -53,7 +53,7 @@ examples = [
     },
     {
         "input": "Filter inventory by expiry date descending order",
-        "query": "SELECT `id`, `expiry_date`, `quantity` FROM `product_expiry` ORDER BY `expiry_date` DESC LIMIT 3;",
+        "query": "SELECT `id`, `expiry_date`, `quantity` FROM `expiry` ORDER BY `expiry_date` DESC LIMIT 3;",
     },
     {
         "input": "What is the date of my order for midodrine hydrochloride?",
@@ -8,7 +8,7 @@ from langchain_core.messages import AIMessage
 from langchain_community.vectorstores import FAISS
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import PromptTemplate, FewShotPromptTemplate
-from langchain_core.runnables import RunnablePassthrough, Runnable
+from langchain_core.runnables import RunnablePassthrough, Runnable, RunnableLambda
 from langchain_google_vertexai import VertexAIEmbeddings
 # can be used instead of FAISS.
 
@@ -24,13 +24,29 @@ from langchain_google_vertexai import VertexAIEmbeddings
 
 
 import os
+import re
+from functools import lru_cache
+from typing import List, Dict, Any, Optional
 from dotenv import load_dotenv
-from langchain_community.tools import QuerySQLDataBaseTool
 from langchain_core.language_models import BaseChatModel, BaseLLM
 from langchain_community.utilities.sql_database import SQLDatabase
-from langchain_ollama import OllamaLLM
-
-from proj.chain.prompts_examples import examples
+from sqlalchemy import text
+
+from proj.backend.analytics_mirror import AnalyticsMirror, get_analytics_mirror
+from proj.backend.change_feed import FEED_TABLES, get_publisher
+from proj.backend.database_orm import DatabaseManager, record_write
+from proj.backend.db_metrics import engine_options, instrument_engine
+from proj.backend.model_schema import Base
+from proj.backend.product_index import ProductNameIndex, get_product_index
+from proj.backend.report_snapshots import mark_dirty
+from proj.backend.tenancy import current_store_id, scope_sql, tenant_host
+from proj.chain.llm_config import get_ollama_llm
+from proj.chain.llm_gateway import LLMBusy, llm_request
+from proj.chain.model_router import ModelRouter
+from proj.chain.example_store import ExampleStore
+from proj.chain.tools.result_renderer import SQLResult, RenderConfig, render_sql_result, render_without_llm
+from proj.chain.tools.result_store import ResultBudget, fetch_bounded, get_result_store
+from proj.chain.tools.schema_linker import SchemaLinker
 
 # Not needed but boilerplate for SQL prompting.
 # from langchain.chains import create_sql_query_chain
@@ -56,21 +72,180 @@ os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = get_credentials_path()
 # {os.getenv('DB_PASSWORD')}
 db_connection_string = f"mysql://{os.getenv('DB_USER')}:@{os.getenv('DB_HOST')}/{os.getenv('DB_NAME')}"
 print("Connection String: ", db_connection_string)
-db = SQLDatabase.from_uri(db_connection_string, )  # include_tables=["products"]
+db = SQLDatabase.from_uri(db_connection_string, engine_args=engine_options("nl2sql"))  # include_tables=["products"]
+instrument_engine(db._engine, "nl2sql")
+
+
+# Shared resources, built once per process and reused by every question (and every batch worker).
+# Previously the FAISS index was re-embedded and the schema re-reflected on each call.
+@lru_cache(maxsize=1)
+def get_embeddings() -> VertexAIEmbeddings:
+	return VertexAIEmbeddings(model_name="text-embedding-004")  # text-embedding-005
+
+
+def validate_sql(query: str) -> Optional[str]:
+	"""Check a query against the current schema with EXPLAIN, without running it. Returns the error, if any."""
+	try:
+		with db._engine.connect() as connection:
+			# Sent as is: through text() a ':name' or a '10:30' literal would be taken for a bind parameter.
+			connection.exec_driver_sql(f"EXPLAIN {query.strip().rstrip(';')}", execution_options={"no_parameters": True})
+	except Exception as e:
+		return str(e)
+	return None
+
+
+@lru_cache(maxsize=1)
+def get_example_store() -> ExampleStore:
+	"""The few-shot example store, its index is loaded from disk or embedded only once."""
+	return ExampleStore(get_embeddings(), validate_sql)
+
+
+@lru_cache(maxsize=None)
+def get_example_selector(top_k: int = 3) -> SemanticSimilarityExampleSelector:
+	"""Return the dynamic few-shot example selector, it shares the store's index, so added examples are used at once."""
+	return get_example_store().selector(top_k)
+
+
+@lru_cache(maxsize=1)
+def get_table_info() -> str:
+	"""Return the table info (CREATE statements and sample rows), reflected only once."""
+	return db.get_table_info()
+
+
+# Only the tables relevant to the question go into the prompt (SQL_SCHEMA_LINKING=false for the full table info).
+SCHEMA_LINKING = os.getenv("SQL_SCHEMA_LINKING", "true").lower() != "false"
+
+
+def load_schema_vocabulary() -> Dict[str, List[str]]:
+	"""Product names, categories and suppliers, so a question naming one is linked to the products table."""
+	with db._engine.connect() as connection:
+		rows = connection.execute(text("SELECT DISTINCT `product_name`, `category`, `supplier` FROM `products`")).fetchall()
+	return {"products": [value for row in rows for value in row]}
+
+
+@lru_cache(maxsize=1)
+def get_schema_linker() -> SchemaLinker:
+	"""The schema linker, embedding the table and column descriptions only once."""
+	return SchemaLinker(Base.metadata, get_embeddings(), load_schema_vocabulary)
+
+
+def table_info_for(question: str) -> str:
+	"""Compact schema of the tables linked to the question, or the full table info when linking is off or fails."""
+	if SCHEMA_LINKING:
+		try:
+			schema = get_schema_linker().schema_for(question)
+			if schema:
+				return schema
+		except Exception as e:
+			logger.warning(f"Schema linking failed, using the full schema: {str(e)}")
+	return get_table_info()
+
+
+# SELECTs go to a read replica when DB_REPLICA_HOSTS is set, so analytical questions don't compete with order writes.
+route_reads_to_replicas = True
+# Analytical questions go to the embedded DuckDB / SQLite mirror instead (ANALYTICS_MIRROR=false to disable).
+route_analytics_to_mirror = os.getenv("ANALYTICS_MIRROR", "true").lower() != "false"
+# Product names resolve against this index rather than the store's production one, when set (see use_database).
+product_name_index: Optional[ProductNameIndex] = None
+
+
+def use_database(db_uri: str) -> SQLDatabase:
+	"""Point the chain at a different database (e.g. a seeded local copy for evaluation)."""
+	global db, route_reads_to_replicas, route_analytics_to_mirror, product_name_index
+	db = SQLDatabase.from_uri(db_uri)
+	route_reads_to_replicas = False
+	route_analytics_to_mirror = False
+	get_table_info.cache_clear()
+	# get_product_index reads the production database, names must resolve to this database's products.
+	product_name_index = ProductNameIndex()
+	with db._engine.connect() as connection:
+		product_name_index.rebuild(connection.execute(
+			text("SELECT id, product_name FROM products WHERE store_id = :store_id"), {"store_id": current_store_id()}
+		).all())
+	product_name_index.stale = False
+	return db
+
+
+# The prompt is laid out so everything that is the same for every question comes first:
+# the instructions, then the schema, and only then the dynamic examples and the question.
+# A byte-stable prefix lets Ollama reuse its KV cache instead of re-evaluating the whole prompt each time.
+# With schema linking the schema differs per question, so the cached prefix ends after the instructions,
+# but the linked schema is a fraction of the full table info (no CREATE statements or sample rows).
+SQL_TOP_K = 3
+SQL_PROMPT_INSTRUCTIONS = (
+	'You are a MySQL expert. Given an input question, first create a syntactically correct MySQL query to '
+	'run, then look at the results of the query and return the answer to the input question.'
+	'Unless the user specifies in the question a specific number of examples to obtain, query for at most '
+	+ str(SQL_TOP_K) + ' results using the LIMIT clause as per MySQL. You can order the results to return the most '
+	                   'informative data in the database.'
+	                   'Never query for all columns from a table. You must query only the columns that are needed to answer '
+	                   'the question. Wrap each column name in backticks (`) to denote them as delimited identifiers.'
+	                   'Pay attention to use only the column names you can see in the tables below. Be careful to not query '
+	                   'for columns that do not exist. Also, pay attention to which column is in which table.'
+	                   'Pay attention to use CURDATE() function to get the current date, if the question involves "today".'
+	                   'Please note expiry information and orders will require queries that involve relations like JOIN between ids,'
+	                   ' please review column names carefully.'
+	                   ' Never filter on store_id, every query is limited to the user\'s pharmacy automatically.'
+	                   ''
+	                   'Use the following format:'
+	                   ''
+	                   'Question: Question here'
+	                   'SQLQuery: SQL Query to run'
+	                   'SQLResult: Result of the SQLQuery'
+	                   'Answer: Final answer here'
+	                   ''
+	                   'Please only respond with the SQL query.'
+)
+
+
+def sql_prompt_prefix(instructions: str) -> str:
+	return (
+		instructions +
+		'\n\nOnly use the following tables:\n'
+		'{table_info}'
+		'\n\nBelow are a number of examples of questions and their corresponding SQL queries.'
+	)
+
+
+SQL_PROMPT_PREFIX = sql_prompt_prefix(SQL_PROMPT_INSTRUCTIONS)
+SQL_PROMPT_SUFFIX = "User input: {input}\nSQL query: "
+
+# Query shapes the columnar mirror is for: grouping, window functions and aggregates over joins. Routing on the
+# generated query rather than the question keeps lookups ("how many units of X are in stock?") on MySQL, current
+# to the last write, where the mirror can lag by a sync interval.
+ANALYTICAL_QUERY_PATTERN = re.compile(r"\bGROUP\s+BY\b|\bOVER\s*\(", re.IGNORECASE)
+AGGREGATE_PATTERN = re.compile(r"\b(?:COUNT|SUM|AVG|MIN|MAX)\s*\(", re.IGNORECASE)
+JOIN_PATTERN = re.compile(r"JOIN\b", re.IGNORECASE)
+
+
+def to_mirror_dialect(query: str, dialect: str) -> str:
+	"""Translate the MySQL-isms the model still produces (the few-shot examples are MySQL)."""
+	if dialect == "duckdb":
+		query = query.replace("`", '"')
+		query = re.sub(r"\bCURDATE\(\)", "CURRENT_DATE", query, flags=re.IGNORECASE)
+		return re.sub(r"\bNOW\(\)", "CURRENT_TIMESTAMP", query, flags=re.IGNORECASE)
+	query = re.sub(r"\bCURDATE\(\)", "date('now')", query, flags=re.IGNORECASE)
+	return re.sub(r"\bNOW\(\)", "datetime('now')", query, flags=re.IGNORECASE)
+
+
+def is_analytical_query(query: str) -> bool:
+	return bool(READ_QUERY_PATTERN.match(query)) and bool(
+		ANALYTICAL_QUERY_PATTERN.search(query) or (AGGREGATE_PATTERN.search(query) and JOIN_PATTERN.search(query))
+	)
+
+
+def analytics_mirror_for(query: str) -> Optional[AnalyticsMirror]:
+	"""The mirror to run this generated query on, None for other queries or while the mirror is syncing."""
+	if not route_analytics_to_mirror or not is_analytical_query(query):
+		return None
+	mirror = get_analytics_mirror()
+	return mirror if mirror.ready else None
 
 
 # Lambda Functions
-def generate_better_sql_query_chain(prompt: str, llm: BaseChatModel | BaseLLM) -> str:
+def generate_better_sql_query_chain(prompt: str, llm: BaseChatModel | BaseLLM, prefix: str = SQL_PROMPT_PREFIX) -> str:
 	# Converting this to dynamic few-shot example, for better performance.
-	top_k = 3
-	example_selector = SemanticSimilarityExampleSelector.from_examples(
-		examples,
-		# embeddings callable,
-		VertexAIEmbeddings(model_name="text-embedding-004"),  # text-embedding-005
-		FAISS,  # VertexAIVectorSearch
-		k=top_k,
-		input_keys=["input"]
-	)
+	example_selector = get_example_selector(SQL_TOP_K)
 
 	example_prompt = PromptTemplate.from_template("User input: {input}\nSQL query: {query}")
 
@@ -78,42 +253,15 @@ def generate_better_sql_query_chain(prompt: str, llm: BaseChatModel | BaseLLM) -
 		example_selector=example_selector,
 		example_prompt=example_prompt,
 		input_variables=['input', 'table_info'],
-		prefix=
-		'You are a MySQL expert. Given an input question, first create a syntactically correct MySQL query to '
-		'run, then look at the results of the query and return the answer to the input question.'
-		'Unless the user specifies in the question a specific number of examples to obtain, query for at most '
-		+ str(top_k) + ' results using the LIMIT clause as per MySQL. You can order the results to return the most '
-		               'informative data in the database.'
-		               'Never query for all columns from a table. You must query only the columns that are needed to answer '
-		               'the question. Wrap each column name in backticks (`) to denote them as delimited identifiers.'
-		               'Pay attention to use only the column names you can see in the tables below. Be careful to not query '
-		               'for columns that do not exist. Also, pay attention to which column is in which table.'
-		               'Pay attention to use CURDATE() function to get the current date, if the question involves "today".'
-		               'Please note expiry information and orders will require queries that involve relations like JOIN between ids,'
-		               ' please review column names carefully.'
-		               ''
-		               'Use the following format:'
-		               ''
-		               'Question: Question here'
-		               'SQLQuery: SQL Query to run'
-		               'SQLResult: Result of the SQLQuery'
-		               'Answer: Final answer here'
-		               ''
-		               'Only use the following tables:'
-		               '{table_info}'
-		               ''
-		               'Question: {input}'
-		               'Please only respond with the SQL query.'
-		               ''
-		               ''
-		               'Below are a number of examples of questions and their corresponding SQL queries.',
-		suffix="User input: {input}\nSQL query: ",
+		# Static prefix (instructions + schema), then the per-question examples and input.
+		prefix=prefix,
+		suffix=SQL_PROMPT_SUFFIX,
 	)
 	# print("Prompt Used: ", sql_prompt)
 	# Add custom instructions to llm model.
 	chain = sql_prompt | llm
 	# Execute the chain with the query.
-	query = chain.invoke({"input": prompt, "table_info": db.get_table_info()})
+	query = chain.invoke({"input": prompt, "table_info": table_info_for(prompt)})
 	if isinstance(query, AIMessage):
 		response = query.content
 	else:
@@ -125,8 +273,107 @@ def generate_better_sql_query_chain(prompt: str, llm: BaseChatModel | BaseLLM) -
 
 
 def execute_sql_query(query: str) -> str:
-	execute_query = QuerySQLDataBaseTool(db=db)
-	return execute_query.invoke(query)
+	# Bounded (streamed, summarised when large) rather than QuerySQLDataBaseTool's fetch-all string.
+	return str(run_sql_query(query))
+
+
+READ_QUERY_PATTERN = re.compile(r"^\s*\(?\s*(?:SELECT|WITH|SHOW|DESCRIBE|EXPLAIN)\b", re.IGNORECASE)
+DML_TABLE_PATTERN = re.compile(r"^\s*(?:INSERT\s+INTO|UPDATE|DELETE\s+FROM)\s+`?(\w+)`?", re.IGNORECASE)
+# `product_name` = 'Paracetmol' (optionally table qualified), the literal is group 2.
+PRODUCT_NAME_LITERAL_PATTERN = re.compile(r"(`?product_name`?\s*=\s*)'((?:[^'\\]|\\.|'')*)'", re.IGNORECASE)
+# Product names in generated WHERE clauses are resolved against the product name index before execution
+# (SQL_RESOLVE_PRODUCT_NAMES=false to run them as written).
+RESOLVE_PRODUCT_NAMES = os.getenv("SQL_RESOLVE_PRODUCT_NAMES", "true").lower() != "false"
+
+
+def current_product_index() -> ProductNameIndex:
+	"""The index product names resolve against: the store's, or the one use_database built."""
+	return product_name_index if product_name_index is not None else get_product_index()
+
+
+def resolve_product_names(query: str) -> str:
+	"""
+	Replace misspelled or differently cased product names compared with `product_name =` by the stored name,
+	when the index has one confident match, so the query finds the row instead of returning nothing.
+	"""
+	if not RESOLVE_PRODUCT_NAMES or "product_name" not in query.lower():
+		return query
+	index = current_product_index()
+
+	def replace(match: re.Match) -> str:
+		name = match.group(2).replace("''", "'").replace("\\'", "'")
+		resolved = index.resolve(name)
+		if resolved is None or resolved.name == name:
+			return match.group(0)
+		logger.info(f"Resolved product name '{name}' to '{resolved.name}' (id {resolved.id}, score {resolved.score})")
+		return f"{match.group(1)}'{resolved.name.replace(chr(39), chr(39) * 2)}'"
+
+	return PRODUCT_NAME_LITERAL_PATTERN.sub(replace, query)
+
+
+def stash_result(query: str, result: SQLResult, budget: ResultBudget) -> SQLResult:
+	"""Keep results too large for the prompt under a handle, so the UI can page through them."""
+	result.prompt_rows = budget.summary_rows
+	if result.truncated or len(result.rows) > budget.summary_rows:
+		result.handle = get_result_store().put(query, result)
+	return result
+
+
+def run_sql_query(query: str, budget: ResultBudget = None) -> SQLResult:
+	"""
+	Execute the query and keep the result structured (columns and rows), so it can be rendered without the LLM.
+	SELECTs are streamed from a server-side cursor and cut off at the row / byte budget.
+	"""
+	budget = budget or ResultBudget.from_env()
+	# Stores on another database host (DB_TENANT_HOSTS) use that host's shared engine.
+	engine = db._engine if tenant_host() is None else DatabaseManager().engine()
+	is_read = bool(READ_QUERY_PATTERN.match(query))
+	if route_reads_to_replicas and is_read:
+		engine = DatabaseManager().replica_engine() or engine
+	try:
+		# Only the current store's rows are read or written, whatever the model generated.
+		scoped_query = scope_sql(query)
+		logger.debug(f"Store scoped SQL Query: {scoped_query}")
+		with engine.connect() as connection:
+			if is_read:
+				connection = connection.execution_options(stream_results=True)
+			cursor = connection.execute(text(scoped_query))
+			if not cursor.returns_rows:
+				connection.commit()
+				if cursor.rowcount > 0:
+					match = DML_TABLE_PATTERN.match(query)
+					table = match.group(1).lower() if match else None
+					record_write(query.split()[0].lower(), table or "unknown")
+					# Writes made through NL2SQL (e.g. stock updates) also make the precomputed reports and the
+					# mirrored table stale.
+					mark_dirty(table)
+					# The changed rows are unknown here, so dashboards are told to refetch the table.
+					if table in FEED_TABLES:
+						get_publisher().publish(table, "invalidate")
+					if table == "products":
+						current_product_index().mark_stale()
+				return SQLResult(returns_rows=False, rowcount=cursor.rowcount)
+
+			columns = list(cursor.keys())
+			rows, truncated = fetch_bounded(cursor, budget)
+			if truncated:
+				# Closing a server-side cursor reads the rest of the result, drop the connection instead.
+				connection.invalidate()
+			return stash_result(query, SQLResult(columns=columns, rows=rows, truncated=truncated), budget)
+	except Exception as e:
+		# Like QuerySQLDataBaseTool, hand the error on so the rephrase step can explain it.
+		return SQLResult(error=str(e))
+
+
+def run_analytics_query(query: str, budget: ResultBudget = None) -> SQLResult:
+	"""Execute a read query on the analytics mirror, translated to its dialect."""
+	budget = budget or ResultBudget.from_env()
+	mirror = get_analytics_mirror()
+	try:
+		columns, rows, truncated = mirror.query(to_mirror_dialect(scope_sql(query), mirror.dialect), budget.max_rows)
+		return stash_result(query, SQLResult(columns=columns, rows=[tuple(row) for row in rows], truncated=truncated), budget)
+	except Exception as e:
+		return SQLResult(error=str(e))
 
 
 def rephrase_db_results(llm: BaseChatModel | BaseLLM):
@@ -153,43 +400,81 @@ def rephrase_db_results(llm: BaseChatModel | BaseLLM):
 	return rephrase_chain
 
 
-def get_database_chain(llm: BaseChatModel | BaseLLM) -> Runnable:
-    # Get the rephrase chain
-    rephrase_chain = rephrase_db_results(llm)
+def get_database_chain(llm: BaseChatModel | BaseLLM | ModelRouter, render_config: RenderConfig = None) -> Runnable:
+    # A plain LLM is used for every stage as before, a ModelRouter picks (and escalates) the model per stage.
+    router = llm if isinstance(llm, ModelRouter) else ModelRouter.fixed(llm)
+    # Decides which results are rendered directly, skipping the rephrase LLM call.
+    render_config = render_config or RenderConfig.from_env()
+    if route_analytics_to_mirror:
+        # Start the background sync, analytical queries use MySQL until the first full sync is done.
+        get_analytics_mirror()
 
     # Create functions that include logging
     def log_and_generate_sql(x):
-        query = generate_better_sql_query_chain(x["question"], llm)
+        query = generate_better_sql_query_chain(x["question"], x["llm"], x.get("prefix", SQL_PROMPT_PREFIX))
         logger.info(f"Generated SQL Query: {query}")
-        return query
+        return resolve_product_names(query)
 
     def log_and_execute_sql(x):
-        result = execute_sql_query(x["query"])
-        logger.info(f"SQL Execution Result: {result}")
+        result = run_analytics_query(x["query"]) if x.get("analytics") else run_sql_query(x["query"])
+        if result.error or not result.returns_rows:
+            logger.info(f"SQL Execution Result: {result.error or f'{result.rowcount} rows changed'}")
+        else:
+            # Only the size at INFO, a large result would flood the log.
+            logger.info(f"SQL Execution Result: {len(result.rows)} rows{' (truncated)' if result.truncated else ''}")
+            logger.debug(f"SQL Execution Result: {result}")
         return result
 
+    generate_step = RunnableLambda(log_and_generate_sql)
+    execute_step = RunnableLambda(log_and_execute_sql)
+
+    def generate_and_execute_sql(x):
+        def attempt(stage_llm):
+            query = generate_step.invoke({"question": x["question"], "llm": stage_llm})
+            if analytics_mirror_for(query) is not None:
+                # Grouping, windows and aggregates over joins run on the mirror, off the MySQL primary.
+                result = execute_step.invoke({"query": query, "analytics": True})
+                if not result.error and result.rows:
+                    return {"query": query, "result": result}
+                # MySQL-only syntax, or semantics that differ (e.g. case sensitive comparisons): the same query
+                # runs on MySQL, without generating it again.
+                logger.info(f"Analytics mirror gave no result, running the query on MySQL: {result.error or 'no rows'}")
+            return {"query": query, "result": execute_step.invoke({"query": query})}
+
+        # Escalate to a larger model on a generation error, a SQL error or an empty SELECT result.
+        return router.run(
+            "sql",
+            attempt,
+            accept=lambda r: not r["result"].error and (bool(r["result"].rows) or not r["result"].returns_rows)
+        )
+
     def log_and_rephrase(x):
-        output = rephrase_chain.invoke({
-            "question": x["question"],
-            "query": x["query"],
-            "result": x["result"]
-        })
+        # Counts, single values and short tables are formatted directly.
+        output = render_sql_result(x["query"], x["result"], render_config)
+        if output is not None:
+            logger.info(f"Rendered Output: {output}")
+            return output
+
+        try:
+            output = router.run("rephrase", lambda stage_llm: rephrase_db_results(stage_llm).invoke({
+                "question": x["question"],
+                "query": x["query"],
+                "result": str(x["result"])
+            }))
+        except LLMBusy as e:
+            # The rows are already fetched, a plain rendering now beats a nicer answer after the deadline.
+            logger.info(f"Rephrase shed ({e}), rendering the result directly")
+            return render_without_llm(x["query"], x["result"])
         logger.info(f"Rephrased Output: {output}")
         return output
 
     # Create the master chain using proper RunnablePassthrough
     master_chain = (
-        # Step 1: Generate SQL query
-        {
-            "question": RunnablePassthrough(),
-            "query": log_and_generate_sql
-        }
-        | RunnablePassthrough.assign(
-            # Step 2: Execute SQL query
-            result=log_and_execute_sql
-        )
+        # Step 1 + 2: Generate and execute the SQL query (escalating the model if needed)
+        RunnablePassthrough.assign(sql=generate_and_execute_sql)
+        | (lambda x: {"question": x["question"], "query": x["sql"]["query"], "result": x["sql"]["result"]})
         | RunnablePassthrough.assign(
-            # Step 3: Rephrase results
+            # Step 3: Render or rephrase results
             output=log_and_rephrase
         )
         | (lambda x: x["output"])  # Extract just the output string
@@ -198,12 +483,46 @@ def get_database_chain(llm: BaseChatModel | BaseLLM) -> Runnable:
     return master_chain
 
 
+def batch_ask(questions: List[str], llm: BaseChatModel | BaseLLM | ModelRouter, max_concurrency: int = 4) -> List[Dict[str, Any]]:
+	"""
+	Run many questions through the database chain concurrently.
+	Identical questions are only asked once, the example index, schema info and DB pool are shared,
+	and results are returned in the same order as the questions, with errors reported per item.
+	"""
+	# Dedupe while keeping first-seen order.
+	unique_questions = list(dict.fromkeys(questions))
+
+	# Warm the shared resources up front, so the workers do not all race to build them.
+	get_example_selector(SQL_TOP_K)
+	get_table_info()
+	if SCHEMA_LINKING:
+		get_schema_linker()
+
+	db_chain = get_database_chain(llm)
+	# Queued behind interactive chat at the model gates (the batch workers copy this context).
+	with llm_request("batch"):
+		outputs = db_chain.batch(
+			[{"question": question} for question in unique_questions],
+			config={"max_concurrency": max_concurrency},
+			return_exceptions=True,
+		)
+
+	answers = {}
+	for question, output in zip(unique_questions, outputs):
+		if isinstance(output, Exception):
+			logger.error(f"Batch question failed: {question}, Error: {output}")
+			answers[question] = {"question": question, "output": None, "error": str(output)}
+		else:
+			answers[question] = {"question": question, "output": output, "error": None}
+
+	return [dict(answers[question]) for question in questions]
+
+
 
 if __name__ == "__main__":
-	gm_llm = OllamaLLM(
+	gm_llm = get_ollama_llm(
 		# model="gemma2-ft9",
 		model="gemma2-ft2-structured",  # https://huggingface.co/bastienp/Gemma-2-2B-Instruct-structured-output
-		temperature=0,
 	)
 	selected_llm = gm_llm
 	chain = get_database_chain(llm=selected_llm)
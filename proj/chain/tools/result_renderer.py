@@ -0,0 +1,168 @@
+# Deterministic rendering of SQL results.
+# Counts, single values and short tables do not need an LLM to be turned into an answer,
+# so they are formatted directly here and only large or ambiguous results go to the rephrase model.
+import os
+import re
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, List, Optional
+
+
+@dataclass
+class SQLResult:
+	"""Structured result of running a SQL statement, used by both the renderer and the rephrase prompt."""
+	columns: List[str] = field(default_factory=list)
+	rows: List[tuple] = field(default_factory=list)
+	returns_rows: bool = True
+	rowcount: int = -1
+	error: Optional[str] = None
+	truncated: bool = False  # The fetch stopped at the row / byte budget, there are more rows.
+	handle: Optional[str] = None  # Where the fetched rows are kept for paging, see result_store.py
+	prompt_rows: int = 20  # Larger results are summarised for the LLM instead of listed.
+
+	def __str__(self) -> str:
+		# Same shape QuerySQLDataBaseTool used to hand the rephrase prompt, for results that fit.
+		if self.error:
+			return f"Error: {self.error}"
+		if not self.rows:
+			return ""
+		if self.truncated or len(self.rows) > self.prompt_rows:
+			return self.summary()
+		return str(self.rows)
+
+	def summary(self) -> str:
+		"""Row count, per column stats and the first rows, a bounded stand-in for a large result."""
+		count = f"At least {len(self.rows)} rows (more were not fetched)" if self.truncated else f"{len(self.rows)} rows"
+		lines = [f"{count}, columns: {', '.join(self.columns)}."]
+		for index, column in enumerate(self.columns):
+			lines.append(f"- {column}: {column_stats([row[index] for row in self.rows])}")
+		lines.append(f"First {min(self.prompt_rows, len(self.rows))} rows: {self.rows[:self.prompt_rows]}")
+		return "\n".join(lines)
+
+
+def column_stats(values: List[Any]) -> str:
+	present = [value for value in values if value is not None]
+	nulls = f", {len(values) - len(present)} empty" if len(present) < len(values) else ""
+	if not present:
+		return "all empty"
+	if all(isinstance(value, (int, float, Decimal)) and not isinstance(value, bool) for value in present):
+		average = sum(float(value) for value in present) / len(present)
+		return f"min {format_value(min(present))}, max {format_value(max(present))}, average {format_value(average)}{nulls}"
+	if all(isinstance(value, (date, datetime)) for value in present):
+		return f"from {format_value(min(present))} to {format_value(max(present))}{nulls}"
+	common = Counter(str(value) for value in present).most_common(3)
+	distinct = len(set(map(str, present)))
+	return f"{distinct} distinct, most common: {', '.join(f'{value} ({count})' for value, count in common)}{nulls}"
+
+
+@dataclass
+class RenderConfig:
+	"""When results are rendered directly instead of being rephrased by the LLM."""
+	enabled: bool = True
+	max_rows: int = 10  # Larger results go to the rephrase model, which summarises them.
+	max_columns: int = 6
+	max_cell_chars: int = 80  # Long free text (e.g. descriptions) is better summarised by the LLM.
+
+	@classmethod
+	def from_env(cls) -> "RenderConfig":
+		return cls(
+			enabled=os.getenv("NL2SQL_RENDER_RESULTS", "true").lower() not in ("0", "false", "no"),
+			max_rows=int(os.getenv("NL2SQL_RENDER_MAX_ROWS", cls.max_rows)),
+			max_columns=int(os.getenv("NL2SQL_RENDER_MAX_COLUMNS", cls.max_columns)),
+			max_cell_chars=int(os.getenv("NL2SQL_RENDER_MAX_CELL_CHARS", cls.max_cell_chars)),
+		)
+
+
+AGGREGATE_PATTERN = re.compile(r"^\s*SELECT\s+(?:DISTINCT\s+)?(COUNT|SUM|AVG|MIN|MAX)\s*\(", re.IGNORECASE)
+
+SCALAR_TEMPLATES = {
+	"COUNT": "There are {value} matching records.",
+	"SUM": "The total {label} is {value}.",
+	"AVG": "The average {label} is {value}.",
+	"MIN": "The lowest {label} is {value}.",
+	"MAX": "The highest {label} is {value}.",
+	None: "The {label} is {value}.",
+}
+
+
+def format_value(value: Any) -> str:
+	if value is None:
+		return "-"
+	if isinstance(value, Decimal):
+		return f"{value:.2f}" if value != value.to_integral_value() else str(value.to_integral_value())
+	if isinstance(value, float):
+		return f"{value:.2f}".rstrip("0").rstrip(".")
+	if isinstance(value, (date, datetime)):
+		return value.isoformat()
+	return str(value).replace("|", "\\|").replace("\n", " ")
+
+
+def humanise_column(column: str) -> str:
+	"""Turn `product_name` or SUM(`stock_count`) into a readable label."""
+	inner = re.search(r"\(([^()]*)\)", column)
+	if inner and inner.group(1).strip() not in ("", "*"):
+		column = inner.group(1)
+	column = column.split(".")[-1].strip("`\" ")
+	return column.replace("_", " ").lower()
+
+
+def markdown_table(columns: List[str], rows: List[tuple]) -> str:
+	header = "| " + " | ".join(humanise_column(c).capitalize() for c in columns) + " |"
+	divider = "| " + " | ".join("---" for _ in columns) + " |"
+	body = ["| " + " | ".join(format_value(v) for v in row) + " |" for row in rows]
+	return "\n".join([header, divider] + body)
+
+
+def render_sql_result(query: str, result: SQLResult, config: RenderConfig = None) -> Optional[str]:
+	"""
+	Render the SQL result directly, picking a template from the query shape.
+	Returns None when the result should be left to the rephrase model (errors, large or ambiguous results).
+	"""
+	config = config or RenderConfig()
+	if not config.enabled or result.error or result.truncated:
+		return None
+
+	# INSERT / UPDATE / DELETE.
+	if not result.returns_rows:
+		if result.rowcount is None or result.rowcount < 0:
+			return None
+		if result.rowcount == 0:
+			return "No records were changed, nothing matched the request."
+		return f"Done, {result.rowcount} record{'s' if result.rowcount != 1 else ''} updated."
+
+	if not result.rows:
+		return "No matching records were found."
+
+	if len(result.rows) > config.max_rows or len(result.columns) > config.max_columns:
+		return None
+	if any(len(format_value(v)) > config.max_cell_chars for row in result.rows for v in row):
+		return None
+
+	# Single value, e.g. a count or a total.
+	if len(result.rows) == 1 and len(result.columns) == 1:
+		aggregate = AGGREGATE_PATTERN.match(query)
+		template = SCALAR_TEMPLATES[aggregate.group(1).upper() if aggregate else None]
+		return template.format(label=humanise_column(result.columns[0]), value=format_value(result.rows[0][0]))
+
+	# Single column list, e.g. product names.
+	if len(result.columns) == 1:
+		label = humanise_column(result.columns[0])
+		return f"Found {len(result.rows)} {label} value{'s' if len(result.rows) != 1 else ''}:\n" + "\n".join(
+			f"- {format_value(row[0])}" for row in result.rows
+		)
+
+	return markdown_table(result.columns, result.rows)
+
+
+def render_without_llm(query: str, result: SQLResult) -> str:
+	"""Always render the result, for when the rephrase model is too busy: any size, errors included."""
+	if result.error:
+		return f"The query could not be run: {result.error}"
+	rendered = render_sql_result(query, result, RenderConfig(max_rows=result.prompt_rows, max_columns=20, max_cell_chars=500))
+	if rendered is not None:
+		return rendered
+	shown = result.rows[:result.prompt_rows]
+	more = "at least " if result.truncated else ""
+	return f"Showing {len(shown)} of {more}{len(result.rows)} rows:\n" + markdown_table(result.columns, shown)
@@ -0,0 +1,125 @@
+# Bounded SQL result handling.
+# Rows are streamed from a server-side cursor until a row or byte budget is reached, so a model generated
+# `SELECT *` over orders can not exhaust memory. The LLM only sees a compact summary (see SQLResult.summary),
+# while the fetched rows are kept for a few minutes under a handle the UI can page through.
+import contextlib
+import contextvars
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+from proj.backend.tenancy import current_store_id
+from proj.chain.tools.result_renderer import SQLResult
+
+
+@dataclass
+class ResultBudget:
+	"""How much of a result is fetched, and how much of it the LLM sees."""
+	max_rows: int = 5000
+	max_bytes: int = 2_000_000  # Approximate, from the length of the values' text.
+	summary_rows: int = 20
+	fetch_size: int = 500
+
+	@classmethod
+	def from_env(cls) -> "ResultBudget":
+		return cls(
+			max_rows=int(os.getenv("NL2SQL_RESULT_MAX_ROWS", cls.max_rows)),
+			max_bytes=int(os.getenv("NL2SQL_RESULT_MAX_BYTES", cls.max_bytes)),
+			summary_rows=int(os.getenv("NL2SQL_RESULT_SUMMARY_ROWS", cls.summary_rows)),
+		)
+
+
+def fetch_bounded(cursor, budget: ResultBudget) -> Tuple[List[tuple], bool]:
+	"""Fetch rows in chunks until the result ends or the budget is used up, returns the rows and whether it was cut."""
+	rows, size = [], 0
+	while True:
+		chunk = cursor.fetchmany(budget.fetch_size)
+		if not chunk:
+			return rows, False
+		for row in chunk:
+			size += sum(len(str(value)) for value in row) + len(row)
+			if len(rows) >= budget.max_rows or size > budget.max_bytes:
+				return rows, True
+			rows.append(tuple(row))
+
+
+# Handles of the results stashed while a job runs, see collect_result_handles.
+_result_handles: contextvars.ContextVar[Optional[List[str]]] = contextvars.ContextVar("result_handles", default=None)
+
+
+@contextlib.contextmanager
+def collect_result_handles():
+	"""Collect the handles of the results stashed in this context (e.g. one agent job), to show them in the UI."""
+	handles: List[str] = []
+	token = _result_handles.set(handles)
+	try:
+		yield handles
+	finally:
+		_result_handles.reset(token)
+
+
+class ResultStore:
+	"""Short-lived, size-bounded store of fetched results, by handle."""
+
+	def __init__(self, ttl_s: float, max_results: int):
+		self.ttl_s = ttl_s
+		self.max_results = max_results
+		# handle -> (expires, result, query, store id)
+		self._results: "OrderedDict[str, Tuple[float, SQLResult, str, int]]" = OrderedDict()
+		self._lock = threading.Lock()
+
+	def put(self, query: str, result: SQLResult) -> str:
+		handle = uuid.uuid4().hex
+		with self._lock:
+			self._prune()
+			self._results[handle] = (time.time() + self.ttl_s, result, query, current_store_id())
+			while len(self._results) > self.max_results:
+				self._results.popitem(last=False)
+		handles = _result_handles.get()
+		if handles is not None:
+			handles.append(handle)
+		return handle
+
+	def _prune(self):
+		now = time.time()
+		for handle in [handle for handle, (expires, _, _, _) in self._results.items() if expires < now]:
+			del self._results[handle]
+
+	def page(self, handle: str, offset: int = 0, limit: int = 50) -> Optional[Dict[str, Any]]:
+		"""A page of rows of a stashed result, None when the handle is unknown, expired or of another store."""
+		with self._lock:
+			self._prune()
+			entry = self._results.get(handle)
+		if entry is None or entry[3] != current_store_id():
+			return None
+		expires, result, query, _ = entry
+		offset, limit = max(offset, 0), min(max(limit, 1), 1000)
+		return {
+			"handle": handle,
+			"query": query,
+			"columns": result.columns,
+			"rows": result.rows[offset:offset + limit],
+			"offset": offset,
+			"total_rows": len(result.rows),
+			"truncated": result.truncated,
+			"expires_at": expires,
+		}
+
+
+_store: Optional[ResultStore] = None
+_store_lock = threading.Lock()
+
+
+def get_result_store() -> ResultStore:
+	global _store
+	with _store_lock:
+		if _store is None:
+			_store = ResultStore(
+				ttl_s=float(os.getenv("NL2SQL_RESULT_TTL_S", "600")),
+				max_results=int(os.getenv("NL2SQL_RESULT_MAX_HANDLES", "100")),
+			)
+		return _store
@@ -0,0 +1,171 @@
+# Schema linking for the SQL prompt.
+# Instead of the full get_table_info() (CREATE statements and sample rows of every table), the prompt gets a
+# compact snippet of the tables relevant to the question. Tables are picked by the similarity of the question to
+# precomputed embeddings of the table and column descriptions, and by keyword matches on the schema vocabulary
+# and the product names, categories and suppliers in the database. Fewer prompt tokens means faster prompt eval.
+import logging
+import os
+import re
+import threading
+import time
+from functools import lru_cache
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from sqlalchemy import MetaData, Table
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_LINK_MARGIN = float(os.getenv("SCHEMA_LINK_MARGIN", "0.05"))  # Tables this close to the best match are kept.
+SCHEMA_PRUNE_MIN_COLUMNS = int(os.getenv("SCHEMA_PRUNE_MIN_COLUMNS", "8"))  # Narrower tables keep every column.
+SCHEMA_VOCAB_TTL_S = float(os.getenv("SCHEMA_VOCAB_TTL_S", "300"))
+
+# Descriptions embedded for the similarity match, per table and column.
+TABLE_DESCRIPTIONS = {
+	"products": "Products the pharmacy stocks: medicines, prescriptions and supplements, with stock levels, suppliers and cost.",
+	"orders": "Orders placed with suppliers for products: order date, quantity ordered and the expected delivery date.",
+	"expiry": "Batches of products with their expiry date and the quantity in each batch.",
+}
+COLUMN_DESCRIPTIONS = {
+	"products.product_name": "name of the product or medicine",
+	"products.supplier": "supplier or manufacturer of the product",
+	"products.category": "category of the product, e.g. Medicine, Prescription, General",
+	"products.stock_count": "how many units are in stock, stock level",
+	"products.cost": "cost or price of one unit",
+	"products.description": "description of the product",
+	"orders.order_date": "date the order was placed",
+	"orders.quantity": "quantity ordered",
+	"orders.date_expected": "date the order is expected to arrive, delivery date",
+	"expiry.expiry_date": "date the batch expires, goes out of date",
+	"expiry.quantity": "quantity of units in the expiring batch",
+}
+# Words that link a question to a table directly.
+TABLE_KEYWORDS = {
+	"products": ("product", "products", "stock", "medicine", "medicines", "medication", "supplier", "category", "cost", "price", "reorder", "inventory"),
+	"orders": ("order", "orders", "ordered", "popular", "delivery", "deliveries", "arrive", "expected", "purchase"),
+	"expiry": ("expire", "expires", "expiring", "expiry", "expired", "batch", "batches", "out of date", "use by"),
+}
+
+HIDDEN_COLUMNS = {"store_id"}
+
+_WORD = re.compile(r"[a-z0-9]+")
+
+
+def _words(text: str) -> Set[str]:
+	return set(_WORD.findall(text.lower()))
+
+
+def _content_words(text: str) -> Set[str]:
+	# Short words ("the", "of", "mg") would match nearly every question.
+	return {word for word in _words(text) if len(word) > 3}
+
+
+class SchemaLinker:
+	"""Picks the tables relevant to a question and renders them as a compact schema snippet."""
+
+	def __init__(
+			self,
+			metadata: MetaData,
+			embeddings: Embeddings,
+			vocabulary_loader: Callable[[], Dict[str, Iterable[str]]] = None
+	):
+		self.tables: Dict[str, Table] = {name: table for name, table in metadata.tables.items() if name in TABLE_DESCRIPTIONS}
+		self.embeddings = embeddings
+		# Returns {"products": [product names, categories, suppliers...]}, values that link a question to a table.
+		self.vocabulary_loader = vocabulary_loader
+		self._vocabulary: Dict[str, Set[str]] = {}
+		self._vocabulary_loaded_at = 0.0
+		self._lock = threading.Lock()
+		# Retries and model escalation ask the same question again, its embedding is reused.
+		self._embed_query = lru_cache(maxsize=1024)(embeddings.embed_query)
+		self._description_keys, self._description_vectors = self._embed_descriptions()
+
+	def _embed_descriptions(self) -> Tuple[List[str], np.ndarray]:
+		"""Embed every table and column description once, as unit vectors."""
+		keys = list(TABLE_DESCRIPTIONS) + list(COLUMN_DESCRIPTIONS)
+		texts = [TABLE_DESCRIPTIONS.get(key) or f"{key.replace('.', ' ')}: {COLUMN_DESCRIPTIONS[key]}" for key in keys]
+		vectors = np.array(self.embeddings.embed_documents(texts), dtype=np.float32)
+		return keys, vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+	def vocabulary(self) -> Dict[str, Set[str]]:
+		"""Lower-cased words of the values per table (e.g. product names), reloaded every SCHEMA_VOCAB_TTL_S."""
+		if self.vocabulary_loader and time.time() - self._vocabulary_loaded_at > SCHEMA_VOCAB_TTL_S:
+			with self._lock:
+				if time.time() - self._vocabulary_loaded_at > SCHEMA_VOCAB_TTL_S:
+					try:
+						values = self.vocabulary_loader()
+						self._vocabulary = {
+							table: {word for value in table_values if value for word in _content_words(value)}
+							for table, table_values in values.items()
+						}
+					except Exception as e:
+						logger.warning(f"Could not load the schema vocabulary: {str(e)}")
+					self._vocabulary_loaded_at = time.time()
+		return self._vocabulary
+
+	def keyword_tables(self, question: str) -> Set[str]:
+		words, text = _words(question), question.lower()
+		tables = {
+			table for table, keywords in TABLE_KEYWORDS.items()
+			if any((keyword in text) if " " in keyword else (keyword in words) for keyword in keywords)
+		}
+		tables.update(table for table, vocabulary in self.vocabulary().items() if words & vocabulary)
+		return tables
+
+	def similarities(self, question: str) -> Dict[str, float]:
+		"""Best cosine similarity of the question to each table's description or one of its column descriptions."""
+		vector = np.array(self._embed_query(question), dtype=np.float32)
+		scores = self._description_vectors @ (vector / np.linalg.norm(vector))
+		by_table: Dict[str, float] = {}
+		for key, score in zip(self._description_keys, scores):
+			table = key.split(".")[0]
+			by_table[table] = max(by_table.get(table, -1.0), float(score))
+		return by_table
+
+	def link(self, question: str) -> List[str]:
+		"""Tables relevant to the question, plus the tables they reference (for the JOINs)."""
+		tables = self.keyword_tables(question)
+		scores = self.similarities(question)
+		if scores:
+			best = max(scores.values())
+			tables.update(table for table, score in scores.items() if score >= best - SCHEMA_LINK_MARGIN)
+
+		for table in list(tables):
+			for foreign_key in self.tables[table].foreign_keys:
+				tables.add(foreign_key.column.table.name)
+		return [table for table in self.tables if table in tables]
+
+	def render(self, tables: List[str], question: str = "") -> str:
+		"""products(id INTEGER PK, product_name VARCHAR(100), ...) per table, then the foreign keys."""
+		words = _content_words(question)
+		lines, relations = [], []
+		for name in tables:
+			table = self.tables[name]
+			# Queries are scoped to the store automatically (see backend/tenancy.py), the model never needs it.
+			columns = [column for column in table.columns if column.name not in HIDDEN_COLUMNS]
+			if len(columns) >= SCHEMA_PRUNE_MIN_COLUMNS:
+				# Wide tables keep their keys and the columns named in, or described like, the question.
+				columns = [
+					column for column in columns
+					if column.primary_key or column.foreign_keys or _content_words(column.name.replace("_", " ")) & words
+					or _content_words(COLUMN_DESCRIPTIONS.get(f"{name}.{column.name}", "")) & words
+				]
+			rendered = []
+			for column in columns:
+				flags = " PK" if column.primary_key else ""
+				rendered.append(f"{column.name} {column.type}{flags}")
+				for foreign_key in column.foreign_keys:
+					relations.append(f"{name}.{column.name} -> {foreign_key.column.table.name}.{foreign_key.column.name}")
+			lines.append(f"{name}({', '.join(rendered)})")
+		if relations:
+			lines.append("Foreign keys: " + "; ".join(relations))
+		return "\n".join(lines)
+
+	def schema_for(self, question: str) -> Optional[str]:
+		"""The compact schema for the question, None when nothing could be linked (use the full schema)."""
+		tables = self.link(question)
+		if not tables:
+			return None
+		return self.render(tables, question)
+
@@ -4,13 +4,76 @@ import os
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
 import os
 # os.chdir("C:\Fast Coding Projects [Memory Critical]\GemmaCompetitionProcurementManagement")
+import json
+import uuid
+import threading
+import requests
 import streamlit as st
-from proj.chain.lc_agent import execute_agent_tools
+from data_access import prefetch_all, STORE_HEADERS
 os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = "C:\Fast Coding Projects [Memory Critical]\GemmaCompetitionProcurementManagement\proj\chain\secrets\gemma-competition-da8786b08cd5.json"
 
 
 st.set_page_config(layout="wide")
 
+# The agent runs in its own service (proj/chain/agent_service.py), this page is only a thin client.
+AGENT_SERVICE_URL = os.getenv("AGENT_SERVICE_URL", "http://127.0.0.1:5001")
+
+
+def ask_agent(prompt: str, session_id: str) -> dict:
+    """Queue the prompt on the agent service and wait for the answer over server-sent events."""
+    try:
+        response = requests.post(
+            f"{AGENT_SERVICE_URL}/jobs",
+            json={"prompt": prompt, "session_id": session_id, "priority": "interactive"},
+            headers=STORE_HEADERS,
+            timeout=10,
+        )
+        if response.status_code == 429:
+            return {"output": "The assistant is busy with other requests, please try again in a moment.", "error": True}
+        response.raise_for_status()
+        job = response.json()
+
+        # If this script run stops (rerun or closed tab), the stream closes and the service cancels the job.
+        with requests.get(
+            f"{AGENT_SERVICE_URL}/jobs/{job['job_id']}/events", headers=STORE_HEADERS, stream=True, timeout=(10, 60)
+        ) as events:
+            for line in events.iter_lines(decode_unicode=True):
+                if line and line.startswith("data: "):
+                    job = json.loads(line[len("data: "):])
+                    if job["status"] in ("done", "failed", "cancelled", "expired"):
+                        break
+    except requests.RequestException as e:
+        return {"output": f"Could not reach the assistant service. Error: {e}", "error": True}
+
+    if job["status"] == "done" or job.get("output"):
+        return {"output": job["output"], "result_handles": job.get("result_handles") or []}
+    return {"output": f"I'm having trouble processing that request ({job['status']}). Could you please try again?", "error": True}
+
+
+RESULT_PAGE_SIZE = 100
+
+
+def show_result_pages(handle: str):
+    """Page through a large SQL result the agent only summarised."""
+    with st.expander("View full result"):
+        page = st.number_input("Page", min_value=1, value=1, step=1, key=f"page_{handle}")
+        try:
+            response = requests.get(
+                f"{AGENT_SERVICE_URL}/results/{handle}",
+                params={"offset": (page - 1) * RESULT_PAGE_SIZE, "limit": RESULT_PAGE_SIZE},
+                headers=STORE_HEADERS,
+                timeout=10,
+            )
+        except requests.RequestException:
+            st.error("Could not reach the assistant service.")
+            return
+        if response.status_code == 404:
+            st.caption("This result has expired.")
+            return
+        result = response.json()
+        st.dataframe([dict(zip(result["columns"], row)) for row in result["rows"]])
+        more = " (the query returned more, only these were fetched)" if result["truncated"] else ""
+        st.caption(f"{result['total_rows']} rows{more}")
 
 
 # Chatbot page..
@@ -36,10 +99,18 @@ with st.chat_message("system"):
 for message in st.session_state.messages:
     with st.chat_message(message["role"]):
         st.markdown(message["content"])
+        for handle in message.get("result_handles", []):
+            show_result_pages(handle)
 
 
-if "chat_history" not in st.session_state:
-    st.session_state.chat_history = []
+# Warm the Inventory / Orders / Expiry caches in the background, so those pages open instantly.
+if "prefetched" not in st.session_state:
+    st.session_state.prefetched = True
+    threading.Thread(target=prefetch_all, daemon=True).start()
+
+# The agent service keeps the (bounded) chat history per session id.
+if "session_id" not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
 
 prompt = st.chat_input("Please enter your prompt here:")
 
@@ -51,13 +122,13 @@ if prompt:
 
     # Process the prompt with chat history
     with st.spinner("Processing your request..."):
-        response = execute_agent_tools(prompt, st.session_state.chat_history)
-
-    # Update chat history
-    st.session_state.chat_history.append({"role": "user", "content": prompt})
-    st.session_state.chat_history.append({"role": "assistant", "content": response['output']})
+        response = ask_agent(prompt, st.session_state.session_id)
 
     # Add assistant's response to messages
     with st.chat_message("assistant"):
         st.markdown(response['output'])
-    st.session_state.messages.append({"role": "assistant", "content": response['output']})
\ No newline at end of file
+        for handle in response.get("result_handles", []):
+            show_result_pages(handle)
+    st.session_state.messages.append({
+        "role": "assistant", "content": response['output'], "result_handles": response.get("result_handles", [])
+    })
\ No newline at end of file
@@ -0,0 +1,155 @@
+# Shared data access for the Streamlit pages.
+# One pooled (keep-alive) HTTP session per process, responses cached with a TTL,
+# and revalidated with the backend's ETag once the TTL runs out, so an unchanged table is not downloaded again.
+# Live pages keep their rows in the session and apply the backend's change feed on top (see load_live_dataset).
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Tuple
+
+import requests
+import streamlit as st
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+BACKEND_URL = os.getenv("BACKEND_URL", "http://127.0.0.1:5000").rstrip("/")
+CACHE_TTL_S = int(os.getenv("FRONTEND_CACHE_TTL_S", "30"))
+REQUEST_TIMEOUT = (3.05, 15)  # (connect, read) seconds
+LIVE_REFRESH_S = float(os.getenv("FRONTEND_LIVE_REFRESH_S", "5"))
+# The branch this UI serves, sent on every backend and agent request (see backend/tenancy.py).
+STORE_ID = os.getenv("STORE_ID", "")
+STORE_HEADERS = {"X-Store-Id": STORE_ID} if STORE_ID else {}
+
+DATASETS = ("inventory", "orders", "expiry")
+# Change feed table and row key per dataset, see backend/change_feed.py
+DATASET_TABLES = {"inventory": ("products", "id"), "orders": ("orders", "order_id"), "expiry": ("expiry", "batch_id")}
+
+# Last ETag, body and change seq per path, used to revalidate after the cache TTL has expired.
+_validators: Dict[str, Tuple[str, Any, int]] = {}
+_validators_lock = threading.Lock()
+
+
+@st.cache_resource
+def get_http_session() -> requests.Session:
+	"""Pooled keep-alive session shared by every page and session of this Streamlit process."""
+	session = requests.Session()
+	adapter = HTTPAdapter(
+		pool_connections=4,
+		pool_maxsize=16,
+		max_retries=Retry(total=2, backoff_factor=0.2, allowed_methods=["GET"], status_forcelist=[502, 503, 504]),
+	)
+	session.mount("http://", adapter)
+	session.mount("https://", adapter)
+	session.headers.update(STORE_HEADERS)
+	return session
+
+
+def get_json_with_seq(path: str) -> Tuple[Any, int]:
+	"""
+	GET a backend path, sending the last ETag so an unchanged resource comes back as 304 without a body.
+	Also returns the change feed seq the data is current to (X-Change-Seq, 0 when the endpoint has none).
+	"""
+	headers = {}
+	with _validators_lock:
+		cached = _validators.get(path)
+	if cached:
+		headers["If-None-Match"] = cached[0]
+
+	response = get_http_session().get(f"{BACKEND_URL}/{path}", headers=headers, timeout=REQUEST_TIMEOUT)
+	if response.status_code == 304 and cached:
+		# Unchanged since the cached body, so the newer seq applies to it as well.
+		return cached[1], int(response.headers.get("X-Change-Seq", cached[2]))
+	response.raise_for_status()
+
+	data = response.json()
+	seq = int(response.headers.get("X-Change-Seq", 0))
+	etag = response.headers.get("ETag")
+	if etag:
+		with _validators_lock:
+			_validators[path] = (etag, data, seq)
+	return data, seq
+
+
+def get_json(path: str) -> Any:
+	return get_json_with_seq(path)[0]
+
+
+@st.cache_data(ttl=CACHE_TTL_S, show_spinner=False)
+def fetch_snapshot(name: str) -> dict:
+	"""Inventory, orders or expiry rows and their change seq, cached for CACHE_TTL_S seconds across reruns and sessions."""
+	rows, seq = get_json_with_seq(name)
+	return {"rows": rows, "seq": seq}
+
+
+def fetch_dataset(name: str) -> list:
+	return fetch_snapshot(name)["rows"]
+
+
+@st.cache_data(ttl=CACHE_TTL_S, show_spinner=False)
+def fetch_report(name: str) -> dict:
+	"""Latest precomputed report snapshot (expiring_7/30/90, expired, low_stock) from the backend scheduler."""
+	return get_json(f"reports/{name}")
+
+
+def prefetch_all() -> None:
+	"""Fetch all datasets in parallel, so the pages open from the cache."""
+	def fetch(name: str):
+		try:
+			fetch_snapshot(name)
+		except requests.RequestException as e:
+			logger.warning(f"Prefetch of {name} failed: {e}")
+
+	with ThreadPoolExecutor(max_workers=len(DATASETS)) as pool:
+		list(pool.map(fetch, DATASETS))
+
+
+def _load_live_state(name: str, refetch: bool = False) -> dict:
+	if refetch:
+		# The cached snapshot is older than the change, drop it for every session.
+		fetch_snapshot.clear()
+	snapshot = fetch_snapshot(name)
+	key = DATASET_TABLES[name][1]
+	state = {"rows": {row[key]: row for row in snapshot["rows"]}, "seq": snapshot["seq"]}
+	st.session_state[f"live_{name}"] = state
+	return state
+
+
+def load_live_dataset(name: str) -> list:
+	"""
+	Dataset rows kept in the session and brought up to date with the backend's change feed on every rerun,
+	so a page refreshing every few seconds only transfers the rows that changed.
+	"""
+	table, key = DATASET_TABLES[name]
+	state = st.session_state.get(f"live_{name}") or _load_live_state(name)
+
+	response = get_http_session().get(
+		f"{BACKEND_URL}/changes",
+		params={"since": state["seq"], "format": "json", "table": table},
+		timeout=REQUEST_TIMEOUT
+	)
+	response.raise_for_status()
+	feed = response.json()
+
+	if feed["reset"] or any(event["op"] == "invalidate" for event in feed["events"]):
+		state = _load_live_state(name, refetch=True)
+	else:
+		for event in feed["events"]:
+			row = event["row"]
+			if event["op"] == "delete":
+				state["rows"].pop(row[key], None)
+			else:
+				# Keep columns the event does not carry (e.g. a joined product_name).
+				state["rows"][row[key]] = {**state["rows"].get(row[key], {}), **row}
+		# The feed's seq is read with the events, so every event up to it is applied.
+		state["seq"] = feed["seq"]
+	return list(state["rows"].values())
+
+
+def live_fragment(fn):
+	"""Rerun just this part of the page every LIVE_REFRESH_S seconds (needs st.fragment, Streamlit 1.37+)."""
+	if hasattr(st, "fragment"):
+		return st.fragment(run_every=LIVE_REFRESH_S)(fn)
+	return fn
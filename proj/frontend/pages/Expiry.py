@@ -1,24 +1,51 @@
 import requests
 import streamlit as st
+from data_access import load_live_dataset, live_fragment, fetch_report
 
+REPORT_LABELS = {
+    "expiring_7": "Expiring in the next 7 days",
+    "expiring_30": "Expiring in the next 30 days",
+    "expiring_90": "Expiring in the next 90 days",
+    "expired": "Expired",
+}
 
+
+@live_fragment
 def load_expiry():
 
-    # Flask API URL for expiry endpoint
-    flask_api_url = "http://127.0.0.1:5000/expiry"
-    response = requests.get(flask_api_url)
+    # Kept up to date with the backend change feed, see data_access.py
+    try:
+        expiry_data = load_live_dataset("expiry")
+    except requests.RequestException:
+        st.error("Failed to fetch expiry data from Flask backend.")
+        return
 
-    if response.status_code == 200:
-        expiry_data = response.json()
-        if expiry_data:
-            st.dataframe(expiry_data)
-        else:
-            st.write("No expiry data found.")
+    if expiry_data:
+        st.dataframe(expiry_data)
     else:
-        st.error("Failed to fetch expiry data from Flask backend.")
+        st.write("No expiry data found.")
+
+
+def load_expiry_report():
+
+    # Precomputed by the backend report scheduler, so this is instant.
+    name = st.selectbox("Report", list(REPORT_LABELS), format_func=REPORT_LABELS.get, index=1)
+    try:
+        report = fetch_report(name)
+    except requests.RequestException:
+        st.error("Failed to fetch the expiry report from Flask backend.")
+        return
+
+    st.caption(f"Generated at {report['generated_at']}")
+    if report["rows"]:
+        st.dataframe(report["rows"])
+    else:
+        st.write("No batches in this report.")
 
 
 # Streamlit layout for expiry
 st.header("Product Expiry")
+st.subheader("Expiry reports")
+load_expiry_report()
 st.subheader("View batch expiry details")
 load_expiry()
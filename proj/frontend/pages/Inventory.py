@@ -1,21 +1,21 @@
 import requests
-import os
 import streamlit as st
+from data_access import load_live_dataset, live_fragment
 
 
+@live_fragment
 def load_inventory():
 
-    flask_api_url = "http://127.0.0.1:5000/inventory"
-    response = requests.get(flask_api_url)
+    try:
+        inventory_data = load_live_dataset("inventory")
+    except requests.RequestException:
+        st.error("Failed to fetch inventory data from Flask backend.")
+        return
 
-    if response.status_code == 200:
-        inventory_data = response.json()
-        if inventory_data:
-            st.dataframe(inventory_data)
-        else:
-            st.write("No inventory data found.")
+    if inventory_data:
+        st.dataframe(inventory_data)
     else:
-        st.error("Failed to fetch inventory data from Flask backend.")
+        st.write("No inventory data found.")
 
 
 st.header("Inventory")
@@ -1,24 +1,23 @@
 import requests
-import os
 import streamlit as st
-import datetime
+from data_access import load_live_dataset, live_fragment
 
 
+@live_fragment
 def load_orders():
 
-    flask_api_url = "http://127.0.0.1:5000/orders"
-    response = requests.get(flask_api_url)
+    try:
+        orders_data = load_live_dataset("orders")
+    except requests.RequestException:
+        st.error("Failed to fetch orders data from Flask backend.")
+        return
 
-    if response.status_code == 200:
-        orders_data = response.json()
-        if orders_data:
-            st.dataframe(orders_data)
-        else:
-            st.write("No order data found.")
+    if orders_data:
+        st.dataframe(orders_data)
     else:
-        st.error("Failed to fetch orders data from Flask backend.")
+        st.write("No order data found.")
 
 
 st.header("Orders")
 st.subheader("View current orders")
-load_orders()
\ No newline at end of file
+load_orders()
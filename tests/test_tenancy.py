@@ -0,0 +1,103 @@
+# Tests of scope_sql, the rewrite that keeps NL2SQL statements to one store's rows.
+# Run from the repository root: python -m pytest tests
+import re
+
+import pytest
+
+from proj.backend.tenancy import TenantError, scope_sql
+
+STORE = 3
+
+
+def scoped(table: str, alias: str = None) -> str:
+	return f"(SELECT * FROM `{table}` WHERE `store_id` = {STORE}) AS `{alias or table}`"
+
+
+def unscoped_names(statement: str) -> list:
+	"""Tenant table names in the statement that are not inside a store scoped derived table."""
+	stripped = re.sub(r"\(SELECT \* FROM `\w+` WHERE `store_id` = \d+\)", "", statement)
+	return re.findall(r"(?<![\w`])(?:products|orders|expiry)(?![\w`])", stripped)
+
+
+def test_select_is_scoped():
+	assert scope_sql("SELECT product_name FROM products WHERE stock_count < 20;", STORE) == (
+		f"SELECT product_name FROM {scoped('products')} WHERE stock_count < 20"
+	)
+
+
+def test_aliases_and_qualifiers_are_kept():
+	statement = scope_sql(
+		"SELECT orders.order_id, p.product_name FROM orders JOIN products AS p ON p.id = orders.product_id", STORE
+	)
+	assert statement == (
+		f"SELECT orders.order_id, p.product_name FROM {scoped('orders')} JOIN {scoped('products', 'p')} "
+		"ON p.id = orders.product_id"
+	)
+
+
+@pytest.mark.parametrize("join", [
+	"JOIN", "INNER JOIN", "LEFT JOIN", "LEFT OUTER JOIN", "RIGHT JOIN", "CROSS JOIN", "NATURAL JOIN",
+	"STRAIGHT_JOIN", "straight_join",
+])
+def test_every_join_form_is_scoped(join):
+	statement = scope_sql(f"SELECT o.order_id FROM orders o {join} products p ON p.id = o.product_id", STORE)
+	assert f"{join} {scoped('products', 'p')}" in statement
+	assert f"FROM {scoped('orders', 'o')}" in statement
+
+
+def test_subqueries_are_scoped():
+	statement = scope_sql(
+		"SELECT product_name FROM products WHERE id IN (SELECT product_id FROM expiry WHERE expiry_date < CURDATE())",
+		STORE
+	)
+	assert unscoped_names(statement) == []
+	assert scoped("expiry") in statement
+
+
+@pytest.mark.parametrize("literal", [
+	"'%from orders%'", '"%from orders%"', "'it''s from orders'", "'it\\'s from orders'", "'join products p'",
+])
+def test_string_literals_are_not_rewritten(literal):
+	statement = scope_sql(f"SELECT product_name FROM products WHERE description LIKE {literal}", STORE)
+	assert statement == f"SELECT product_name FROM {scoped('products')} WHERE description LIKE {literal}"
+
+
+def test_comments_do_not_hide_references():
+	statement = scope_sql("SELECT 1 -- it's\nFROM orders", STORE)
+	assert scoped("orders") in statement
+	assert unscoped_names(statement) == []
+
+
+@pytest.mark.parametrize("query", [
+	"SELECT * FROM orders, products",  # comma join
+	"SELECT * FROM shop.orders",  # schema qualified
+	"SELECT * FROM `shop`.`orders`",
+	"SELECT * FROM (orders)",
+	"WITH orders AS (SELECT * FROM products) SELECT * FROM orders",
+	"SELECT /*! * FROM orders */ 1",  # executable comment
+	"SELECT * FROM products WHERE name = 'unterminated",
+	"INSERT INTO orders (product_id, quantity) VALUES ((SELECT id FROM products LIMIT 1), 2)",
+])
+def test_unscopable_statements_are_refused(query):
+	with pytest.raises(TenantError):
+		scope_sql(query, STORE)
+
+
+def test_update_and_delete_are_scoped():
+	assert scope_sql("UPDATE products SET stock_count = 5 WHERE product_name = 'from orders'", STORE) == (
+		f"UPDATE products SET stock_count = 5 WHERE `store_id` = {STORE} AND (product_name = 'from orders')"
+	)
+	assert scope_sql("DELETE FROM expiry WHERE expiry_date < '2024-01-01'", STORE) == (
+		f"DELETE FROM expiry WHERE `store_id` = {STORE} AND (expiry_date < '2024-01-01')"
+	)
+
+
+def test_insert_gets_the_store():
+	assert scope_sql("INSERT INTO orders (product_id, quantity) VALUES (1, 2), (3, 4)", STORE) == (
+		f"INSERT INTO `orders` (product_id, quantity, `store_id`) VALUES (1, 2, {STORE}), (3, 4, {STORE})"
+	)
+
+
+def test_writes_must_not_set_the_store():
+	with pytest.raises(TenantError):
+		scope_sql("UPDATE products SET store_id = 1", STORE)